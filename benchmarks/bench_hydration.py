@@ -0,0 +1,66 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Compares hydration throughput of the constructor path (a dict per row
+passed through cls(**data)) against the precompiled hydration plan.
+
+    python benchmarks/bench_hydration.py [rows]
+'''
+
+import os
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in (_HERE, os.path.dirname(_HERE)):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from sqlbricks.postgresql.dao import BaseDAO, Field
+
+class Wide(BaseDAO):
+    __table__ = 'wide'
+    name = Field()
+    email = Field()
+    age = Field()
+    score = Field()
+    created = Field()
+    active = Field()
+
+def make_rows(count):
+    description = [(x, None, None, None, None, None, None)
+                   for x in sorted(Wide._fields)]
+    rows = [(True, 30 + i % 40, u'2013-03-17', u'u%d@example.com' % i, i,
+             u'user %d' % i, i * 0.5) for i in range(count)]
+    return description, rows
+
+def constructor_path(description, rows):
+    return [Wide(__conn__=None, **Wide.row_to_dict(description, row))
+            for row in rows]
+
+def plan_path(description, rows):
+    return Wide.from_rows(description, rows, None)
+
+def measure(func, description, rows, repeat=5):
+    best = None
+    for _ in range(repeat):
+        started = time.time()
+        func(description, rows)
+        elapsed = time.time() - started
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(rows) / best
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 100000
+    description, rows = make_rows(count)
+    before = measure(constructor_path, description, rows)
+    after = measure(plan_path, description, rows)
+    print 'constructor: {0:12.0f} objects/sec'.format(before)
+    print 'plan:        {0:12.0f} objects/sec'.format(after)
+    print 'speedup:     {0:12.2f}x'.format(after / before)
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,59 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Compares the memory taken per hydrated object by the default
+__dict__ layout and the compact __slots__ layout.
+
+    python benchmarks/bench_memory.py [rows]
+'''
+
+import os
+import sys
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in (_HERE, os.path.dirname(_HERE)):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from sqlbricks.postgresql.dao import BaseDAO, Field
+
+from bench_hydration import Wide, make_rows
+
+class CompactWide(BaseDAO):
+    __table__ = 'wide'
+    __compact__ = True
+    name = Field()
+    email = Field()
+    age = Field()
+    score = Field()
+    created = Field()
+    active = Field()
+
+def bytes_per_object(objects):
+    """
+    Sums the sizes of the containers each object owns:
+    the instance itself, its __dict__ and its __changed__ set.
+    Column values are shared with the rows and not counted.
+    """
+    total = 0
+    for obj in objects:
+        total += sys.getsizeof(obj)
+        if hasattr(obj, '__dict__'):
+            total += sys.getsizeof(obj.__dict__)
+        total += sys.getsizeof(obj.__changed__)
+    return float(total) / len(objects)
+
+def main(argv):
+    count = int(argv[1]) if len(argv) > 1 else 10000
+    description, rows = make_rows(count)
+    plain = bytes_per_object(Wide.from_rows(description, rows, None))
+    compact = bytes_per_object(CompactWide.from_rows(description, rows,
+                                                     None))
+    print 'dict layout:  {0:8.1f} bytes/object'.format(plain)
+    print 'slots layout: {0:8.1f} bytes/object'.format(compact)
+    print 'ratio:        {0:8.2f}x'.format(plain / compact)
+
+if __name__ == '__main__':
+    main(sys.argv)
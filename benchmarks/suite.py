@@ -0,0 +1,251 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Benchmark suite for the hot paths: query building and rendering,
+persistent query derivation, Expression chains and membership tests,
+hydration, columnar export and memory per object. Results are
+written as JSON so that runs on different commits can be compared.
+
+    python benchmarks/suite.py [--quick] [--output FILE]
+                               [--compare BASELINE] [--threshold 0.1]
+
+With --compare the exit status is 1 when a benchmark got slower
+(or bigger) than the baseline by more than the threshold.
+
+The script can be run from anywhere: it puts the source tree it is
+part of on sys.path. Queries run against the fake connection of the
+test suite (sqlbricks.test.fakedb), so no database is needed.
+'''
+
+import json
+import optparse
+import os
+import platform
+import subprocess
+import sys
+import time
+
+_HERE = os.path.dirname(os.path.abspath(__file__))
+for _path in (_HERE, os.path.dirname(_HERE)):
+    if _path not in sys.path:
+        sys.path.insert(0, _path)
+
+from sqlbricks.postgresql.sql import Select, Insert, Update, Delete
+from sqlbricks.test.fakedb import FakeConnection
+
+from bench_hydration import Wide, make_rows
+from bench_memory import CompactWide, bytes_per_object
+
+USAGE = ('%prog [--quick] [--output FILE] [--compare BASELINE] '
+         '[--threshold 0.1]')
+
+CLAUSE_COUNTS = (1, 5, 20)
+MEMBERSHIP_SIZES = (10, 500, 50000)
+
+def build_select(clauses):
+    statement = Select()
+    statement.add_fields(*[u'f{0}'.format(i) for i in range(clauses)])
+    statement.add_from(u't')
+    for i in range(clauses):
+        statement.add_where(u'f{0} = %(p{0})s'.format(i))
+        statement.bound_parameters[u'p{0}'.format(i)] = i
+    statement.add_order(u'f0')
+    statement.add_limit(10)
+    return unicode(statement)
+
+def build_insert(clauses):
+    statement = Insert(u't')
+    statement.add_values(**dict((u'f{0}'.format(i), i)
+                                for i in range(clauses)))
+    statement.add_returning(u'id')
+    return unicode(statement)
+
+def build_insert_rows(clauses):
+    statement = Insert(u't')
+    statement.add_rows(*[{u'a': i, u'b': i} for i in range(clauses)])
+    return unicode(statement)
+
+def build_update(clauses):
+    statement = Update(u't')
+    statement.add_set(**dict((u'f{0}'.format(i), i)
+                             for i in range(clauses)))
+    statement.add_where(u'id = %(id)s')
+    return unicode(statement)
+
+def build_delete(clauses):
+    statement = Delete(u't')
+    for i in range(clauses):
+        statement.add_where(u'f{0} = %(p{0})s'.format(i))
+    return unicode(statement)
+
+def persistent_select(clauses):
+    statement = Select().persistent()
+    statement = statement.add_fields(*[u'f{0}'.format(i)
+                                       for i in range(clauses)])
+    statement = statement.add_from(u't')
+    for i in range(clauses):
+        statement = statement.add_where(u'f{0} = %(p{0})s'.format(i))
+    return statement
+
+_BASES = dict((x, persistent_select(x)) for x in CLAUSE_COUNTS)
+
+def derive_select(clauses):
+    return unicode(_BASES[clauses].add_where(u'extra'))
+
+def expression_chain(length):
+    expr = Wide.age
+    for i in range(length):
+        expr = (expr + i) * 2
+    return unicode(expr == Wide.score)
+
+
+def membership(size):
+    return Wide.id.in_(range(size)).bind({})
+
+
+def measure(func, arg, min_time):
+    """
+    Runs func(arg) repeatedly for at least min_time seconds,
+    three times, and keeps the best rate.
+    """
+    best = 0.0
+    for _ in range(3):
+        count = 0
+        started = time.time()
+        elapsed = 0.0
+        while elapsed < min_time:
+            for _ in range(10):
+                func(arg)
+            count += 10
+            elapsed = time.time() - started
+        best = max(best, count / elapsed)
+    return best
+
+
+def hydration_benchmarks(rows, min_time):
+    description, data = make_rows(rows)
+    columns = [x[0] for x in description]
+    conn = FakeConnection(lambda sql, params: (columns, data))
+    def from_cursor(cls):
+        cur = conn.cursor()
+        cur.execute(u'SELECT', None)
+        return cls.from_cursor(cur, None)
+    def collection(cls):
+        return list(cls.load_by(conn).stream(itersize=1000))
+    results = {}
+    for name, func in (('from_cursor', from_cursor),
+                       ('collection', collection)):
+        for cls in (Wide, CompactWide):
+            rate = measure(func, cls, min_time) * rows
+            results['hydrate.{0}[{1}]'.format(name, cls.__name__)] = \
+                {'value': rate, 'unit': 'objects/s', 'higher_is_better': True}
+    def to_columns(cls):
+        return cls.load_by(conn).to_columns(use_numpy=False)
+    results['columns.to_columns'] = \
+        {'value': measure(to_columns, Wide, min_time) * rows,
+         'unit': 'rows/s', 'higher_is_better': True}
+    return results
+
+def memory_benchmarks(rows):
+    description, data = make_rows(rows)
+    results = {}
+    for cls in (Wide, CompactWide):
+        size = bytes_per_object(cls.from_rows(description, data, None))
+        results['memory.per_object[{0}]'.format(cls.__name__)] = \
+            {'value': size, 'unit': 'bytes', 'higher_is_better': False}
+    return results
+
+def run(quick=False):
+    min_time = 0.05 if quick else 0.3
+    rows = 1000 if quick else 20000
+    results = {}
+    builders = (('select', build_select), ('insert', build_insert),
+                ('insert_rows', build_insert_rows), ('update', build_update),
+                ('delete', build_delete))
+    for name, func in builders:
+        for clauses in CLAUSE_COUNTS:
+            results['build.{0}[{1}]'.format(name, clauses)] = \
+                {'value': measure(func, clauses, min_time),
+                 'unit': 'ops/s', 'higher_is_better': True}
+    for clauses in CLAUSE_COUNTS:
+        results['derive.select[{0}]'.format(clauses)] = \
+            {'value': measure(derive_select, clauses, min_time),
+             'unit': 'ops/s', 'higher_is_better': True}
+    for length in CLAUSE_COUNTS:
+        results['expression.chain[{0}]'.format(length)] = \
+            {'value': measure(expression_chain, length, min_time),
+             'unit': 'ops/s', 'higher_is_better': True}
+    for size in MEMBERSHIP_SIZES:
+        results['expression.in_[{0}]'.format(size)] = \
+            {'value': measure(membership, size, min_time),
+             'unit': 'ops/s', 'higher_is_better': True}
+    results.update(hydration_benchmarks(rows, min_time))
+    results.update(memory_benchmarks(rows))
+    return results
+
+def metadata():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+                                         stderr=subprocess.STDOUT).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+            'commit': commit,
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'machine': platform.machine(),
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            }
+
+def compare(results, baseline, threshold):
+    """
+    @return: list of (name, baseline value, value, change, regressed)
+    """
+    report = []
+    for name in sorted(results):
+        if name not in baseline:
+            continue
+        old = baseline[name]['value']
+        new = results[name]['value']
+        if not old:
+            continue
+        change = (new - old) / old
+        if results[name]['higher_is_better']:
+            regressed = change < -threshold
+        else:
+            regressed = change > threshold
+        report.append((name, old, new, change, regressed))
+    return report
+
+def main(argv):
+    parser = optparse.OptionParser(usage=USAGE)
+    parser.add_option('--quick', action='store_true', default=False)
+    parser.add_option('--output', default=None)
+    parser.add_option('--compare', default=None)
+    parser.add_option('--threshold', type='float', default=0.1)
+    options, _ = parser.parse_args(argv[1:])
+    document = {'meta': metadata(), 'results': run(options.quick)}
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if options.output:
+        with open(options.output, 'w') as out:
+            out.write(text + '\n')
+    else:
+        print text
+    if options.compare:
+        with open(options.compare) as source:
+            baseline = json.load(source)['results']
+        status = 0
+        for name, old, new, change, regressed in \
+                compare(document['results'], baseline, options.threshold):
+            mark = 'REGRESSION' if regressed else ''
+            print >> sys.stderr, '{0:45} {1:14.1f} {2:14.1f} {3:+7.1%} {4}'.\
+                format(name, old, new, change, mark)
+            if regressed:
+                status = 1
+        return status
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv))
@@ -0,0 +1,82 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from collections import OrderedDict
+import threading
+
+class LRUCache(object):
+    """
+    A small thread-safe least-recently-used mapping which keeps
+    track of its hit and miss counts.
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.RLock()
+
+    def get(self, key, default=None):
+        """
+        Look the key up, marking it as the most recently used one.
+        """
+        with self._lock:
+            try:
+                value = self._data.pop(key)
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data[key] = value
+            self.hits += 1
+            return value
+
+    def put(self, key, value):
+        """
+        Store a value, evicting the least recently used entries
+        if the cache grows over its size. Returns the list of
+        evicted (key, value) pairs.
+        """
+        evicted = []
+        with self._lock:
+            self._data.pop(key, None)
+            self._data[key] = value
+            while self.maxsize is not None and len(self._data) > self.maxsize:
+                evicted.append(self._data.popitem(last=False))
+                self.evictions += 1
+        return evicted
+
+    def pop(self, key, default=None):
+        with self._lock:
+            return self._data.pop(key, default)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def reset_stats(self):
+        with self._lock:
+            self.hits = self.misses = self.evictions = 0
+
+    def stats(self):
+        """
+        @return: dict with hits, misses, evictions, size and maxsize
+        """
+        with self._lock:
+            return {
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions,
+                    'size': len(self._data),
+                    'maxsize': self.maxsize,
+                    }
+
+    def __contains__(self, key):
+        return key in self._data
+
+    def __len__(self):
+        return len(self._data)
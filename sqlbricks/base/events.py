@@ -0,0 +1,211 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Instrumentation hooks.
+
+A hook is a callable taking an L{Event}. Hooks are registered
+process-wide with register() and receive these events:
+
+  render          a query was rendered
+  before_execute  a statement is about to be sent
+  after_execute   the statement returned (or failed, see error)
+  rows_fetched    rows were fetched from a cursor
+  hydrate_start   objects are about to be made from rows
+  hydrate_end     objects were made
+  membership      an in_() or not_in() test was built (rows is the
+                  number of values; strategy and negated are in extra)
+
+Call sites check the module-level hooks list before building an
+event, so instrumentation costs nothing while no hook is registered.
+'''
+
+from collections import deque
+import re
+import threading
+import time
+
+hooks = []
+
+def register(hook):
+    """
+    Adds a hook; registering the same hook twice has no effect.
+    """
+    if hook not in hooks:
+        hooks.append(hook)
+    return hook
+
+def unregister(hook):
+    if hook in hooks:
+        hooks.remove(hook)
+
+
+class Event(object): #IGNORE:R0903
+    """
+    What happened, with the rendered SQL, the number of bound
+    parameters, the DAO class involved, the number of rows, the
+    wall-clock start time and the duration in seconds, where these
+    apply. Anything else is in extra.
+    """
+    __slots__ = ('name', 'sql', 'parameters', 'dao', 'rows', 'started',
+                 'duration', 'error', 'extra')
+
+    def __init__(self, name, sql=None, parameters=None, dao=None, #IGNORE:R0913
+                 rows=None, started=None, duration=None, error=None,
+                 **extra):
+        self.name = name
+        self.sql = sql
+        self.parameters = parameters
+        self.dao = dao
+        self.rows = rows
+        self.started = started
+        self.duration = duration
+        self.error = error
+        self.extra = extra
+
+    def __repr__(self):
+        return '<Event {0} {1!r} {2}s>'.format(self.name, self.sql,
+                                               self.duration)
+
+
+def emit(name, **kwargs):
+    """
+    Sends an event to every hook. Callers should check hooks first.
+    """
+    event = Event(name, **kwargs)
+    for hook in list(hooks):
+        hook(event)
+    return event
+
+
+def execute(cursor, statement, dao=None):
+    """
+    Runs a statement on a cursor, emitting before_execute and
+    after_execute around it when hooks are registered.
+    """
+    sql = unicode(statement)
+    params = statement.bound_parameters
+    if not hooks:
+        return cursor.execute(sql, params)
+    count = len(params) if params else 0
+    emit('before_execute', sql=sql, parameters=count, dao=dao)
+    started = time.time()
+    try:
+        result = cursor.execute(sql, params)
+    except Exception as exc:
+        emit('after_execute', sql=sql, parameters=count, dao=dao,
+             started=started, duration=time.time() - started, error=exc)
+        raise
+    emit('after_execute', sql=sql, parameters=count, dao=dao,
+         started=started, duration=time.time() - started,
+         rows=getattr(cursor, 'rowcount', None))
+    return result
+
+
+def executemany(cursor, statement, seq_of_parameters, dao=None):
+    """
+    Runs a statement once for each set of parameters with the
+    cursor's executemany(), emitting the same events as L{execute};
+    their batch entry in extra is the number of parameter sets.
+    """
+    sql = unicode(statement)
+    if not hooks:
+        return cursor.executemany(sql, seq_of_parameters)
+    seq_of_parameters = list(seq_of_parameters)
+    count = len(seq_of_parameters[0]) if seq_of_parameters else 0
+    batch = len(seq_of_parameters)
+    emit('before_execute', sql=sql, parameters=count, dao=dao, batch=batch)
+    started = time.time()
+    try:
+        result = cursor.executemany(sql, seq_of_parameters)
+    except Exception as exc:
+        emit('after_execute', sql=sql, parameters=count, dao=dao,
+             started=started, duration=time.time() - started, error=exc,
+             batch=batch)
+        raise
+    emit('after_execute', sql=sql, parameters=count, dao=dao,
+         started=started, duration=time.time() - started,
+         rows=getattr(cursor, 'rowcount', None), batch=batch)
+    return result
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_SPACES = re.compile(r'\s+')
+
+def fingerprint(sql):
+    """
+    Normalises a statement so that statements differing only
+    in whitespace or inline literal values look the same.
+    """
+    return _SPACES.sub(u' ', _LITERALS.sub(u'?', sql)).strip()
+
+
+class StatementCollector(object):
+    """
+    A hook aggregating after_execute timings per statement
+    fingerprint. The most recent durations, up to samples of them,
+    are kept for each fingerprint to compute percentiles from.
+
+      collector = register(StatementCollector())
+      ...
+      for sql, stats in collector.report().items():
+          print sql, stats['p50'], stats['p99']
+    """
+
+    def __init__(self, samples=1000):
+        self.samples = samples
+        self.statements = {}
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        if event.name != 'after_execute':
+            return
+        key = fingerprint(event.sql)
+        with self._lock:
+            entry = self.statements.get(key)
+            if entry is None:
+                entry = self.statements[key] = {
+                    'count': 0,
+                    'errors': 0,
+                    'total': 0.0,
+                    'max': 0.0,
+                    'durations': deque(maxlen=self.samples),
+                    }
+            entry['count'] += 1
+            if event.error is not None:
+                entry['errors'] += 1
+            entry['total'] += event.duration
+            entry['max'] = max(entry['max'], event.duration)
+            entry['durations'].append(event.duration)
+
+    @staticmethod
+    def percentile(ordered, fraction):
+        if not ordered:
+            return None
+        index = int(round(fraction * (len(ordered) - 1)))
+        return ordered[index]
+
+    def report(self):
+        """
+        @return: dict of fingerprint to a dict with count, errors,
+                 total, mean, max, p50 and p99 (in seconds)
+        """
+        result = {}
+        with self._lock:
+            for key, entry in self.statements.iteritems():
+                ordered = sorted(entry['durations'])
+                result[key] = {
+                               'count': entry['count'],
+                               'errors': entry['errors'],
+                               'total': entry['total'],
+                               'mean': entry['total'] / entry['count'],
+                               'max': entry['max'],
+                               'p50': self.percentile(ordered, 0.5),
+                               'p99': self.percentile(ordered, 0.99),
+                               }
+        return result
+
+    def reset(self):
+        with self._lock:
+            self.statements.clear()
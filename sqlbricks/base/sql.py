@@ -5,29 +5,321 @@ Created on 21 Mar 2013
 '''
 
 from collections import OrderedDict
+from . import events
+import base64
+import copy
+import datetime
+import decimal
+import functools
+import itertools
+import json
+import re
+import time
+import uuid
+
+def _deriving(func):
+    """
+    Makes an add_* method of a persistent query return a derived
+    query changed by func instead of changing the query itself.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        if not self._persistent:
+            return func(self, *args, **kwargs)
+        child = self._derive()
+        # add_* methods calling one another change the same child
+        child._persistent = False
+        try:
+            func(child, *args, **kwargs)
+        finally:
+            child._persistent = True
+            child._owned = None
+        return child
+    return wrapper
+
+def _reusing(func, clause=None):
+    """
+    Makes a format_* method of a persistent query keep the text it
+    renders along with the clause object it was rendered from, so that
+    queries sharing the clause render it once. Without a clause name,
+    it is the first argument of the method.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args):
+        name = clause if clause is not None else args[0]
+        value = self.clauses.get(name)
+        if not value:
+            return func(self, *args)
+        key = (func.__name__,) + args
+        hit = self._fragments.get(key)
+        if hit is not None and hit[0] is value:
+            return hit[1]
+        text = func(self, *args)
+        self._fragments[key] = (value, text)
+        return text
+    return wrapper
+
+#: format_* methods rendering a single clause, and the clause
+_FRAGMENTS = (('format_tables', None), ('format_cond', None),
+              ('format_join', 'join'), ('format_fields', 'fields'),
+              ('format_order', 'order'), ('format_returning', 'returning'),
+              ('format_set', 'set'))
+
+_persistent_classes = {}
+
+def _persistent_class(cls):
+    """
+    @return: the subclass of a query class used in persistent mode
+    """
+    result = _persistent_classes.get(cls)
+    if result is None:
+        classdict = {'_persistent': True, '_mutable_class': cls}
+        for attr in dir(cls):
+            if attr.startswith('add_'):
+                classdict[attr] = _deriving(getattr(cls, attr).__func__)
+        for attr, clause in _FRAGMENTS:
+            if hasattr(cls, attr):
+                classdict[attr] = _reusing(getattr(cls, attr).__func__,
+                                           clause)
+        result = _persistent_classes[cls] = type(cls.__name__, (cls,),
+                                                 classdict)
+    return result
+
 
 class BaseQuery(object):
     """
     The base query which sets API.
+
+    The rendered SQL text is kept in the query once compiled and
+    is invalidated whenever a clause is changed through an add_* method.
+    Subclasses implement render().
+    
+    A query made with persistent() is never changed: its add_*
+    methods return a new query which shares every clause it does
+    not change with its parent, as well as the rendered text of
+    those clauses.
+    
+      active = Select().persistent().add_fields('*').add_from('users').\
+          add_where('active')
+      admins = active.add_where("role = 'admin'")
     """
+    _persistent = False
+    _mutable_class = None
+    _owned = None
     
     def __init__(self):
         self.clauses = {}
         self.bound_parameters = {}
+        self._compiled = None
 
     def __str__(self):
         return str(self.__unicode__())
         
     def __unicode__(self):
+        return self.compile()
+
+    def invalidate(self):
+        """
+        Drops the compiled SQL text.
+        """
+        self._compiled = None
+
+    def compile(self):
+        """
+        Renders the query unless its compiled text is still valid.
+        """
+        if self._compiled is not None:
+            return self._compiled
+        if events.hooks:
+            started = time.time()
+        result = self._compiled = self.render()
+        if events.hooks:
+            events.emit('render', sql=result,
+                        parameters=len(self.bound_parameters),
+                        started=started, duration=time.time() - started)
+        return result
+
+    def render(self):
         raise NotImplementedError
 
+    def copy(self):
+        """
+        @return: a copy of this query which can be changed
+                 without affecting the original
+        """
+        result = copy.copy(self)
+        result.clauses = dict((k, copy.copy(v))
+                              for k, v in self.clauses.iteritems())
+        result.bound_parameters = dict(self.bound_parameters)
+        result._compiled = None
+        return result
+
+    def persistent(self):
+        """
+        @return: a copy of this query in persistent mode
+        """
+        result = self.copy()
+        result.__class__ = _persistent_class(self.__class__)
+        result._fragments = {}
+        return result
+
+    def mutable(self):
+        """
+        @return: a copy of this query which add_* methods change
+        """
+        result = self.copy()
+        if self._mutable_class is not None:
+            result.__class__ = self._mutable_class
+            del result._fragments
+            # queries derived by add_* carry the mode in their __dict__
+            result.__dict__.pop('_persistent', None)
+        return result
+
+    def _derive(self):
+        """
+        @return: a child query sharing the clauses of this one;
+                 check_clause() copies a clause before the child
+                 changes it
+        """
+        result = copy.copy(self)
+        result.clauses = dict(self.clauses)
+        result.bound_parameters = dict(self.bound_parameters)
+        result._compiled = None
+        result._owned = set()
+        return result
+
+    def freeze(self):
+        """
+        @return: a L{Template} of this query, with its current bound
+                 parameters as defaults
+        """
+        return Template(self.compile(), self.bound_parameters)
+
+
+_PLACEHOLDER = re.compile(r'%\((\w+)\)s')
+
+class Template(object):
+    """
+    A statement frozen into its SQL text and the names of its
+    placeholders. Rendering and validation happen once; running
+    it again only binds parameters.
+
+      find = User.load_by(conn, name=None).query.freeze()
+      find.execute(cur, {'name': u'john'})
+      insert.executemany(cur, rows)
+      insert.execute_chunks(cur, (row for row in source), size=500)
+
+    Templates are immutable. bind() gives a statement which can be
+    executed, or iterated over, counted and tested for existence in
+    a Collection; what needs the clauses of a query, such as eager
+    loading, projections, aggregates and pages, does not work on it.
+    """
+    __slots__ = ('sql', 'names', '_defaults')
+
+    def __init__(self, sql, defaults=None):
+        object.__setattr__(self, 'sql', unicode(sql))
+        object.__setattr__(self, 'names',
+                           frozenset(_PLACEHOLDER.findall(self.sql)))
+        object.__setattr__(self, '_defaults',
+                           tuple(sorted((defaults or {}).iteritems())))
+
+    @property
+    def defaults(self):
+        """
+        @return: a copy of the default parameters
+        """
+        return dict(self._defaults)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Templates are immutable")
+
+    def __unicode__(self):
+        return self.sql
+
+    def __str__(self):
+        return self.sql.encode('utf-8')
+
+    def __repr__(self):
+        return '<Template {0!r}>'.format(self.sql)
+
+    def parameters(self, parameters=None):
+        """
+        Merges parameters over the defaults, checking that every
+        placeholder gets a value.
+
+        @return: dict of parameters
+        """
+        merged = dict(self._defaults)
+        if parameters:
+            merged.update(parameters)
+        if not self.names.issubset(merged):
+            raise KeyError("Missing parameters: {0}".format(
+                u', '.join(sorted(self.names.difference(merged)))))
+        return merged
+
+    def bind(self, parameters=None, **kwargs):
+        """
+        @return: a statement with the given parameters bound
+        """
+        if kwargs:
+            parameters = dict(parameters or {}, **kwargs)
+        return BoundTemplate(self, self.parameters(parameters))
+
+    def execute(self, cursor, parameters=None, dao=None):
+        return events.execute(cursor, self.bind(parameters), dao)
+
+    def executemany(self, cursor, seq_of_parameters, dao=None):
+        return events.executemany(cursor, self, [self.parameters(x)
+                                                 for x in seq_of_parameters],
+                                  dao)
+
+    def execute_chunks(self, cursor, parameters, size=1000, dao=None):
+        """
+        Runs the template for every parameter dict of an iterable,
+        passing at most size of them to each executemany() call,
+        so that a generator is never held in memory at once.
+
+        @return: the number of parameter sets
+        """
+        source = iter(parameters)
+        count = 0
+        while True:
+            chunk = [self.parameters(x)
+                     for x in itertools.islice(source, size)]
+            if not chunk:
+                return count
+            events.executemany(cursor, self, chunk, dao)
+            count += len(chunk)
+
+
+class BoundTemplate(object): #IGNORE:R0903
+    """
+    A L{Template} with its parameters.
+    """
+    __slots__ = ('template', 'bound_parameters')
+
+    def __init__(self, template, bound_parameters):
+        self.template = template
+        self.bound_parameters = bound_parameters
+
+    def __unicode__(self):
+        return self.template.sql
+
+    def compile(self):
+        return self.template.sql
+
 class _BaseMixin(object):
 
     def check_clause(self, clause, initial=None):
+        self.invalidate()
         if initial is None:
             initial = OrderedDict()
         if not self.clauses.get(clause):
             self.clauses[clause] = initial
+        elif self._owned is not None and clause not in self._owned:
+            self.clauses[clause] = copy.copy(self.clauses[clause])
+        if self._owned is not None:
+            self._owned.add(clause)
     
 class _TblListMixin(_BaseMixin):
 
@@ -80,8 +372,15 @@ class _JoinMixin(_BaseMixin):
 class _CondMixin(_BaseMixin):
 
     def add_cond(self, cond, *args):
+        """
+        Adds conditions. Arguments having a bind() method, such as
+        DAO expressions, render themselves and put their values into
+        bound_parameters.
+        """
         self.check_clause(cond)
         for arg in args:
+            if hasattr(arg, 'bind'):
+                arg = arg.bind(self.bound_parameters)
             self.clauses[cond][unicode(arg)] = True
         
     def format_cond(self, cond, prefix):
@@ -144,7 +443,7 @@ class _OrderMixin(_BaseMixin):
                     buf.append(u"{0} {1}".format(*o))
                 else:
                     buf.append(u'{0} ASC'.format(unicode(o)))
-            result = u', '.join(buf)
+            result = u'ORDER BY {0}'.format(u', '.join(buf))
         return result
 
 class _GroupMixin(_BaseMixin):
@@ -157,7 +456,8 @@ class _GroupMixin(_BaseMixin):
     def format_group(self):
         result = u''
         if self.clauses.get('group'):
-            result = u', '.join(self.clauses.get('group'))
+            result = u'GROUP BY {0}'.format(
+                u', '.join(self.clauses.get('group')))
         return result
     
 class _LimitMixin(_BaseMixin):
@@ -202,3 +502,96 @@ class _WithMixin(_BaseMixin):
             result.append(fmt.format(recursive, unicode(v[0]), k))
         return u'WITH {0}'.format(u', '.join(result))
 
+
+
+#: types kept in keyset tokens as {tag: text}, by tag
+_TOKEN_TYPES = {'__decimal__': decimal.Decimal, '__uuid__': uuid.UUID}
+
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    for tag, kind in _TOKEN_TYPES.iteritems():
+        if isinstance(value, kind):
+            return {tag: unicode(value)}
+    raise TypeError("{0!r} cannot be used in a keyset token".format(value))
+
+def _json_object(value):
+    if len(value) == 1:
+        tag, text = value.items()[0]
+        if tag in _TOKEN_TYPES and isinstance(text, basestring):
+            return _TOKEN_TYPES[tag](text)
+    return value
+
+class _SeekMixin(_BaseMixin):
+    """
+    Keyset (seek) pagination: instead of skipping rows with OFFSET,
+    the query continues after the ORDER BY values of the last row
+    seen, which costs the same whatever page is being read.
+    Keyset values must not be NULL.
+    """
+
+    def order_columns(self):
+        """
+        @return: list of (column, descending) pairs of the ORDER BY
+        """
+        result = []
+        for o in self.clauses.get('order') or []:
+            if isinstance(o, (list, tuple)):
+                result.append((unicode(o[0]),
+                               unicode(o[1]).strip().upper() == u'DESC'))
+            else:
+                result.append((unicode(o), False))
+        return result
+
+    def add_seek(self, values=None, token=None):
+        """
+        Restricts the query to rows after the given ORDER BY values,
+        with a row-value comparison such as (a, b) > (%s, %s) when all
+        columns sort the same way, or its expanded form otherwise.
+
+        @param values: the ORDER BY values of the last row seen
+        @param token: a token from seek_token() instead of values
+        """
+        if token is not None:
+            values = self.decode_seek_token(token)
+        columns = self.order_columns()
+        if not columns:
+            raise ValueError("Keyset pagination needs an ORDER BY")
+        if len(values) != len(columns):
+            raise ValueError("Expected {0} keyset values, got {1}".\
+                             format(len(columns), len(values)))
+        params = []
+        for i, value in enumerate(values):
+            name = u'seek_{0}'.format(i)
+            self.bound_parameters[name] = value
+            params.append(u'%({0})s'.format(name))
+        directions = set(desc for _, desc in columns)
+        if len(directions) == 1:
+            self.add_where(u'({0}) {1} ({2})'.format(
+                u', '.join(col for col, _ in columns),
+                u'<' if directions.pop() else u'>',
+                u', '.join(params)))
+            return
+        branches = []
+        for i, (col, desc) in enumerate(columns):
+            terms = [u'{0} = {1}'.format(columns[j][0], params[j])
+                     for j in range(i)]
+            terms.append(u'{0} {1} {2}'.format(col, u'<' if desc else u'>',
+                                               params[i]))
+            branches.append(u'({0})'.format(u' AND '.join(terms)))
+        self.add_where(u' OR '.join(branches))
+
+    @staticmethod
+    def seek_token(values):
+        """
+        Encodes keyset values into an opaque URL-safe token.
+        Decimal and UUID values are decoded with their type,
+        dates and times as ISO 8601 strings.
+        """
+        return base64.urlsafe_b64encode(json.dumps(list(values),
+                                                   default=_json_default))
+
+    @staticmethod
+    def decode_seek_token(token):
+        return json.loads(base64.urlsafe_b64decode(str(token)),
+                          object_hook=_json_object)
@@ -0,0 +1,374 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Asynchronous counterpart of the DAO layer.
+
+It reuses the statement builders of L{dao} and only replaces the
+places where they block on a cursor. The code is written as generator
+coroutines which yield futures: any object with done(), result() and
+add_done_callback(), which covers asyncio, trollius, tornado and
+concurrent.futures futures. The functions here return L{Task}s, which
+are such futures themselves, so they can be yielded from coroutines
+of any of those frameworks, or from other L{coroutine}s:
+
+  @coroutine
+  def rename(conn, user_id, name):
+      user = yield load_by_primary(User, conn, user_id)
+      user.name = name
+      yield save(user)
+      posts = yield related(user, 'posts')
+      raise Return(posts)
+
+The driver is pluggable. An asynchronous connection must have a
+cursor() method returning a cursor (or a future of one) whose
+execute(), fetchone(), fetchmany() and fetchall() return futures,
+and whose description and rowcount are set once execute() is done.
+'''
+
+import functools
+import sys
+import time
+import types
+
+from .dao import Collection
+from ..base import events
+
+class Return(Exception):
+    """
+    Raise it in a coroutine to make value its result.
+    """
+
+    def __init__(self, value=None):
+        super(Return, self).__init__(value)
+        self.value = value
+
+
+def is_future(obj):
+    return hasattr(obj, 'add_done_callback') and hasattr(obj, 'result')
+
+
+class Future(object):
+    """
+    A minimal thread-unsafe future, completed through set_result()
+    or set_exc_info().
+    """
+
+    def __init__(self):
+        self._done = False
+        self._result = None
+        self._exc_info = None
+        self._callbacks = []
+
+    def done(self):
+        return self._done
+
+    def result(self):
+        if not self._done:
+            raise RuntimeError("The future is not done yet")
+        if self._exc_info is not None:
+            raise self._exc_info[0], self._exc_info[1], self._exc_info[2]
+        return self._result
+
+    def exception(self):
+        if self._exc_info is not None:
+            return self._exc_info[1]
+        return None
+
+    def add_done_callback(self, func):
+        if self._done:
+            func(self)
+        else:
+            self._callbacks.append(func)
+
+    def set_result(self, value):
+        self._result = value
+        self._finish()
+
+    def set_exception(self, exc):
+        self.set_exc_info((exc.__class__, exc, None))
+
+    def set_exc_info(self, exc_info):
+        self._exc_info = exc_info
+        self._finish()
+
+    def _finish(self):
+        self._done = True
+        callbacks, self._callbacks = self._callbacks, []
+        for func in callbacks:
+            func(self)
+
+
+class Task(Future):
+    """
+    Runs a generator coroutine, resuming it whenever the future
+    it yielded is done.
+    """
+
+    def __init__(self, gen):
+        super(Task, self).__init__()
+        self.gen = gen
+        self._step(None, None)
+
+    def _step(self, value, exc_info):
+        while True:
+            try:
+                if exc_info is not None:
+                    yielded = self.gen.throw(*exc_info)
+                else:
+                    yielded = self.gen.send(value)
+            except Return as ret:
+                self.set_result(ret.value)
+                return
+            except StopIteration:
+                self.set_result(None)
+                return
+            except Exception: #IGNORE:W0703
+                self.set_exc_info(sys.exc_info())
+                return
+            if not is_future(yielded):
+                value = None
+                exc_info = (TypeError, TypeError(
+                    "Coroutines must yield futures, not {0!r}".\
+                    format(yielded)), None)
+                continue
+            if not yielded.done():
+                yielded.add_done_callback(self._wakeup)
+                return
+            value, exc_info = self._outcome(yielded)
+
+    @staticmethod
+    def _outcome(future):
+        try:
+            return future.result(), None
+        except Exception: #IGNORE:W0703
+            return None, sys.exc_info()
+
+    def _wakeup(self, future):
+        self._step(*self._outcome(future))
+
+
+def coroutine(func):
+    """
+    Makes a generator function return a L{Task}.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        result = func(*args, **kwargs)
+        if isinstance(result, types.GeneratorType):
+            return Task(result)
+        future = Future()
+        future.set_result(result)
+        return future
+    return wrapper
+
+
+@coroutine
+def execute(conn, statement, dao=None):
+    """
+    Runs a statement, emitting execution events like
+    L{events.execute}.
+
+    @return: a future of the cursor
+    """
+    cur = conn.cursor()
+    if is_future(cur):
+        cur = yield cur
+    sql = unicode(statement)
+    params = statement.bound_parameters
+    if not events.hooks:
+        yield cur.execute(sql, params)
+        raise Return(cur)
+    count = len(params) if params else 0
+    events.emit('before_execute', sql=sql, parameters=count, dao=dao)
+    started = time.time()
+    try:
+        yield cur.execute(sql, params)
+    except Exception as exc:
+        events.emit('after_execute', sql=sql, parameters=count, dao=dao,
+                    started=started, duration=time.time() - started,
+                    error=exc)
+        raise
+    events.emit('after_execute', sql=sql, parameters=count, dao=dao,
+                started=started, duration=time.time() - started,
+                rows=getattr(cur, 'rowcount', None))
+    raise Return(cur)
+
+
+class AsyncCollection(Collection):
+    """
+    A L{Collection} which runs on an asynchronous connection.
+    Instead of iterating over it, call next(), fetch() or all(),
+    which return futures. Eager loading options are not supported.
+    """
+
+    def __iter__(self):
+        raise TypeError("Use next(), fetch() or all() "
+                        "on an asynchronous collection")
+
+    def __len__(self):
+        raise TypeError("Use count() on an asynchronous collection")
+
+    def options(self, *options):
+        if options:
+            raise TypeError("Eager loading is not supported "
+                            "on asynchronous collections")
+        return self
+
+    @coroutine
+    def start(self):
+        self.cursor = yield execute(self.connection, self.query,
+                                    self.objtype)
+        self.buffer.clear()
+        self.started = True
+
+    @coroutine
+    def fetch(self, size):
+        """
+        @return: a future of a list of at most size objects,
+                 empty when the collection is exhausted
+        """
+        if not self.started:
+            yield self.start()
+        rows = yield self.cursor.fetchmany(size)
+        if not rows:
+            self.started = False
+            raise Return([])
+        if events.hooks:
+            events.emit('rows_fetched', dao=self.objtype, rows=len(rows))
+        raise Return(self.objtype.from_rows(self.cursor.description, rows,
+                                            self.connection))
+
+    @coroutine
+    def next(self):
+        """
+        @return: a future of the next object, or of None
+                 when the collection is exhausted
+        """
+        if not self.buffer:
+            self.buffer.extend((yield self.fetch(self.itersize)))
+            if not self.buffer:
+                raise Return(None)
+        raise Return(self.buffer.popleft())
+
+    @coroutine
+    def all(self):
+        """
+        @return: a future of the list of all objects
+        """
+        result = list(self.buffer)
+        self.buffer.clear()
+        while True:
+            batch = yield self.fetch(self.itersize)
+            if not batch:
+                break
+            result.extend(batch)
+        raise Return(result)
+
+    @coroutine
+    def _scalar_row(self, statement):
+        cur = yield execute(self.connection, statement, self.objtype)
+        raise Return((yield cur.fetchone()))
+
+    @coroutine
+    def count(self):
+        row = yield self._scalar_row(self.count_query())
+        raise Return(row[0])
+
+    @coroutine
+    def exists(self):
+        row = yield self._scalar_row(self.exists_query())
+        raise Return(bool(row[0]))
+
+    @coroutine
+    def aggregate(self, **kwargs):
+        statement, names = self.aggregate_query(**kwargs)
+        row = yield self._scalar_row(statement)
+        raise Return(dict(zip(names, row)))
+
+
+def load_by(cls, conn, *args, **kwargs):
+    """
+    Asynchronous L{dao.BaseDAO.load_by}.
+
+    @return: L{AsyncCollection}
+    """
+    collection = cls.load_by(conn, *args, **kwargs)
+    if collection.eager or collection.deferred:
+        raise TypeError("Eager loading and deferred fields are not "
+                        "supported on asynchronous collections")
+    return AsyncCollection(collection.query, conn, cls)
+
+
+@coroutine
+def load_by_primary(cls, conn, value):
+    """
+    Asynchronous L{dao.BaseDAO.load_by_primary}.
+
+    @return: a future of the object or None
+    """
+    identity_map = getattr(conn, 'identity_map', None)
+    if identity_map is not None:
+        obj = identity_map.get(cls, value)
+        if obj is not None:
+            raise Return(obj)
+    obj = yield load_by(cls, conn, **{cls.__primary__: value}).next()
+    if obj is not None and identity_map is not None:
+        identity_map.add(obj)
+    raise Return(obj)
+
+
+@coroutine
+def save(obj):
+    """
+    Asynchronous L{dao.BaseDAO.save}.
+    """
+    statement = obj.save_statement()
+    if statement is None:
+        raise Return(obj)
+    obj.forget()
+    cur = yield execute(obj.__connection__, statement, obj.__class__)
+    row = yield cur.fetchone()
+    obj.update_from_row(cur.description, row)
+    raise Return(obj)
+
+
+@coroutine
+def delete(obj):
+    """
+    Asynchronous L{dao.BaseDAO.delete}.
+
+    @return: a future of the number of deleted rows
+    """
+    statement = obj.delete_statement()
+    if statement is None:
+        raise Return(None)
+    obj.forget()
+    cur = yield execute(obj.__connection__, statement, obj.__class__)
+    raise Return(cur.rowcount)
+
+
+@coroutine
+def related(obj, name):
+    """
+    Loads the relationship called name of obj.
+
+    @return: a future of the related object (or None), or of the list
+             of related objects for collection relationships
+    """
+    rel = obj.get_relationship(name)
+    value = rel.loaded(obj)
+    if value is not rel.UNLOADED:
+        raise Return(value)
+    if rel.is_primary_lookup():
+        result = yield load_by_primary(rel.get_entity(),
+                                       obj.__connection__,
+                                       getattr(obj, rel.mine))
+        raise Return(result)
+    collection = rel.lazy_collection(obj)
+    collection = AsyncCollection(collection.query, obj.__connection__,
+                                 collection.objtype)
+    if rel.collection:
+        raise Return((yield collection.all()))
+    raise Return((yield collection.next()))
@@ -0,0 +1,145 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+import datetime
+import time
+
+def _to_text(value):
+    if isinstance(value, bool):
+        return u't' if value else u'f'
+    if isinstance(value, (datetime.datetime, datetime.date, datetime.time)):
+        return value.isoformat()
+    if isinstance(value, str):
+        return value.decode('utf-8')
+    return unicode(value)
+
+def escape_text(value):
+    """
+    Encodes a value for COPY text format.
+    """
+    if value is None:
+        return u'\\N'
+    return _to_text(value).replace(u'\\', u'\\\\').replace(u'\t', u'\\t').\
+        replace(u'\n', u'\\n').replace(u'\r', u'\\r')
+
+def escape_csv(value):
+    """
+    Encodes a value for COPY CSV format. NULL is an unquoted empty
+    string, so empty strings are always quoted, and so is a lone
+    \\., which would otherwise end the data.
+    """
+    if value is None:
+        return u''
+    value = _to_text(value)
+    if value in (u'', u'\\.') or any(c in value for c in u',"\n\r'):
+        return u'"{0}"'.format(value.replace(u'"', u'""'))
+    return value
+
+
+class _CopyStream(object):
+    """
+    A file-like object which encodes rows lazily, so that COPY
+    reads the input in bounded pieces.
+    """
+
+    def __init__(self, rows, encode_row):
+        self.rows = iter(rows)
+        self.encode_row = encode_row
+        self.buffer = ''
+        self.count = 0
+        self.exhausted = False
+
+    def _pull(self):
+        try:
+            row = next(self.rows)
+        except StopIteration:
+            self.exhausted = True
+            return
+        self.buffer += self.encode_row(row).encode('utf-8')
+        self.count += 1
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            size = 8192
+        while len(self.buffer) < size and not self.exhausted:
+            self._pull()
+        result, self.buffer = self.buffer[:size], self.buffer[size:]
+        return result
+
+    def readline(self, size=-1): #IGNORE:W0613
+        while '\n' not in self.buffer and not self.exhausted:
+            self._pull()
+        pos = self.buffer.find('\n') + 1 or len(self.buffer)
+        result, self.buffer = self.buffer[:pos], self.buffer[pos:]
+        return result
+
+
+class CopyLoader(object):
+    """
+    Loads DAO objects, dicts or tuples into the table of a DAO class
+    with COPY ... FROM STDIN. Rows are encoded as COPY reads them,
+    so memory stays flat however long the input is.
+
+      loader = CopyLoader(User, format='csv')
+      stats = loader.load(conn, (User(name=n) for n in names))
+
+    The connection cursor must provide copy_expert().
+    """
+    TEXT = 'text'
+    CSV = 'csv'
+
+    def __init__(self, dao_class, columns=None, format=TEXT): #IGNORE:W0622
+        if format not in (self.TEXT, self.CSV):
+            raise ValueError("COPY format must be 'text' or 'csv'")
+        self.dao_class = dao_class
+        if columns is None:
+            columns = sorted(dao_class._fields)
+        self.columns = tuple(columns)
+        self.format = format
+
+    def statement(self):
+        result = u'COPY {0} ({1}) FROM STDIN'.format(
+            self.dao_class.__table__, u', '.join(self.columns))
+        if self.format == self.CSV:
+            result += u" WITH (FORMAT csv)"
+        return result
+
+    def values(self, row):
+        """
+        @return: the values of a row in column order
+        """
+        if isinstance(row, dict):
+            return [row.get(col) for col in self.columns]
+        if isinstance(row, (list, tuple)):
+            if len(row) != len(self.columns):
+                raise ValueError("Row has {0} values, expected {1}".\
+                                 format(len(row), len(self.columns)))
+            return row
+        return [getattr(row, col) for col in self.columns]
+
+    def encode_row(self, row):
+        if self.format == self.CSV:
+            return u','.join(escape_csv(x) for x in self.values(row)) + u'\n'
+        return u'\t'.join(escape_text(x) for x in self.values(row)) + u'\n'
+
+    def load(self, conn, rows):
+        """
+        Streams rows into the table.
+
+        @param conn: DB-API connection whose cursors have copy_expert
+        @param rows: an iterable of DAO objects, dicts or tuples
+        @return: dict with rows, seconds and rows_per_second
+        """
+        stream = _CopyStream(rows, self.encode_row)
+        cur = conn.cursor()
+        started = time.time()
+        cur.copy_expert(self.statement(), stream)
+        elapsed = time.time() - started
+        return {
+                'rows': stream.count,
+                'seconds': elapsed,
+                'rows_per_second': stream.count / elapsed if elapsed else 0.0,
+                }
@@ -0,0 +1,89 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Column buffers for reading result sets as column vectors.
+
+Each column of a result set goes into an array.array when its
+PostgreSQL type maps to a machine type, and into a list otherwise,
+or once a NULL shows up in it. When NumPy is installed, finished
+columns can be turned into NumPy arrays.
+'''
+
+from array import array
+from collections import OrderedDict
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+#: PostgreSQL type OIDs and the array typecodes they are kept in
+TYPECODES = {
+             21: 'h',    # int2
+             23: 'i',    # int4
+             700: 'f',   # float4
+             701: 'd',   # float8
+             }
+if array('l').itemsize == 8:
+    TYPECODES[20] = 'l' # int8
+
+def typecode(column):
+    """
+    @param column: an entry of a DB-API cursor description
+    @return: the array typecode for the column, or None
+    """
+    return TYPECODES.get(column[1])
+
+
+class ColumnBuffers(object):
+    """
+    Accumulates rows of a result set column by column.
+    """
+
+    def __init__(self, description):
+        self.names = [x[0] for x in description]
+        self.columns = []
+        for column in description:
+            code = typecode(column)
+            self.columns.append(array(code) if code else [])
+
+    def extend(self, rows):
+        """
+        Appends a batch of rows.
+        """
+        if not rows:
+            return
+        for index, values in enumerate(zip(*rows)):
+            column = self.columns[index]
+            if isinstance(column, array):
+                size = len(column)
+                try:
+                    column.extend(values)
+                    continue
+                except (TypeError, OverflowError):
+                    # a NULL, or a value the typecode cannot take;
+                    # the values before it were appended already
+                    column = self.columns[index] = column.tolist()[:size]
+            column.extend(values)
+
+    def result(self, use_numpy=None):
+        """
+        @param use_numpy: True to return NumPy arrays, False not to;
+                          by default they are used if NumPy is installed
+        @return: OrderedDict of column name to column
+        """
+        if use_numpy is None:
+            use_numpy = numpy is not None
+        elif use_numpy and numpy is None:
+            raise RuntimeError("NumPy is not installed")
+        result = OrderedDict()
+        for name, column in zip(self.names, self.columns):
+            if use_numpy:
+                if isinstance(column, array):
+                    column = numpy.frombuffer(column, dtype=column.typecode)
+                else:
+                    column = numpy.array(column, dtype=object)
+            result[name] = column
+        return result
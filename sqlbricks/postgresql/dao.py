@@ -5,7 +5,20 @@ Created on 17 Mar 2013
 '''
 
 from .sql import Select, Update, Delete, Insert, Literal
+from .bulk import CopyLoader
+from .columns import ColumnBuffers
+from .pool import acquire, checkout, checkin
+from . import prepared
+from ..base import events
+from collections import OrderedDict, deque
+from itertools import izip
 import copy
+import datetime
+import decimal
+import itertools
+import string
+import time
+import uuid
 
 __DAO__ = {}
 
@@ -27,12 +40,44 @@ class Expression(object): #IGNORE:R0903
       
     DAO field accessors, when invoked as class methods, will
     return Expression instances. 
+    
+    Operators build a tree which is only rendered when needed, and
+    once. Plain Python values become bound parameters: add_where()
+    and add_having() merge them into the query's bound_parameters,
+    so the SQL text stays the same whatever the values are.
+    unicode() of an expression inlines them as quoted literals.
+    
+    Membership tests (in_() and not_in()) pick how to pass their
+    values by how many there are: inline up to INLINE_LIMIT, as one
+    array up to ARRAY_LIMIT, and above that as an array the database
+    joins against rather than scanning it for every row.
     """
-    def __init__(self, initval=None):
+    LIST = 'list'
+    ARRAY = 'array'
+    JOIN = 'join'
+    EMPTY = 'empty'
+    INLINE_LIMIT = 16
+    ARRAY_LIMIT = 1000
+    #: array element types by Python type, most specific first
+    ARRAY_TYPES = ((bool, u'boolean'), ((int, long), u'bigint'),
+                   (float, u'double precision'), (decimal.Decimal, u'numeric'),
+                   (basestring, u'text'), (datetime.datetime, u'timestamp'),
+                   (datetime.date, u'date'), (datetime.time, u'time'),
+                   (uuid.UUID, u'uuid'))
+    
+    def __init__(self, initval=None, tokens=None, operands=()):
         self.initval = initval
+        self.tokens = tokens
+        self.operands = operands
+        self._parts = None
         
     def __unicode__(self):
-        return unicode(self.initval)
+        texts, values = self.parts()
+        result = [texts[0]]
+        for value, text in izip(values, texts[1:]):
+            result.append(unicode(self._escape(value)))
+            result.append(text)
+        return u''.join(result)
         
     @classmethod
     def _escape(cls, something):
@@ -44,9 +89,27 @@ class Expression(object): #IGNORE:R0903
         """
         if isinstance(something, (cls, Literal)):
             return something
+        elif something is None:
+            return u'NULL'
+        elif isinstance(something, list):
+            # an array literal, which takes the type it is compared to
+            items = []
+            for item in something:
+                if item is None:
+                    items.append(u'NULL')
+                else:
+                    items.append(u'"{0}"'.format(unicode(item).\
+                        replace(u'\\', u'\\\\').replace(u'"', u'\\"')))
+            return cls._escape(u'{{{0}}}'.format(u','.join(items)))
         else:
             return u"'{0}'".format(unicode(something).replace("'", "''"))
 
+    @classmethod
+    def _operand(cls, something):
+        if isinstance(something, (cls, Literal)):
+            return something
+        return Parameter(something)
+
     @classmethod
     def call(cls, funcname, *args):
         """
@@ -55,19 +118,95 @@ class Expression(object): #IGNORE:R0903
         Expression.call('AVG', User.age) -> 'AVG(users.age)'
         
         """
-        processed = u', '.join([unicode(cls._escape(x)) for x in args])
-        return Expression(u"{0}({1})".\
-                          format(funcname, processed))
+        tokens = [u'{0}('.format(funcname)]
+        for i in range(len(args)):
+            if i:
+                tokens.append(u', ')
+            tokens.append(i)
+        tokens.append(u')')
+        return cls(tokens=tokens,
+                   operands=tuple(cls._operand(x) for x in args))
     
     def __str__(self):
-        return str(self.initval)
+        return unicode(self).encode('utf-8')
     
+    def parts(self):
+        """
+        Renders the tree, without recursion, into SQL text fragments
+        and the values to be bound between them.
+        
+        @return: (texts, values), with one more text than values
+        """
+        if self._parts is not None:
+            return self._parts
+        texts = []
+        values = []
+        buf = []
+        stack = [self]
+        while stack:
+            item = stack.pop()
+            if isinstance(item, basestring):
+                buf.append(item)
+            elif isinstance(item, Parameter):
+                texts.append(u''.join(buf))
+                buf = []
+                values.append(item.value)
+            elif not isinstance(item, Expression):
+                buf.append(unicode(item))
+            elif item._parts is not None:
+                sub_texts, sub_values = item._parts
+                buf.append(sub_texts[0])
+                for value, text in izip(sub_values, sub_texts[1:]):
+                    texts.append(u''.join(buf))
+                    buf = [text]
+                    values.append(value)
+            elif item.tokens is None:
+                buf.append(unicode(item.initval))
+            else:
+                stack.extend(x if isinstance(x, basestring)
+                             else item.operands[x]
+                             for x in reversed(item.tokens))
+        texts.append(u''.join(buf))
+        self._parts = (texts, values)
+        return self._parts
+
+    def bind(self, parameters):
+        """
+        Renders the expression with a placeholder for each value,
+        adding the values to parameters. Placeholder names depend
+        only on the names already in parameters, so the same query
+        built with other values has the same text.
+        
+        @param parameters: dict of bound parameters of a query
+        @return: SQL text
+        """
+        texts, values = self.parts()
+        result = [texts[0]]
+        index = 0
+        for value, text in izip(values, texts[1:]):
+            while u'expr_{0}'.format(index) in parameters:
+                index += 1
+            name = u'expr_{0}'.format(index)
+            parameters[name] = value
+            result.append(u'%({0})s'.format(name))
+            result.append(text)
+        return u''.join(result)
+
     def _fmt(self, fmt, other):
         """
         A formatting helper for binary operators.
         """
-        return Expression(fmt.\
-                          format(self.initval, self._escape(other)))
+        tokens = _TEMPLATES.get(fmt)
+        if tokens is None:
+            tokens = []
+            for text, field, _, _ in _FORMATTER.parse(fmt):
+                if text:
+                    tokens.append(text)
+                if field is not None:
+                    tokens.append(int(field))
+            tokens = _TEMPLATES[fmt] = tuple(tokens)
+        return Expression(tokens=tokens,
+                          operands=(self, self._operand(other)))
 
     def __add__(self, other):
         return self._fmt(u'({0} + {1})', other)
@@ -94,10 +233,10 @@ class Expression(object): #IGNORE:R0903
         return self._fmt(u'({1} / {0})', other)
 
     def __mod__(self, other):
-        return self._fmt(u'({0} % {1})', other)
+        return self._fmt(u'({0} %% {1})', other)
     
     def __rmod__(self, other):
-        return self._fmt(u'({1} % {0})', other)
+        return self._fmt(u'({1} %% {0})', other)
 
     def __pow__(self, other):
         return self._fmt(u'POWER({0}, {1})', other)
@@ -124,12 +263,20 @@ class Expression(object): #IGNORE:R0903
         return self._fmt(u'({1} XOR {0})', other)
 
     def __not__(self):
-        return Expression(u'(NOT {0})'.format(self.initval))
+        return Expression(tokens=(u'(NOT ', 0, u')'), operands=(self,))
+
+    __invert__ = __not__
     
     def __eq__(self, other):
+        if other is None:
+            return Expression(tokens=(u'(', 0, u' IS NULL)'),
+                              operands=(self,))
         return self._fmt(u'({0} = {1})', other)
 
     def __ne__(self, other):
+        if other is None:
+            return Expression(tokens=(u'(', 0, u' IS NOT NULL)'),
+                              operands=(self,))
         return self._fmt(u'({0} <> {1})', other)
 
     def __lt__(self, other):
@@ -138,34 +285,294 @@ class Expression(object): #IGNORE:R0903
     def __gt__(self, other):
         return self._fmt(u'({0} > {1})', other)
 
-    def __lte__(self, other):
+    def __le__(self, other):
+        return self._fmt(u'({0} <= {1})', other)
+
+    def __ge__(self, other):
         return self._fmt(u'({0} >= {1})', other)
 
-    def __gte__(self, other):
-        return self._fmt(u'({0} <= {1})', other)
+    def in_(self, values, strategy=None):
+        """
+        Tests for membership in values, rendered as one of
+        
+          (expr IN (%(expr_0)s, %(expr_1)s, ...))     LIST
+          (expr = ANY(%(expr_0)s))                    ARRAY
+          (expr IN (SELECT unnest(%(expr_0)s::bigint[])))  JOIN
+        
+        The array of JOIN is cast to the type of its values, as
+        told by array_type(). Duplicate values are dropped.
+        A membership event tells which strategy was chosen.
+        
+        @param values: an iterable of values
+        @param strategy: LIST, ARRAY or JOIN; by default it depends
+                         on the number of values
+        @return: L{Expression}, with the strategy in its strategy
+                 attribute
+        """
+        return self._membership(values, strategy, False)
+
+    def not_in(self, values, strategy=None):
+        """
+        The negation of L{in_}, rendered with NOT IN or <> ALL.
+        None values are dropped, as SQL would compare them as NULL
+        and never find expr outside the list.
+        """
+        return self._membership(values, strategy, True)
+
+    @classmethod
+    def membership_strategy(cls, size):
+        """
+        @return: the strategy of a membership test of size values
+        """
+        if not size:
+            return cls.EMPTY
+        if size <= cls.INLINE_LIMIT:
+            return cls.LIST
+        if size <= cls.ARRAY_LIMIT:
+            return cls.ARRAY
+        return cls.JOIN
+
+    @classmethod
+    def array_type(cls, values):
+        """
+        @return: the SQL type of the elements of an array of values,
+                 or None if they are not all of one type in ARRAY_TYPES
+        """
+        names = set()
+        for kind in set(x.__class__ for x in values if x is not None):
+            for types, name in cls.ARRAY_TYPES:
+                if issubclass(kind, types):
+                    names.add(name)
+                    break
+            else:
+                return None
+        if len(names) != 1:
+            return None
+        name = names.pop()
+        if name == u'timestamp' and \
+                any(x.tzinfo is not None for x in values if x is not None):
+            name = u'timestamptz'
+        return name
+
+    def _membership(self, values, strategy, negated):
+        values = list(values)
+        if negated:
+            # a NULL would make NOT IN and <> ALL match no row at all
+            values = [x for x in values if x is not None]
+        seen = set()
+        add = seen.add
+        try:
+            # by type too, as 1 == True == 1.0 but they bind differently
+            values = [x for x in values
+                      if not ((type(x), x) in seen or add((type(x), x)))]
+        except TypeError:
+            pass
+        if not values:
+            strategy = self.EMPTY
+        elif strategy is None:
+            strategy = self.membership_strategy(len(values))
+        if strategy == self.EMPTY:
+            result = Expression(u'TRUE' if negated else u'FALSE')
+        elif strategy == self.LIST:
+            tokens = [u'(', 0, u' NOT IN (' if negated else u' IN (']
+            for index in range(1, len(values) + 1):
+                if index > 1:
+                    tokens.append(u', ')
+                tokens.append(index)
+            tokens.append(u'))')
+            result = Expression(tokens=tuple(tokens), operands=(self,) +
+                                tuple(Parameter(x) for x in values))
+        elif strategy == self.ARRAY:
+            result = Expression(tokens=(u'(', 0, u' <> ALL(' if negated
+                                        else u' = ANY(', 1, u'))'),
+                                operands=(self, Parameter(values)))
+        elif strategy == self.JOIN:
+            # unnest() takes any array, so the server cannot infer the
+            # type of a parameter passed to it without a cast, as in a
+            # prepared statement
+            cast = self.array_type(values)
+            result = Expression(tokens=(u'(', 0, u' NOT IN' if negated
+                                        else u' IN', u' (SELECT unnest(', 1,
+                                        u'::{0}[])))'.format(cast) if cast
+                                        else u')))'),
+                                operands=(self, Parameter(values)))
+        else:
+            raise ValueError("Unknown membership strategy {0!r}".\
+                             format(strategy))
+        result.strategy = strategy
+        if events.hooks:
+            events.emit('membership', sql=unicode(self), rows=len(values),
+                        strategy=strategy, negated=negated)
+        return result
+
+    __hash__ = object.__hash__
+
+class Parameter(Expression): #IGNORE:R0903
+    """
+    A leaf of an L{Expression} tree holding a value to be bound.
+    """
+    def __init__(self, value):
+        super(Parameter, self).__init__()
+        self.value = value
+        self._parts = ([u'', u''], [value])
+
+_FORMATTER = string.Formatter()
+_TEMPLATES = {}
+
+class DeferredBatch(object): #IGNORE:R0903
+    """
+    Stands in for the deferred fields of the objects hydrated from
+    one batch of rows. The first access to a deferred field of any
+    of them loads the deferred fields of the whole batch with one
+    query; each object takes its values on its first access.
+    """
+    __slots__ = ('cls', 'connection', 'names', 'keys', 'values')
+
+    def __init__(self, cls, connection, names, keys):
+        self.cls = cls
+        self.connection = connection
+        self.names = names
+        self.keys = keys
+        self.values = None
+
+    def load(self, obj, name):
+        """
+        Replaces the deferred fields of obj by their values, leaving
+        alone those assigned since obj was loaded.
+        
+        @return: the value of the field called name
+        """
+        if self.values is None:
+            if self.connection is None:
+                raise RuntimeError("Cannot load deferred fields "
+                                   "without a connection")
+            self.values = self.cls.load_deferred(self.connection,
+                                                 self.names, self.keys)
+        fields = obj._field_objects
+        row = self.values.get(getattr(obj, obj.__primary__))
+        for index, field in enumerate(self.names):
+            field = fields[field]
+            if field.raw(obj) is self:
+                field.store(obj, row[index] if row is not None
+                            else field.value)
+        return fields[name].raw(obj)
+
+
+#: types whose values compare with those of another type by value
+_SAME_KIND = {long: int, str: unicode}
+
+def same_value(first, second):
+    """
+    Tells whether assigning second over first changes nothing.
+    Values of different types differ, so that e.g. 1 and True do,
+    except int and long, and str (as UTF-8) and unicode, as the
+    driver may return either.
+    """
+    if first is second:
+        return True
+    kind = _SAME_KIND.get(first.__class__, first.__class__)
+    if kind is not _SAME_KIND.get(second.__class__, second.__class__):
+        return False
+    if kind is unicode and first.__class__ is not second.__class__:
+        if first.__class__ is str:
+            first = first.decode('utf-8', 'replace')
+        else:
+            second = second.decode('utf-8', 'replace')
+    return first == second
+
 
 class Field(object): #IGNORE:R0903
     """
     This class should be used for field member of DAO classes.
     Only Fields can be saved and queried automatically.
+    
+    Values are kept in the instance: in its __dict__ under the field
+    name, or, for compact classes, in a slot named by _slot.
+    The value given to the constructor is the default.
+    
+    Assignments are tracked: a field is in the instance's __changed__
+    while its value differs from the one it had when loaded, which is
+    kept in __original__ until the object is saved.
     """
     def __init__(self, initval=None):
         self.value = initval
         self._name = None
+        self._slot = None
     
     def __get__(self, obj, objtype=None):
         if obj is None:
             return Expression(u'"{0}"."{1}"'.\
                               format(objtype.__table__, self._name))
-        return self.value
+        if obj.__compact__:
+            value = getattr(obj, self._slot, self.value)
+        else:
+            value = obj.__dict__.get(self._name, self.value)
+        if value.__class__ is DeferredBatch:
+            return value.load(obj, self._name)
+        return value
 
     def __set__(self, obj, value):
         if obj is None:
             raise ValueError("Cannot set value on an unbound field.")
-        self.value = value
+        name = self._name
+        old = self.raw(obj)
+        self.store(obj, value)
+        originals = getattr(obj, '__original__', None)
+        if originals is not None and name in originals:
+            old = originals[name]
+        elif old.__class__ is DeferredBatch:
+            # the loaded value is unknown, so any value is a change
+            obj.__changed__.add(name)
+            return
+        if same_value(old, value):
+            obj.__changed__.discard(name)
+            if originals:
+                originals.pop(name, None)
+        else:
+            obj.__changed__.add(name)
+            if originals is None:
+                originals = obj.__original__ = {}
+            originals.setdefault(name, old)
+
+    def store(self, obj, value):
+        """
+        Puts a value into the instance storage.
+        """
+        if obj.__compact__:
+            setattr(obj, self._slot, value)
+        else:
+            obj.__dict__[self._name] = value
+
+    def raw(self, obj):
+        """
+        @return: the stored value, which is a L{DeferredBatch}
+                 for deferred fields not loaded yet
+        """
+        if obj.__compact__:
+            return getattr(obj, self._slot, self.value)
+        return obj.__dict__.get(self._name, self.value)
         
 
 class Collection(object):
+    """
+    An iterable over DAO objects produced by a query.
+    
+    By default the query runs on an ordinary client-side cursor.
+    In streaming mode (see stream()) a named server-side cursor is
+    used instead and rows are fetched in batches of itersize, so that
+    large result sets are never buffered in client memory at once.
+    
+    A collection on a pool holds a connection from the start of the
+    iteration to its end. Leaving the iteration early, use close(),
+    or the collection as a context manager, to return it:
+    
+      with User.load_by(pool) as users:
+          for user in users:
+              if user.name == name:
+                  break
+    """
+    itersize = 2000
+    _cursor_ids = itertools.count(1)
     
     def __init__(self, query, conn, objt):
         self.objtype = objt
@@ -173,29 +580,411 @@ class Collection(object):
         self.query = query
         self.started = False
         self.cursor = None
+        self.streaming = False
+        self.buffer = deque()
+        self.eager = []
+        self.eager_state = {}
+        self.deferred = frozenset()
+        self.active = None
     
     def __iter__(self):
+        if not self.started:
+            self.start()
+        return self
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.finish(error=exc_type is not None)
+    
+    def __del__(self):
+        if getattr(self, 'active', None) is not None:
+            self.finish()
+    
+    def close(self):
+        """
+        Stops the iteration, returning the connection if it came
+        from a pool.
+        """
+        self.finish()
+    
+    def stream(self, itersize=None):
+        """
+        Switches the collection to a named server-side cursor.
+        Server-side cursors only live inside a transaction.
+        
+        @param itersize: the number of rows fetched per round trip
+        @return: the collection itself
+        """
+        if self.started:
+            raise RuntimeError("Cannot switch a started collection "
+                               "to streaming")
+        self.streaming = True
+        if itersize is not None:
+            self.itersize = itersize
+        return self
+    
+    def options(self, *options):
+        """
+        Adds eager loading options, see L{prefetch} and L{joined},
+        and projection options, see L{only} and L{defer}.
+        Objects are then fetched in batches of itersize, and related
+        objects or deferred fields are loaded for each batch at once.
+        
+        @return: the collection itself
+        """
+        if self.started:
+            raise RuntimeError("Cannot add options to a started collection")
+        if options:
+            self._needs_clauses("Options")
+        for option in options:
+            if isinstance(option, Projection):
+                option.apply(self)
+            else:
+                self.eager.append(option)
         return self
     
     def start(self):
-        self.cursor = self.connection.cursor()
-        self.cursor.execute(unicode(self.query), self.query.bound_parameters)
+        if self.active is not None:
+            self.finish()
+        self.active = checkout(self.connection)
+        try:
+            if self.streaming:
+                name = 'sqlbricks_{0}'.format(next(self._cursor_ids))
+                self.cursor = self.active.cursor(name)
+                self.cursor.itersize = self.itersize
+                # DECLARE takes a query, not an EXECUTE
+                events.execute(self.cursor, self.query, self.objtype)
+            else:
+                self.cursor = self.active.cursor()
+                prepared.execute(self.cursor, self.query, self.objtype)
+        except:
+            self.finish(error=True)
+            raise
+        self.buffer.clear()
         self.started = True
     
+    def finish(self, error=False):
+        """
+        Marks the collection exhausted, closing a server-side cursor
+        and returning the connection if it came from a pool.
+        """
+        if self.streaming and self.cursor is not None:
+            self.cursor.close()
+        if self.active is not None:
+            active, self.active = self.active, None
+            checkin(self.connection, active, error)
+        self.started = False
+    
+    def first(self):
+        """
+        @return: the first object, or None; the collection is finished
+                 right away
+        """
+        try:
+            return next(self, None)
+        finally:
+            self.finish()
+    
+    def fetch(self, size):
+        """
+        Fetches and hydrates up to size objects.
+        
+        @return: list of DAO objects, empty when exhausted
+        """
+        rows = self.cursor.fetchmany(size)
+        if not rows:
+            return []
+        if events.hooks:
+            events.emit('rows_fetched', dao=self.objtype, rows=len(rows))
+        batch = self.objtype.from_rows(self.cursor.description, rows,
+                                       self.connection)
+        for option in self.eager:
+            option.load(self, batch)
+        return batch
+    
     def next(self):
+        if not self.started:
+            self.start()
+        if not self.streaming and not self.eager and not self.deferred:
+            try:
+                inst = self.objtype.one_from_cursor(self.cursor,
+                                                    self.connection)
+            except StopIteration:
+                self.finish()
+                raise
+            except Exception:
+                self.finish(error=True)
+                raise
+            return inst
+        if not self.buffer:
+            self.buffer.extend(self.fetch(self.itersize))
+            if not self.buffer:
+                self.finish()
+                raise StopIteration
+        return self.buffer.popleft()
+    
+    def batches(self, size=None):
+        """
+        Yields lists of at most size hydrated objects, so that only
+        one batch is held in memory at a time.
+        
+        @param size: batch size, defaults to itersize
+        """
+        if size is None:
+            size = self.itersize
         if not self.started:
             self.start()
         try:
-            inst = self.objtype.one_from_cursor(self.cursor, self.connection)
+            while self.buffer:
+                batch = []
+                while self.buffer and len(batch) < size:
+                    batch.append(self.buffer.popleft())
+                yield batch
+            while True:
+                batch = self.fetch(size)
+                if not batch:
+                    break
+                yield batch
+        finally:
+            # also when the generator is abandoned
+            self.finish()
+    
+    def iter_columns(self, batch=None, use_numpy=None):
+        """
+        Yields the result set as column vectors, batch rows at a time,
+        without making objects. Each batch is an OrderedDict of column
+        name to an array.array (for integer and floating point columns
+        without NULLs) or a list, or to NumPy arrays (see
+        L{columns.ColumnBuffers.result}).
+        
+        @param batch: rows per batch, defaults to itersize
+        """
+        if batch is None:
+            batch = self.itersize
+        self.start()
+        try:
+            while True:
+                rows = self.cursor.fetchmany(batch)
+                if not rows:
+                    break
+                if events.hooks:
+                    events.emit('rows_fetched', dao=self.objtype,
+                                rows=len(rows))
+                buffers = ColumnBuffers(self.cursor.description)
+                buffers.extend(rows)
+                yield buffers.result(use_numpy)
+        except GeneratorExit:
+            self.finish()
+            raise
         except:
-            self.started = False
-            raise StopIteration
-        return inst
+            self.finish(error=True)
+            raise
+        self.finish()
+    
+    def to_columns(self, use_numpy=None):
+        """
+        Reads the whole result set as column vectors, see
+        L{iter_columns}.
+        
+        @return: OrderedDict of column name to column
+        """
+        self.start()
+        try:
+            buffers = ColumnBuffers(self.cursor.description)
+            while True:
+                rows = self.cursor.fetchmany(self.itersize)
+                if not rows:
+                    break
+                if events.hooks:
+                    events.emit('rows_fetched', dao=self.objtype,
+                                rows=len(rows))
+                buffers.extend(rows)
+        except:
+            self.finish(error=True)
+            raise
+        self.finish()
+        return buffers.result(use_numpy)
     
     def __len__(self):
-        if not self.started:
-            self.start()
-        return self.cursor.rowcount
+        # list() asks for the length of a collection it is iterating
+        # over, so a started collection must not issue another query
+        if self.started:
+            if self.streaming or self.cursor.rowcount < 0:
+                raise TypeError("The length of a started streaming "
+                                "collection is unknown, use count()")
+            return self.cursor.rowcount
+        return self.count()
+    
+    def _keyset_query(self):
+        """
+        @return: the query ordered by a unique key, and the
+                 attribute names of its ORDER BY columns
+        """
+        # a persistent query would return the changed query from
+        # add_* instead of changing itself
+        statement = self.query.mutable()
+        primary = getattr(self.objtype, self.objtype.__primary__)
+        columns = [col for col, _ in statement.order_columns()]
+        if unicode(primary) not in columns and \
+                self.objtype.__primary__ not in columns:
+            statement.add_order(unicode(primary))
+            columns.append(unicode(primary))
+        return statement, [col.split('.')[-1].strip('"') for col in columns]
+    
+    def page(self, size, token=None):
+        """
+        Fetches one page of objects with keyset pagination.
+        The ORDER BY of the collection (completed with the primary
+        key to make it unique) must consist of fields.
+        
+        @param size: page size
+        @param token: the token returned for the previous page
+        @return: (list of objects, token of the next page or None)
+        """
+        self._needs_clauses("Pagination")
+        statement, attrs = self._keyset_query()
+        if token is not None:
+            statement.add_seek(token=token)
+        statement.add_limit(size)
+        with acquire(self.connection) as conn:
+            cur = conn.cursor()
+            events.execute(cur, statement, self.objtype)
+            rows = cur.fetchall()
+            description = cur.description
+        if events.hooks:
+            events.emit('rows_fetched', dao=self.objtype, rows=len(rows))
+        objects = []
+        if rows:
+            objects = self.objtype.from_rows(description, rows,
+                                             self.connection)
+            for option in self.eager:
+                # the page ran the keyset query, with its own LIMIT
+                option.load(self, objects, statement)
+        if len(objects) < size:
+            return objects, None
+        last = objects[-1]
+        return objects, statement.seek_token([getattr(last, x)
+                                              for x in attrs])
+    
+    def pages(self, size):
+        """
+        Iterates over the whole collection in pages of size objects
+        using keyset pagination, so that every page costs the same.
+        """
+        token = None
+        while True:
+            objects, token = self.page(size, token)
+            if objects:
+                yield objects
+            if token is None:
+                break
+    
+    def derive(self, *fields):
+        """
+        Makes a query selecting fields over the same WITH, FROM,
+        JOIN and WHERE clauses as this collection.
+        
+        @return: L{Select}
+        """
+        self._needs_clauses("Deriving a query")
+        statement = Select()
+        statement.add_fields(*fields)
+        for clause in ('with', 'from', 'join', 'where'):
+            if self.query.clauses.get(clause):
+                statement.clauses[clause] = \
+                    copy.copy(self.query.clauses[clause])
+        statement.bound_parameters.update(self.query.bound_parameters)
+        return statement
+    
+    def _needs_clauses(self, what):
+        if not hasattr(self.query, 'clauses'):
+            raise TypeError("{0} needs a query built from clauses, not "
+                            "{1}".format(what,
+                                         self.query.__class__.__name__))
+    
+    def _is_windowed(self):
+        # a statement without clauses, e.g. a bound template,
+        # can only be counted as a subquery
+        clauses = getattr(self.query, 'clauses', None)
+        if clauses is None:
+            return True
+        return bool(clauses.get('group') or clauses.get('having') or
+                    clauses.get('limit') or clauses.get('offset'))
+    
+    def _scalar_row(self, statement):
+        with acquire(self.connection) as conn:
+            cur = conn.cursor()
+            prepared.execute(cur, statement, self.objtype)
+            return cur.fetchone()
+    
+    def count_query(self):
+        """
+        @return: the SELECT COUNT(*) query for this collection
+        """
+        if self._is_windowed():
+            statement = Select()
+            statement.add_fields(u'COUNT(*)')
+            statement.add_from(u'({0}) AS "__counted__"'.format(
+                unicode(self.query)))
+            statement.bound_parameters.update(self.query.bound_parameters)
+            return statement
+        return self.derive(u'COUNT(*)')
+    
+    def exists_query(self):
+        """
+        @return: the SELECT EXISTS(...) query for this collection
+        """
+        if self._is_windowed():
+            inner = self.query
+        else:
+            inner = self.derive(u'1')
+        statement = Select()
+        statement.add_fields(u'EXISTS({0})'.format(unicode(inner)))
+        statement.bound_parameters.update(inner.bound_parameters)
+        return statement
+    
+    def aggregate_query(self, **kwargs):
+        """
+        @return: the aggregate query for this collection, and the
+                 function names in the order of its columns
+        """
+        self._needs_clauses("Aggregation")
+        if self._is_windowed():
+            raise ValueError("Cannot aggregate over a collection with "
+                             "GROUP BY, HAVING, LIMIT or OFFSET")
+        names = sorted(kwargs)
+        statement = self.derive(*[u'{0}({1}) AS "{2}"'.format(
+            name.upper(), kwargs[name], name) for name in names])
+        return statement, names
+    
+    def count(self):
+        """
+        Counts matching rows with SELECT COUNT(*), without fetching
+        or hydrating them.
+        """
+        return self._scalar_row(self.count_query())[0]
+    
+    def exists(self):
+        """
+        Checks whether there are matching rows with SELECT EXISTS(...).
+        """
+        return bool(self._scalar_row(self.exists_query())[0])
+    
+    def aggregate(self, **kwargs):
+        """
+        Computes aggregates over the matching rows. Keywords name
+        aggregate functions, values are the columns or expressions.
+        
+          Order.load_by(conn, paid=True).aggregate(sum=Order.amount,
+                                                   max=Order.amount)
+          -> {'sum': 1200, 'max': 300}
+        
+        @return: dict of function name to value
+        """
+        statement, names = self.aggregate_query(**kwargs)
+        return dict(izip(names, self._scalar_row(statement)))
     
     def __delitem__(self, item):
         raise RuntimeError("Cannot delete items from the collection")
@@ -206,7 +995,147 @@ class Collection(object):
     def __setitem__(self, idx, value):
         raise RuntimeError("Collections are read-only")
 
+_UNLOADED = object()
+
+class EagerLoad(object):
+    """
+    An option which makes a Collection load a relationship for
+    whole batches of objects instead of one query per object.
+    """
+
+    def __init__(self, name):
+        self.name = name
+
+    def load(self, collection, batch, query=None):
+        """
+        @param query: the query which selected batch, when it is not
+                      the query of the collection
+        """
+        raise NotImplementedError
+
+
+class PrefetchLoad(EagerLoad):
+    """
+    Loads related objects for each batch with a single
+    query matching the parent keys with = ANY(...).
+    """
+
+    def load(self, collection, batch, query=None):
+        rel = collection.objtype.get_relationship(self.name)
+        keys = set(getattr(obj, rel.mine) for obj in batch)
+        keys.discard(None)
+        related = {}
+        if keys:
+            related = rel.load_related(rel.eager_query(keys=sorted(keys)),
+                                       collection.connection,
+                                       collection.active)
+        rel.attach_related(batch, related)
+
+
+class JoinedLoad(EagerLoad):
+    """
+    Loads related objects for the whole collection with one query
+    which matches their keys against a subquery selecting the keys
+    of the collection's objects. Collections with a LIMIT fall back
+    to prefetching.
+    """
+
+    def load(self, collection, batch, query=None):
+        if query is None:
+            query = collection.query
+        if query.clauses.get('limit') or query.clauses.get('offset'):
+            return PrefetchLoad(self.name).load(collection, batch)
+        rel = collection.objtype.get_relationship(self.name)
+        key = ('joined', self.name)
+        if key not in collection.eager_state:
+            collection.eager_state[key] = rel.load_related(
+                rel.eager_query(parent_query=query), collection.connection,
+                collection.active)
+        rel.attach_related(batch, collection.eager_state[key])
+
+
+def prefetch(name):
+    """
+    Eager loading option: load the relationship called name with
+    one = ANY(...) query per batch of objects.
+    
+      User.load_by(conn, prefetch('orders'))
+    """
+    return PrefetchLoad(name)
+
+
+def joined(name):
+    """
+    Eager loading option: load the relationship called name with
+    one query for the whole collection.
+    
+      Order.load_by(conn, joined('owner'))
+    """
+    return JoinedLoad(name)
+
+
+class Projection(object):
+    """
+    An option which narrows the fields a Collection selects.
+    The fields left out are deferred: see L{DeferredBatch}.
+    The primary key is always selected.
+    """
+
+    def __init__(self, names, exclude=False):
+        self.names = frozenset(names)
+        self.exclude = exclude
+
+    def apply(self, collection):
+        cls = collection.objtype
+        unknown = self.names - cls._fields
+        if unknown:
+            raise ValueError("No such fields: {0}".format(
+                u', '.join(sorted(unknown))))
+        if self.exclude:
+            names = cls._fields - self.names
+        else:
+            names = self.names
+        names = names | frozenset([cls.__primary__])
+        query = collection.query
+        if query._persistent:
+            # the query may be shared with other queries and collections
+            query = collection.query = query.mutable()
+        query.check_clause('fields')
+        query.clauses['fields'] = OrderedDict(
+            (x, True) for x in cls.field_list(names))
+        collection.deferred = cls._fields - names
+
+
+def only(*names):
+    """
+    Projection option: select only the fields called names,
+    deferring the others.
+    
+      Document.load_by(conn, only('title', 'author_id'))
+    """
+    return Projection(names)
+
+
+def defer(*names):
+    """
+    Projection option: defer the fields called names.
+    
+      Document.load_by(conn, defer('body'))
+    """
+    return Projection(names, exclude=True)
+
+
 class Relationship(object): #IGNORE:R0902
+    """
+    Links a DAO class to another one. Accessing a relationship on an
+    object loads the objects of the entity class whose attribute
+    theirs is equal to the mine attribute of this object, or,
+    through via_table, those linked to it by rows having via_mine
+    and via_theirs columns. A relationship which is not a collection
+    returns a single object.
+    """
+    
+    UNLOADED = _UNLOADED
     
     def __init__(self, entity, mine, theirs, collection=False, #IGNORE:R0913
                  via_table=None, via_mine=None, via_theirs=None): 
@@ -220,29 +1149,133 @@ class Relationship(object): #IGNORE:R0902
         self.via_mine = via_mine
         self.via_theirs = via_theirs
         
+    def get_entity(self):
+        if isinstance(self.entity, basestring):
+            self.entity = get_dao(self.entity)
+        return self.entity
+    
+    def loaded(self, obj):
+        """
+        @return: the eagerly loaded value attached to obj,
+                 or UNLOADED if there is none
+        """
+        if obj.__compact__:
+            return getattr(obj, self._slot, _UNLOADED)
+        return obj.__dict__.get(self.name, _UNLOADED)
+    
+    def attach(self, obj, value):
+        """
+        Stores an eagerly loaded value in the object, where it takes
+        precedence over querying the database.
+        """
+        if obj.__compact__:
+            setattr(obj, self._slot, value)
+        else:
+            obj.__dict__[self.name] = value
+    
+    def eager_query(self, keys=None, parent_query=None):
+        """
+        Builds a query for the related objects of many parents at once.
+        The last column of the query is the parent key the row belongs to.
+        
+        @param keys: the parent key values to load the objects for
+        @param parent_query: the query selecting the parents, whose
+                             keys are matched with a subquery instead
+                             of being listed
+        @return: L{Select}
+        """
+        entity = self.get_entity()
+        statement = Select()
+        statement.add_fields(*entity.field_list())
+        statement.add_from(entity.__table__)
+        if self.via_table is not None:
+            self.join_via(statement)
+            key = u'"{0}"."{1}"'.format(self.via_table, self.via_mine)
+        else:
+            key = unicode(getattr(entity, self.theirs))
+        statement.add_fields(u'{0} AS "__key__"'.format(key))
+        if keys is not None:
+            param = u'{0}_keys'.format(self.name)
+            statement.add_where(u'{0} = ANY(%({1})s)'.format(key, param))
+            statement.bound_parameters[param] = list(keys)
+        if parent_query is not None:
+            # the parent query runs in a scope of its own, so that its
+            # columns cannot clash with those of the entity table, even
+            # when both are the same table
+            parents = parent_query.mutable()
+            parents.clauses['fields'] = OrderedDict(
+                [(unicode(getattr(self.parent, self.mine)), True)])
+            parents.clauses.pop('order', None)
+            statement.add_where(u'{0} IN ({1})'.format(key,
+                                                       unicode(parents)))
+            statement.bound_parameters.update(parents.bound_parameters)
+        return statement
+    
+    def load_related(self, statement, conn, active=None):
+        """
+        Runs an eager query.
+        
+        @param active: a connection already checked out of conn,
+                       to run the query on instead of another one
+        @return: dict of parent key to list of related objects
+        """
+        entity = self.get_entity()
+        # a plain connection is not checked out of anything
+        with acquire(conn if active is None else active) as real:
+            cur = real.cursor()
+            events.execute(cur, statement, entity)
+            rows = cur.fetchall()
+            description = cur.description
+        if events.hooks:
+            events.emit('rows_fetched', dao=entity, rows=len(rows))
+        result = {}
+        if not rows:
+            return result
+        objects = entity.from_rows(description[:-1],
+                                   [row[:-1] for row in rows], conn)
+        seen = set()
+        for row, obj in izip(rows, objects):
+            ident = (row[-1], getattr(obj, entity.__primary__))
+            if ident in seen:
+                continue
+            seen.add(ident)
+            result.setdefault(row[-1], []).append(obj)
+        return result
+    
+    def attach_related(self, parents, related):
+        """
+        Attaches the objects from load_related() to their parents.
+        """
+        for obj in parents:
+            found = related.get(getattr(obj, self.mine), [])
+            if self.collection:
+                self.attach(obj, found)
+            else:
+                self.attach(obj, found[0] if found else None)
+        
     def join_via(self, query):
-        fmt_via_join = u"JOIN {via_table} ON ({via_mine} = {my_id})".\
+        """
+        Joins the link table to a query on the entity table.
+        """
+        fmt_via_join = u"JOIN {via_table} ON ({via_theirs} = {their_id})".\
             format(
                    via_table = self.via_table,
-                   via_mine = u'"{0}"."{1}"'.\
-                        format(self.via_table, self.via_mine),
-                   my_id = getattr(self.parent, self.mine)
-                   )
-        fmt_theirs_join = u"JOIN {their_table} ON ({via_theirs} = {their_id})".\
-            format(
-                   their_table = self.entity.__table__,
-                   via_theirs = self.via_theirs,
-                   their_id = getattr(self.entity, self.theirs)
+                   via_theirs = u'"{0}"."{1}"'.\
+                        format(self.via_table, self.via_theirs),
+                   their_id = getattr(self.get_entity(), self.theirs)
                    )
-        query.add_join(fmt_via_join, fmt_theirs_join)
+        query.add_join(fmt_via_join)
         return query
     
     def join_theirs(self, query):
+        """
+        Joins the entity table to a query on the parent table.
+        """
         fmt_join = u"JOIN {their_table} ON ({their_id} = {mine_id})".\
             format(
-                   their_table = self.entity.__table__,
-                   their_id = getattr(self.entity, self.theirs),
-                   mine_id = getattr(self.parent.__class__, self.mine)
+                   their_table = self.get_entity().__table__,
+                   their_id = getattr(self.get_entity(), self.theirs),
+                   mine_id = getattr(self.parent, self.mine)
                    )
         query.add_join(fmt_join)
         return query
@@ -250,26 +1283,190 @@ class Relationship(object): #IGNORE:R0902
     def __get__(self, obj, objtype=None):
         if obj is None:
             raise ValueError("Cannot query relationship on an unbounded object")
-        if isinstance(self.entity, str):
-            self.entity = get_dao(self.entity)
-        conn = obj.__connection__
-        collection = obj.__class__.load_by(conn)
+        value = self.loaded(obj)
+        if value is not _UNLOADED:
+            return value
+        if self.is_primary_lookup():
+            return self.get_entity().load_by_primary(obj.__connection__,
+                                                     getattr(obj, self.mine))
+        collection = self.lazy_collection(obj)
+        if self.collection:
+            return collection
+        return collection.first()
+    
+    def is_primary_lookup(self):
+        """
+        @return: whether the relationship is a single object
+                 looked up by its primary key
+        """
+        return not self.collection and self.via_table is None \
+            and self.theirs == self.get_entity().__primary__
+    
+    def lazy_collection(self, obj):
+        """
+        @return: the L{Collection} of objects related to obj
+        """
+        entity = self.get_entity()
+        collection = entity.load_by(obj.__connection__)
         if self.via_table is not None:
             self.join_via(collection.query)
+            column = u'"{0}"."{1}"'.format(self.via_table, self.via_mine)
         else:
-            self.join_theirs(collection.query)
-        my_name = getattr(self.parent.__class__, self.mine)
-        collection.query.add_where(u"{my_id} = %({rel}_{my_id_short})s".\
-                                   format(
-                                          my_id = my_name,
-                                          my_id_short = self.mine,
-                                          rel = self.name
-                                          ))
-        collection.query.bound_parameters[self.name + '_' + self.mine] = \
-            getattr(self.parent, self.mine)
-        if self.collection:
-            return collection
-        return next(collection)
+            column = getattr(entity, self.theirs)
+        param = u'{0}_{1}'.format(self.name, self.mine)
+        collection.query.add_where(u"{0} = %({1})s".format(column, param))
+        collection.query.bound_parameters[param] = getattr(obj, self.mine)
+        return collection
+
+
+class HydrationPlan(object):
+    """
+    Maps the columns of a result set onto the attributes of a DAO
+    class. A plan is computed once per class and cursor description,
+    after which rows are put straight into instance storage, without
+    an intermediate dict or a setattr() call per column.
+    
+    Classes which override __new__, __init__ or __setattr__ are
+    hydrated through the constructor, as they may rely on it.
+    
+    When the primary key is in the result set, the fields which are
+    not are deferred: they hold a L{DeferredBatch} shared by the
+    objects made by one hydrate_many() call.
+    """
+    CONSTRUCTOR = 'constructor'
+    DICT = 'dict'
+    SLOTS = 'slots'
+
+    def __init__(self, cls, description):
+        self.cls = cls
+        self.description = description
+        self.names = tuple(col[0] for col in description)
+        self.defaults = tuple((name, func) for name, func in cls._mutables
+                              if name not in self.names)
+        self.deferred = ()
+        self.key_index = None
+        if cls.__primary__ in self.names:
+            self.deferred = tuple(sorted(cls._fields - set(self.names)))
+            self.key_index = self.names.index(cls.__primary__)
+        self.setters = None
+        if not self._is_plain(cls):
+            self.mode = self.CONSTRUCTOR
+        elif cls.__compact__:
+            self.setters = self._slot_setters(
+                cls, self.names + ('__connection__', '__changed__'))
+            self.mode = self.SLOTS if self.setters else self.CONSTRUCTOR
+        elif all(self._is_plain_attr(cls, name) for name in self.names):
+            self.mode = self.DICT
+        else:
+            self.mode = self.CONSTRUCTOR
+
+    @property
+    def direct(self):
+        return self.mode != self.CONSTRUCTOR
+
+    @staticmethod
+    def _is_plain(cls):
+        for name in ('__new__', '__init__', '__setattr__'):
+            owner = next(klass for klass in cls.__mro__
+                         if name in klass.__dict__)
+            if owner is not BaseDAO and owner is not object:
+                return False
+        return True
+
+    @staticmethod
+    def _is_plain_attr(cls, name):
+        attr = getattr(cls, name, None) if name not in cls._fields \
+            else None
+        return not hasattr(attr, '__set__')
+
+    @staticmethod
+    def _slot_setters(cls, names):
+        """
+        @return: the slot member setters for names, or None if
+                 some of them are not slots
+        """
+        setters = []
+        for name in names:
+            if name in cls._fields:
+                name = '_{0}_value'.format(name)
+            member = getattr(cls, name, None)
+            if type(member).__name__ != 'member_descriptor':
+                return None
+            setters.append(member.__set__)
+        return tuple(setters)
+
+    def hydrate(self, row, conn):
+        """
+        @return: an instance made from a single row
+        """
+        return self.hydrate_many((row,), conn)[0]
+
+    def hydrate_many(self, rows, conn):
+        """
+        @return: list of instances made from rows
+        """
+        if not events.hooks:
+            return self._hydrate_many(rows, conn)
+        events.emit('hydrate_start', dao=self.cls, rows=len(rows),
+                    mode=self.mode)
+        started = time.time()
+        result = self._hydrate_many(rows, conn)
+        events.emit('hydrate_end', dao=self.cls, rows=len(rows),
+                    mode=self.mode, started=started,
+                    duration=time.time() - started)
+        return result
+
+    def _hydrate_many(self, rows, conn):
+        cls = self.cls
+        names = self.names
+        deferred = self.deferred
+        batch = None
+        if deferred:
+            batch = DeferredBatch(cls, conn, deferred,
+                                  [row[self.key_index] for row in rows])
+        if self.mode == self.CONSTRUCTOR:
+            result = [cls(__conn__=conn, **dict(izip(names, row)))
+                      for row in rows]
+            if deferred:
+                fields = [cls._field_objects[x] for x in deferred]
+                for obj in result:
+                    for field in fields:
+                        field.store(obj, batch)
+            return result
+        new = object.__new__
+        defaults = self.defaults
+        result = []
+        append = result.append
+        if self.mode == self.SLOTS:
+            setters = self.setters[:-2]
+            set_connection, set_changed = self.setters[-2:]
+            deferred_setters = ()
+            if deferred:
+                deferred_setters = self._slot_setters(cls, deferred)
+            for row in rows:
+                obj = new(cls)
+                for setter, value in izip(setters, row):
+                    setter(obj, value)
+                for setter in deferred_setters:
+                    setter(obj, batch)
+                set_connection(obj, conn)
+                set_changed(obj, set())
+                for name, func in defaults:
+                    setattr(obj, name, func())
+                append(obj)
+            return result
+        for row in rows:
+            obj = new(cls)
+            data = dict(izip(names, row))
+            for name in deferred:
+                data[name] = batch
+            data['__connection__'] = conn
+            data['__changed__'] = set()
+            for name, func in defaults:
+                data[name] = func()
+            obj.__dict__ = data
+            append(obj)
+        return result
 
 
 class DataObjectMeta(type):
@@ -277,12 +1474,45 @@ class DataObjectMeta(type):
     def __new__(mcs, classname, bases, classdict):
         mutables = find_mutables(classdict, bases)
         fields = find_fields(classdict, bases)
-        rels = find_relationships(classdict, bases, mcs)
+        rels = find_relationships(classdict, bases)
         classdict['_mutables'] = mutables
         classdict['_fields'] = fields
         classdict['_relationships'] = rels
-        __DAO__[mcs.__name__] = mcs
-        return type.__new__(mcs, classname, bases, classdict)
+        classdict['_plans'] = {}
+        if classdict.get('__compact__') and '__slots__' not in classdict:
+            classdict['__slots__'] = compact_slots(bases, fields, mutables,
+                                                   rels)
+        cls = type.__new__(mcs, classname, bases, classdict)
+        cls._field_objects = dict(
+            (name, next(klass.__dict__[name] for klass in cls.__mro__
+                        if name in klass.__dict__))
+            for name in fields)
+        for name in rels:
+            if name in classdict:
+                classdict[name].parent = cls
+        __DAO__[classname] = cls
+        return cls
+
+    def hydration_plan(cls, description):
+        """
+        Returns the hydration plan for a cursor description,
+        computing it on first use.
+        
+        @param description: DB-API cursor description
+        @return: L{HydrationPlan}
+        """
+        plans = cls._plans
+        # the plan used last is kept under None, so that consecutive rows
+        # of one result set skip building the key
+        plan = plans.get(None)
+        if plan is not None and plan.description is description:
+            return plan
+        key = tuple(col[0] for col in description)
+        plan = plans.get(key)
+        if plan is None:
+            plan = plans[key] = HydrationPlan(cls, description)
+        plans[None] = plan
+        return plan
 
 
 def find_fields(classdict, bases):
@@ -290,25 +1520,40 @@ def find_fields(classdict, bases):
     for name, value in classdict.items():
         if isinstance(value, Field):
             value._name = name
+            value._slot = '_{0}_value'.format(name)
             found_fields.add(name)
     for base in bases:
-        if hasattr(base, '_fields'):
-            for name, value in base._fields:
+        if getattr(base, '_fields', None):
+            for name in base._fields:
                 if not name in found_fields:
                     found_fields.add(name)
     return frozenset(found_fields)
 
 
-def find_relationships(classdict, bases, cls):
+def compact_slots(bases, fields, mutables, rels):
+    """
+    Computes __slots__ for a compact class: one slot per field,
+    mutable and relationship, and the bookkeeping attributes,
+    skipping those which are already provided by a base class.
+    """
+    wanted = ['__connection__', '__changed__', '__original__']
+    wanted.extend(sorted(name for name, _ in mutables))
+    wanted.extend('_{0}_value'.format(name) for name in sorted(fields))
+    wanted.extend('_{0}_related'.format(name) for name in sorted(rels))
+    return tuple(name for name in wanted
+                 if not any(hasattr(base, name) for base in bases))
+
+
+def find_relationships(classdict, bases):
     found_rels = set()
     for name, value in classdict.items():
         if isinstance(value, Relationship):
             value.name = name
-            value.parent = cls
+            value._slot = '_{0}_related'.format(name)
             found_rels.add(name)
     for base in bases:
-        if hasattr(base, '_relationships'):
-            for name, value in base._relationships:
+        if getattr(base, '_relationships', None):
+            for name in base._relationships:
                 if not name in found_rels:
                     found_rels.add(name)
     return frozenset(found_rels)
@@ -330,7 +1575,7 @@ def find_mutables(classdict, bases):
                 mutables.add(create_default(name, value))
                 del classdict[name]
     for base in bases:
-        if hasattr(base, '_mutables'):
+        if getattr(base, '_mutables', None):
             for name, value in base._mutables:
                 if not name in found_mutables:
                     found_mutables.add(name)
@@ -339,12 +1584,27 @@ def find_mutables(classdict, bases):
 
 
 class BaseDAO(object):
+    """
+    The base class of data objects.
+    
+    Set __compact__ = True in a subclass to store its fields in
+    __slots__ instead of a per-instance __dict__. Compact objects
+    take a fraction of the memory, at the price of not accepting
+    attributes which are neither fields nor mutables. The __dict__
+    only goes away if every DAO base class is compact as well.
+    
+    Set __unique__ to a tuple of field names to make upserts
+    detect conflicts on that unique key instead of __primary__.
+    """
+    __slots__ = ()
     _mutables = None
     _immutables = None
     _fields = None
     __metaclass__ = DataObjectMeta
     __table__ = None
     __primary__ = 'id'
+    __unique__ = None
+    __compact__ = False
     id = Field(None)
 
     def __new__(cls, **kwargs):
@@ -359,12 +1619,95 @@ class BaseDAO(object):
         self.__changed__ = set()
         for key, val in kwargs.iteritems():
             setattr(self, key, val)
+        self.reset_changes()
+    
+    def reset_changes(self):
+        """
+        Makes the current field values the loaded ones,
+        so that nothing counts as changed.
+        """
         self.__changed__ = set()
+        if getattr(self, '__original__', None) is not None:
+            self.__original__ = None
     
-    def __setattr__(self, attr, value):
-        if attr in self._mutables:
-            self.__changed__.add(attr)
-        object.__setattr__(attr, value)
+    def mark_changed(self, *names):
+        """
+        Flags fields as changed, e.g. after a list or dict held
+        by one of them was modified in place, which assignment
+        tracking cannot see.
+        """
+        for name in names:
+            if name not in self._fields:
+                raise ValueError("{0} has no field {1}".\
+                                 format(self.__class__.__name__, name))
+            self.__changed__.add(name)
+    
+    def original(self, name):
+        """
+        @return: the value field name had when it was loaded
+        """
+        originals = getattr(self, '__original__', None)
+        if originals and name in originals:
+            return originals[name]
+        return getattr(self, name)
+    
+    def changes(self):
+        """
+        @return: dict of changed field name to (loaded value,
+                 current value)
+        """
+        return dict((name, (self.original(name), getattr(self, name)))
+                    for name in self.__changed__)
+    
+    def assigned_fields(self):
+        """
+        @return: frozenset of the names of the fields which hold
+                 a value of their own rather than the class default,
+                 leaving out deferred fields which are not loaded
+        """
+        result = set()
+        for name in self._fields:
+            field = self._field_objects[name]
+            if self.__compact__:
+                value = getattr(self, field._slot, field)
+            else:
+                value = self.__dict__.get(name, field)
+            if value is not field and value.__class__ is not DeferredBatch:
+                result.add(name)
+        return frozenset(result)
+    
+    def snapshot(self):
+        """
+        Takes a copy of the loaded field values, to be compared
+        with them later by L{diff}. Lists, dicts and sets are copied
+        deeply, so that changes made to them in place show up.
+        
+        @return: dict of field name to value
+        """
+        result = {}
+        for name in self._fields:
+            value = self._field_objects[name].raw(self)
+            if value.__class__ is DeferredBatch:
+                continue
+            if isinstance(value, (list, dict, set)):
+                value = copy.deepcopy(value)
+            result[name] = value
+        return result
+    
+    def diff(self, snapshot):
+        """
+        @param snapshot: what L{snapshot} returned earlier
+        @return: dict of field name to (value in the snapshot,
+                 current value) for the fields which differ
+        """
+        result = {}
+        for name, old in snapshot.iteritems():
+            value = self._field_objects[name].raw(self)
+            if value.__class__ is DeferredBatch:
+                continue
+            if not same_value(old, value):
+                result[name] = (old, value)
+        return result
     
     @classmethod
     def fetch_dict_one(cls, cursor):
@@ -376,33 +1719,93 @@ class BaseDAO(object):
         @return: dict
         """
         row = cursor.fetchone()
+        if row is None:
+            raise StopIteration
+        return cls.row_to_dict(cursor.description, row)
+
+    @classmethod
+    def row_to_dict(cls, description, row):
+        """
+        Make a fetched row into a dictionary.
+        
+        @param description: DB-API cursor description
+        @param row: the row
+        @return: dict
+        """
         result = {}
-        description = cursor.description
-        i = 0
-        for i in range(len(description) - 1):
+        for i in range(len(description)):
             result[description[i][0]] = row[i]
         return result
     
     def save(self):
         """
         Insert or update this object into the database.
+        An object with a primary key and no changes is left alone.
+        """
+        statement = self.save_statement()
+        if statement is None:
+            return
+        self.forget()
+        with acquire(self.__connection__) as conn:
+            cur = conn.cursor()
+            prepared.execute(cur, statement, self.__class__)
+            self.update_from_row(cur.description, cur.fetchone())
+    
+    def save_statement(self):
+        """
+        An INSERT writes the fields which were given a value, leaving
+        the others to database defaults; an UPDATE writes the changed
+        fields only.
+        
+        @return: the INSERT or UPDATE statement which saves this
+                 object, or None if it has nothing to write
         """
-        values = {}
-        for field in self.__changed__:
-            values[field] = getattr(self, field)
-            
         if getattr(self, self.__primary__) is None:
+            # a primary key set to None is left to the database default
+            names = (self.assigned_fields() | self.__changed__) - \
+                frozenset([self.__primary__])
             statement = Insert(self.__table__)
-            statement.add_values(**values)
+            if names:
+                statement.add_values(**dict((x, getattr(self, x))
+                                            for x in names))
+            else:
+                statement.add_values(**{self.__primary__:
+                                        Literal(u'DEFAULT')})
         else:
+            if not self.__changed__:
+                return None
             statement = Update(self.__table__)
-            statement.add_set(**values)
-        statement.add_returning(*self._values)
-        cur = self.__connection__.cursor()
-        cur.execute(unicode(statement), statement.bound_parameters)
-        row = self.fetch_dict_one(cur)
-        [setattr(self, key, val) for key, val in row.items()]
-        self.__changed__ = set()
+            statement.add_set(**dict((x, getattr(self, x))
+                                     for x in self.__changed__))
+            statement.add_where(u'{0} = %(__primary__)s'.\
+                                format(self.__primary__))
+            statement.bound_parameters['__primary__'] = \
+                self.original(self.__primary__)
+        # deferred fields stay deferred rather than being read back
+        statement.add_returning(*sorted(self._fields -
+                                        self.deferred_fields()))
+        return statement
+    
+    def update_from_row(self, description, row):
+        """
+        Sets the values returned by the database after a write.
+        """
+        fields = self._field_objects
+        for key, val in self.row_to_dict(description, row).iteritems():
+            if key in fields:
+                fields[key].store(self, val)
+            else:
+                setattr(self, key, val)
+        self.reset_changes()
+    
+    def forget(self):
+        """
+        Evicts this object from the identity map of its
+        connection, if there is one.
+        """
+        identity_map = getattr(self.__connection__, 'identity_map', None)
+        if identity_map is not None:
+            identity_map.discard(self)
         
     def delete(self):
         """
@@ -410,14 +1813,27 @@ class BaseDAO(object):
         NB: if you plan on inserting it again and use surrogate
         keys, you will need to set them to None.
         """
+        statement = self.delete_statement()
+        if statement is None:
+            return None
+        self.forget()
+        with acquire(self.__connection__) as conn:
+            cur = conn.cursor()
+            prepared.execute(cur, statement, self.__class__)
+            return cur.rowcount
+    
+    def delete_statement(self):
+        """
+        @return: the DELETE statement for this object, or None
+                 if it has no primary key
+        """
         if getattr(self, self.__primary__) is None:
             return None
         statement = Delete(self.__table__)
         statement.add_where('{0} = %({0})s'.format(self.__primary__))
-        statement.bound_parameters[self.__primary__] = getattr(self.__primary__)
-        cur = self.__connection__.cursor()
-        cur.execute(unicode(statement), statement.bound_parameters)
-        return cur.rowcount
+        statement.bound_parameters[self.__primary__] = \
+            getattr(self, self.__primary__)
+        return statement
     
     @classmethod
     def from_cursor(cls, cur, conn):
@@ -429,48 +1845,367 @@ class BaseDAO(object):
                      for objects
         @return: list of DAO objects
         """
-        result = []
-        while True:
-            try:
-                data = cls.fetch_dict_one(cur)
-            except:
-                break
-            inst = cls(__conn__=conn, **data)
-            result.append(inst)
-        return result
+        rows = cur.fetchall()
+        if not rows:
+            return []
+        if events.hooks:
+            events.emit('rows_fetched', dao=cls, rows=len(rows))
+        return cls.hydration_plan(cur.description).hydrate_many(rows, conn)
+    
+    @classmethod
+    def from_rows(cls, description, rows, conn):
+        """
+        Hydrates objects from already fetched rows.
+        
+        @param description: DB-API cursor description
+        @param rows: sequence of rows
+        @param conn: the database connection to be used for objects
+        @return: list of DAO objects
+        """
+        return cls.hydration_plan(description).hydrate_many(rows, conn)
     
     @classmethod
     def one_from_cursor(cls, cur, conn):
-        data = cls.fetch_dict_one(cur)
-        inst = cls(__conn__=conn, **data)
-        return inst
+        row = cur.fetchone()
+        if row is None:
+            raise StopIteration
+        if events.hooks:
+            events.emit('rows_fetched', dao=cls, rows=1)
+        return cls.hydration_plan(cur.description).hydrate(row, conn)
     
     @classmethod
     def load_by(cls, conn, *args, **kwargs):
+        """
+        Makes a collection of objects matching the conditions.
+        Positional arguments are WHERE conditions or eager loading
+        options (see L{prefetch} and L{joined}); keyword arguments
+        are column values to match.
+        
+        @return: L{Collection}
+        """
         statement = Select()
-        statement.add_fields([u'"{0}"."{1}"'.\
-                              format(cls.__table__, x) for x in cls._fields])
+        statement.add_fields(*cls.field_list())
         statement.add_from(cls.__table__)
+        options = []
         for lit in args:
-            statement.add_where(lit)
+            if isinstance(lit, (EagerLoad, Projection)):
+                options.append(lit)
+            else:
+                statement.add_where(lit)
         for nonlit, value in kwargs.iteritems():
             statement.add_where(u'{0} = %({0})s'.format(nonlit))
             statement.bound_parameters[nonlit] = value
-        return Collection(statement, conn, cls)
+        return Collection(statement, conn, cls).options(*options)
+
+    @classmethod
+    def field_list(cls, names=None):
+        """
+        @param names: the fields to list, by default all of them
+        @return: qualified names of the fields, in a stable order
+        """
+        if names is None:
+            names = cls._fields
+        return [u'"{0}"."{1}"'.format(cls.__table__, x)
+                for x in sorted(names)]
+
+    def deferred_fields(self):
+        """
+        @return: the names of the deferred fields not loaded yet
+        """
+        return frozenset(name for name, field in
+                         self._field_objects.iteritems()
+                         if field.raw(self).__class__ is DeferredBatch)
+
+    @classmethod
+    def load_deferred(cls, conn, names, keys):
+        """
+        Fetches the fields called names of the rows with
+        the primary keys keys.
+        
+        @return: dict of primary key to the tuple of values
+        """
+        statement = Select()
+        statement.add_fields(*cls.field_list([cls.__primary__]))
+        statement.add_fields(*[u'"{0}"."{1}"'.format(cls.__table__, x)
+                               for x in names])
+        statement.add_from(cls.__table__)
+        statement.add_where(u'"{0}"."{1}" = ANY(%(keys)s)'.\
+                            format(cls.__table__, cls.__primary__))
+        statement.bound_parameters['keys'] = list(keys)
+        with acquire(conn) as real:
+            cur = real.cursor()
+            prepared.execute(cur, statement, cls)
+            rows = cur.fetchall()
+        return dict((row[0], tuple(row[1:])) for row in rows)
+
+    @classmethod
+    def get_relationship(cls, name):
+        """
+        @return: the L{Relationship} descriptor called name
+        """
+        for klass in cls.__mro__:
+            if isinstance(klass.__dict__.get(name), Relationship):
+                return klass.__dict__[name]
+        raise AttributeError("{0} has no relationship {1}".\
+                             format(cls.__name__, name))
 
     @classmethod
     def load_by_primary(cls, conn, value):
         """
         Fetch and hydrate an object by its primary key.
+        When conn has an identity map (see L{session.Session}),
+        it is consulted first.
         
         @param conn: database connection object
         @param value: the value of primary key
+        @return: the object, or None if there is no such row
         
         @todo: make it usable for composite keys
         """
+        identity_map = getattr(conn, 'identity_map', None)
+        if identity_map is not None:
+            obj = identity_map.get(cls, value)
+            if obj is not None:
+                return obj
         params = { cls.__primary__ : value }
-        return cls.load_by(conn, **params)
+        obj = cls.load_by(conn, **params).first()
+        if obj is not None and identity_map is not None:
+            identity_map.add(obj)
+        return obj
+
+    @classmethod
+    def copy_from(cls, conn, rows, columns=None, format=CopyLoader.TEXT): #IGNORE:W0622
+        """
+        Bulk-loads rows with COPY ... FROM STDIN.
+        See L{CopyLoader}.
+        
+        @param conn: database connection object
+        @param rows: an iterable of objects, dicts or tuples
+        @return: dict with rows, seconds and rows_per_second
+        """
+        with acquire(conn) as real:
+            return CopyLoader(cls, columns, format).load(real, rows)
+
+    @classmethod
+    def insert_many(cls, conn, objects, max_parameters=None,
+                    changed_only=False):
+        """
+        Inserts many objects using multi-row INSERT statements,
+        and updates them from the rows the database returns.
+        Objects with no primary key set leave it to the database
+        default.
+        
+        @param conn: database connection object
+        @param objects: DAO objects, all of this class
+        @param max_parameters: upper bound of bound parameters
+                               per statement
+        @param changed_only: insert only the fields which were given
+                             a value, as save() does, leaving the others
+                             to database defaults; objects are then
+                             grouped by their set of such fields
+        @return: the list of objects
+        """
+        objects = list(objects)
+        groups = OrderedDict()
+        for obj in objects:
+            columns = cls._fields
+            if changed_only:
+                columns = obj.assigned_fields() | obj.__changed__
+            if getattr(obj, cls.__primary__) is None:
+                columns = columns - frozenset([cls.__primary__])
+            if not columns:
+                columns = cls._fields - frozenset([cls.__primary__])
+            groups.setdefault(columns, []).append(obj)
+        returning = sorted(cls._fields)
+        with acquire(conn) as real:
+            cls._insert_groups(conn, real.cursor(), groups, returning,
+                               max_parameters)
+        return objects
+    
+    @classmethod
+    def _insert_groups(cls, conn, cur, groups, returning, max_parameters):
+        for columns, group in groups.iteritems():
+            statement = Insert(cls.__table__)
+            statement.add_rows(*[dict((col, getattr(obj, col))
+                                      for col in columns) for obj in group])
+            statement.add_returning(*returning)
+            pos = 0
+            for chunk in statement.split(max_parameters):
+                events.execute(cur, chunk, cls)
+                description = cur.description
+                for row in cur.fetchall():
+                    obj = group[pos]
+                    pos += 1
+                    obj.update_from_row(description, row)
+                    obj.__connection__ = conn
 
-    def __getattribute__(self, attr):
-        print self
-        return super(BaseDAO, self).__getattribute__(attr)
+    def upsert(self, key=None, update=None, where=None):
+        """
+        Inserts this object, or updates the row it conflicts with,
+        in one statement. See L{upsert_many}.
+        
+        @return: False if the row was left alone (DO NOTHING or
+                 a where condition not met), True otherwise
+        """
+        return self.upsert_many(self.__connection__, [self], key, update,
+                                where) == 1
+    
+    @classmethod
+    def upsert_many(cls, conn, objects, key=None, update=None, where=None, #IGNORE:R0913
+                    max_parameters=None):
+        """
+        Inserts many objects with multi-row INSERT ... ON CONFLICT
+        statements, updating the rows they conflict with instead,
+        and updates the objects from the rows the database returns.
+        Objects with the same key are written once, the last one
+        winning, as one statement cannot change a row twice.
+        Returned rows are matched to the objects by their key, which
+        must come back as it was written: a key the database changes,
+        such as one in a char(n) column, raises ValueError.
+        
+        @param conn: database connection object
+        @param objects: DAO objects, all of this class
+        @param key: the conflict key, a tuple of field names;
+                    by default __unique__, or else __primary__
+        @param update: the fields to update on conflict, by default
+                       all written fields but the key and the primary
+                       key; an empty list leaves conflicting rows
+                       alone (DO NOTHING)
+        @param where: the condition of the update
+        @param max_parameters: upper bound of bound parameters
+                               per statement
+        @return: the number of rows written
+        """
+        if key is None:
+            key = cls.__unique__ or (cls.__primary__,)
+        key = tuple(key)
+        latest = OrderedDict()
+        for obj in objects:
+            values = tuple(getattr(obj, x) for x in key)
+            if None in values:
+                raise ValueError("Cannot upsert an object without "
+                                 "a value for {0}".format(u', '.join(key)))
+            latest.setdefault(values, []).append(obj)
+        groups = OrderedDict()
+        for same in latest.itervalues():
+            obj = same[-1]
+            columns = cls._fields
+            if getattr(obj, cls.__primary__) is None:
+                columns = columns - frozenset([cls.__primary__])
+            groups.setdefault(columns, []).append(obj)
+        count = 0
+        with acquire(conn) as real:
+            cur = real.cursor()
+            for columns, group in groups.iteritems():
+                statement = Insert(cls.__table__)
+                statement.add_rows(*[dict((col, getattr(obj, col))
+                                          for col in columns)
+                                     for obj in group])
+                changes = update
+                if changes is None:
+                    # the key and the primary key of a row stay as they are
+                    changes = sorted(columns - frozenset(key) -
+                                     frozenset([cls.__primary__]))
+                statement.add_on_conflict(*key, update=changes, where=where)
+                statement.add_returning(*sorted(cls._fields))
+                for chunk in statement.split(max_parameters):
+                    events.execute(cur, chunk, cls)
+                    description = cur.description
+                    for row in cur.fetchall():
+                        data = cls.row_to_dict(description, row)
+                        values = tuple(data[x] for x in key)
+                        if values not in latest:
+                            raise ValueError(
+                                "Row returned for {0} = {1!r} matches no "
+                                "object: the database changed the key "
+                                "value".format(u', '.join(key), values))
+                        for obj in latest[values]:
+                            obj.update_from_row(description, row)
+                            obj.__connection__ = conn
+                        count += 1
+        return count
+    
+    @classmethod
+    def update_many(cls, conn, objects, max_parameters=None):
+        """
+        Writes the changed fields of many objects with
+        UPDATE ... FROM (VALUES ...) statements, one per set of
+        changed fields and chunk, and updates the objects from
+        the rows the database returns. Unchanged objects are skipped.
+        
+        @param conn: database connection object
+        @param objects: DAO objects, all of this class, with
+                        primary keys
+        @param max_parameters: upper bound of bound parameters
+                               per statement
+        @return: the number of objects written
+        """
+        groups = OrderedDict()
+        for obj in objects:
+            if not obj.__changed__:
+                continue
+            if getattr(obj, cls.__primary__) is None:
+                raise ValueError("Cannot update an object "
+                                 "without a primary key")
+            if cls.__primary__ in obj.__changed__:
+                raise ValueError("Cannot update the primary key "
+                                 "of several objects at once")
+            groups.setdefault(frozenset(obj.__changed__), []).append(obj)
+        count = 0
+        with acquire(conn) as real:
+            cur = real.cursor()
+            for columns, group in groups.iteritems():
+                for statement, chunk in cls.update_statements(
+                        columns, group, max_parameters):
+                    events.execute(cur, statement, cls)
+                    by_key = dict((getattr(obj, cls.__primary__), obj)
+                                  for obj in chunk)
+                    description = cur.description
+                    for row in cur.fetchall():
+                        data = cls.row_to_dict(description, row)
+                        by_key[data[cls.__primary__]].\
+                            update_from_row(description, row)
+                    count += len(chunk)
+        return count
+    
+    @classmethod
+    def update_statements(cls, columns, objects, max_parameters=None):
+        """
+        Builds UPDATE ... FROM (VALUES ...) statements setting columns
+        of objects to their current values. The first VALUES row is
+        NULLs taken from the table's row type, so that the values
+        get the types of the columns they are written to.
+        
+        @return: list of (Update statement, objects it writes) pairs
+        """
+        if max_parameters is None:
+            max_parameters = Insert.max_parameters
+        table = cls.__table__
+        primary = cls.__primary__
+        columns = sorted(columns)
+        names = [primary] + columns
+        typed = u'({0})'.format(u', '.join(
+            u'(NULL::"{0}")."{1}"'.format(table, x) for x in names))
+        chunk_size = max(1, max_parameters // len(names))
+        result = []
+        for start in range(0, len(objects), chunk_size):
+            chunk = objects[start:start + chunk_size]
+            statement = Update(table)
+            statement.add_set(**dict((x, Literal(u'"v"."{0}"'.format(x)))
+                                     for x in columns))
+            rows = [typed]
+            for index, obj in enumerate(chunk):
+                buf = []
+                for col in names:
+                    name = u'{0}_{1}'.format(col, index)
+                    statement.bound_parameters[name] = getattr(obj, col)
+                    buf.append(u'%({0})s'.format(name))
+                rows.append(u'({0})'.format(u', '.join(buf)))
+            statement.add_from(u'(VALUES {0}) AS "v" ({1})'.format(
+                u', '.join(rows),
+                u', '.join(u'"{0}"'.format(x) for x in names)))
+            statement.add_where(u'"{0}"."{1}" = "v"."{1}"'.\
+                                format(table, primary))
+            statement.add_returning(*cls.field_list())
+            result.append((statement, chunk))
+        return result
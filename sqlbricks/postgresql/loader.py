@@ -0,0 +1,271 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Coalescing of primary key lookups.
+
+Independent pieces of code which each need one row by its primary
+key can ask a L{BatchLoader} instead of calling load_by_primary().
+The loader hands out futures and collects the keys asked for until
+it is dispatched, then fetches all of them with one
+
+  SELECT ... WHERE pk = ANY(%(keys)s)
+
+per chunk of keys, and resolves every future with its object, or
+with None when there is no such row. A key asked for several times
+is fetched once.
+
+A batch is dispatched by an explicit call to dispatch(), after a
+window of time, or by a scheduler:
+
+  # threads: batch what arrives within 2ms; conn should be a pool
+  loader = BatchLoader(User, pool, window=0.002)
+  user = loader.load(user_id).result()
+
+  # asyncio: batch what is asked for in one turn of the event loop,
+  # fetch in a thread pool and resolve the futures in the loop
+  loader = BatchLoader(User, pool, schedule=loop.call_soon,
+                       future=loop.create_future, executor=executor,
+                       deliver=loop.call_soon_threadsafe)
+  user = await loader.load(user_id)
+
+Without a window or a scheduler, waiting on a result dispatches
+the batch it is in. Without an executor, the query runs in whatever
+calls dispatch(), which blocks an event loop for its duration.
+'''
+
+from collections import OrderedDict
+import sys
+import threading
+
+from .aio import Future
+
+class LoadTimeout(RuntimeError):
+    """
+    Raised when a result did not arrive in time.
+    """
+
+
+class LoadFuture(Future):
+    """
+    A thread-safe future whose result() blocks until it is done.
+    """
+
+    def __init__(self, loader=None):
+        super(LoadFuture, self).__init__()
+        self._loader = loader
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+
+    def add_done_callback(self, func):
+        with self._lock:
+            if not self._done:
+                self._callbacks.append(func)
+                return
+        func(self)
+
+    def result(self, timeout=None):
+        if not self._done:
+            loader = self._loader
+            if loader is not None and loader.on_demand:
+                loader.dispatch()
+            if not self._event.wait(timeout):
+                raise LoadTimeout("No result after {0}s".format(timeout))
+        return super(LoadFuture, self).result()
+
+    def _finish(self):
+        with self._lock:
+            self._done = True
+            self._loader = None
+            callbacks, self._callbacks = self._callbacks, []
+        self._event.set()
+        for func in callbacks:
+            func(self)
+
+
+class BatchLoader(object):
+    """
+    Coalesces primary key lookups of one DAO class into batches.
+
+    @param cls: the DAO class
+    @param conn: database connection object; with a window the batches
+                 run on a timer thread, so it should then be a pool
+    @param window: seconds to wait after the first key of a batch
+                   before dispatching it
+    @param chunk_size: the most keys fetched by one statement
+    @param schedule: callable taking a function to call soon, such as
+                     the call_soon() of an event loop; it is called
+                     with dispatch once per batch
+    @param future: callable making the futures handed out, which need
+                   set_result() and set_exception(); by default they
+                   are L{LoadFuture}s
+    @param executor: an object whose submit(func, *args) runs func
+                     elsewhere, such as a concurrent.futures executor;
+                     batches are then fetched through it
+    @param deliver: callable taking a function and its arguments,
+                    through which the futures are resolved once a batch
+                    is fetched, such as the call_soon_threadsafe() of
+                    an event loop; by default they are resolved by the
+                    thread which fetched the batch
+    """
+
+    def __init__(self, cls, conn, window=None, chunk_size=1000, #IGNORE:R0913
+                 schedule=None, future=None, executor=None, deliver=None):
+        if chunk_size < 1:
+            raise ValueError("chunk_size must be at least 1")
+        self.cls = cls
+        self.conn = conn
+        self.window = window
+        self.chunk_size = chunk_size
+        self.schedule = schedule
+        self.future = future
+        self.executor = executor
+        self.deliver = deliver
+        self.pending = OrderedDict()
+        self.requests = 0
+        self.batches = 0
+        self.queries = 0
+        self.keys = 0
+        self._timer = None
+        self._lock = threading.Lock()
+
+    @property
+    def on_demand(self):
+        """
+        Tells whether batches are dispatched by waiting on a result.
+        """
+        return self.window is None and self.schedule is None
+
+    def _make_future(self):
+        if self.future is None:
+            return LoadFuture(self)
+        return self.future()
+
+    def load(self, key):
+        """
+        @return: a future of the object with primary key key,
+                 or of None if there is no such row
+        """
+        identity_map = getattr(self.conn, 'identity_map', None)
+        if identity_map is not None:
+            obj = identity_map.get(self.cls, key)
+            if obj is not None:
+                future = self._make_future()
+                future.set_result(obj)
+                return future
+        future = self._make_future()
+        timer = None
+        with self._lock:
+            self.requests += 1
+            first = not self.pending
+            self.pending.setdefault(key, []).append(future)
+            if first and self.schedule is None and self.window is not None:
+                # armed under the lock, so that no batch gets two timers
+                timer = self._timer = threading.Timer(self.window,
+                                                      self.dispatch)
+                timer.daemon = True
+        if timer is not None:
+            timer.start()
+        elif first and self.schedule is not None:
+            self.schedule(self.dispatch)
+        return future
+
+    def load_many(self, keys):
+        """
+        @return: list of futures, one per key
+        """
+        return [self.load(x) for x in keys]
+
+    def dispatch(self):
+        """
+        Fetches the keys collected so far and resolves their futures,
+        or hands them to the executor to do so.
+
+        @return: the number of distinct keys in the batch
+        """
+        with self._lock:
+            pending, self.pending = self.pending, OrderedDict()
+            timer, self._timer = self._timer, None
+            if pending:
+                self.batches += 1
+                self.keys += len(pending)
+        if timer is not None:
+            timer.cancel()
+        if not pending:
+            return 0
+        if self.executor is not None:
+            self.executor.submit(self._run, pending)
+        else:
+            self._run(pending)
+        return len(pending)
+
+    def _run(self, pending):
+        found = exc_info = None
+        try:
+            found = self.fetch(list(pending))
+        except Exception: #IGNORE:W0703
+            exc_info = sys.exc_info()
+        if self.deliver is not None:
+            self.deliver(self._resolve, pending, found, exc_info)
+        else:
+            self._resolve(pending, found, exc_info)
+
+    def _resolve(self, pending, found, exc_info):
+        if exc_info is not None:
+            for futures in pending.itervalues():
+                for future in futures:
+                    self._fail(future, exc_info)
+            return
+        identity_map = getattr(self.conn, 'identity_map', None)
+        for key, futures in pending.iteritems():
+            obj = found.get(key)
+            if obj is not None and identity_map is not None:
+                identity_map.add(obj)
+            for future in futures:
+                if not future.done():
+                    future.set_result(obj)
+
+    @staticmethod
+    def _fail(future, exc_info):
+        if future.done():
+            return
+        if hasattr(future, 'set_exc_info'):
+            future.set_exc_info(exc_info)
+        else:
+            future.set_exception(exc_info[1])
+
+    def fetch(self, keys):
+        """
+        Loads the rows with the given primary keys, chunk_size
+        keys per statement.
+
+        @return: dict of primary key to object
+        """
+        cls = self.cls
+        condition = u'"{0}"."{1}" = ANY(%(keys)s)'.\
+            format(cls.__table__, cls.__primary__)
+        result = {}
+        for start in range(0, len(keys), self.chunk_size):
+            collection = cls.load_by(self.conn, condition)
+            collection.query.bound_parameters['keys'] = \
+                keys[start:start + self.chunk_size]
+            with self._lock:
+                self.queries += 1
+            for obj in collection:
+                result[getattr(obj, cls.__primary__)] = obj
+        return result
+
+    def stats(self):
+        """
+        @return: dict with requests, batches, queries, keys
+                 and pending
+        """
+        with self._lock:
+            return {
+                    'requests': self.requests,
+                    'batches': self.batches,
+                    'queries': self.queries,
+                    'keys': self.keys,
+                    'pending': len(self.pending),
+                    }
@@ -0,0 +1,272 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from collections import deque
+from contextlib import contextmanager
+import threading
+import time
+
+class PoolTimeout(RuntimeError):
+    """
+    Raised when no connection became available in time.
+    """
+
+
+class ConnectionPool(object):
+    """
+    A thread-safe pool of DB-API connections. A pool can be passed to
+    DAO methods and collections wherever a connection is expected:
+    each operation then checks a connection out, commits (or rolls
+    back on error) and returns it. Operations inside transaction()
+    all share one connection, committed when the scope ends.
+
+      pool = ConnectionPool(lambda: psycopg2.connect(dsn), maxsize=20)
+      user = User.load_by_primary(pool, 1)
+      with pool.transaction():
+          user.save()
+          order.save()
+
+    @param factory: callable making a new connection
+    @param minsize: connections opened up front and kept open
+    @param maxsize: the most connections open at once
+    @param timeout: seconds to wait for a connection before PoolTimeout
+    @param check: callable telling whether a connection is usable,
+                  called on checkout; by default closed connections
+                  are replaced
+    """
+
+    def __init__(self, factory, minsize=1, maxsize=10, timeout=30.0,
+                 check=None):
+        if minsize > maxsize:
+            raise ValueError("minsize cannot be greater than maxsize")
+        self.factory = factory
+        self.minsize = minsize
+        self.maxsize = maxsize
+        self.timeout = timeout
+        if check is not None:
+            self.check = check
+        self.idle = deque()
+        self.size = 0
+        self.waiting = 0
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.closed = False
+        self._cond = threading.Condition(threading.Lock())
+        self._local = threading.local()
+        for _ in range(minsize):
+            self.idle.append(self.factory())
+            self.size += 1
+
+    @staticmethod
+    def check(conn):
+        return not getattr(conn, 'closed', False)
+
+    def _pinned(self):
+        return getattr(self._local, 'pinned', None)
+
+    def getconn(self, timeout=None):
+        """
+        Checks a connection out, waiting up to timeout seconds
+        for one to be returned if the pool is exhausted. Inside
+        transaction() it is the connection of the scope.
+        """
+        pinned = self._pinned()
+        if pinned is not None:
+            pinned[1] += 1
+            return pinned[0]
+        if timeout is None:
+            timeout = self.timeout
+        started = time.time()
+        deadline = started + timeout
+        with self._cond:
+            if self.closed:
+                raise RuntimeError("The pool is closed")
+            while not self.idle and self.size >= self.maxsize:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    raise PoolTimeout("No connection available "
+                                      "in {0} seconds".format(timeout))
+                self.waiting += 1
+                try:
+                    self._cond.wait(remaining)
+                finally:
+                    self.waiting -= 1
+            if self.idle:
+                conn = self.idle.popleft()
+            else:
+                conn = None
+                self.size += 1
+            waited = time.time() - started
+            self.wait_time += waited
+            self.max_wait = max(self.max_wait, waited)
+            self.checkouts += 1
+        try:
+            if conn is None or not self.check(conn):
+                if conn is not None:
+                    self._close(conn)
+                    self.discarded += 1
+                conn = self.factory()
+        except:
+            with self._cond:
+                self.size -= 1
+                self._cond.notify()
+            raise
+        return conn
+
+    def putconn(self, conn, error=False):
+        """
+        Returns a connection, committing its work, or rolling it back
+        if error is true. Broken connections are closed and dropped.
+        """
+        pinned = self._pinned()
+        if pinned is not None and pinned[0] is conn:
+            pinned[1] -= 1
+            return
+        healthy = True
+        try:
+            if error:
+                conn.rollback()
+            else:
+                conn.commit()
+        except Exception: #IGNORE:W0703
+            healthy = False
+        if healthy:
+            healthy = self.check(conn)
+        with self._cond:
+            if healthy and not self.closed:
+                self.idle.append(conn)
+            else:
+                self.size -= 1
+                self.discarded += 1
+            self._cond.notify()
+        if not healthy or self.closed:
+            self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception: #IGNORE:W0703
+            pass
+
+    @contextmanager
+    def connection(self):
+        """
+        Checks a connection out for the duration of a with block.
+        """
+        conn = self.getconn()
+        try:
+            yield conn
+        except:
+            self.putconn(conn, error=True)
+            raise
+        self.putconn(conn)
+
+    @contextmanager
+    def transaction(self):
+        """
+        Pins one connection to the current thread for the duration
+        of a with block: every operation on the pool inside it uses
+        that connection, and it is committed, or rolled back on error,
+        when the block ends.
+        """
+        if self._pinned() is not None:
+            yield self._pinned()[0]
+            return
+        conn = self.getconn()
+        self._local.pinned = [conn, 0]
+        try:
+            yield conn
+        except:
+            self._local.pinned = None
+            self.putconn(conn, error=True)
+            raise
+        self._local.pinned = None
+        self.putconn(conn)
+
+    def cursor(self, *args, **kwargs):
+        """
+        Opens a cursor on the connection of the current transaction()
+        scope; outside of one there is no connection to use.
+        """
+        pinned = self._pinned()
+        if pinned is None:
+            raise RuntimeError("Pool cursors can only be opened "
+                               "inside transaction()")
+        return pinned[0].cursor(*args, **kwargs)
+
+    def close(self):
+        """
+        Closes idle connections; those checked out are closed when
+        they are returned.
+        """
+        with self._cond:
+            self.closed = True
+            idle, self.idle = list(self.idle), deque()
+            self.size -= len(idle)
+            self._cond.notify_all()
+        for conn in idle:
+            self._close(conn)
+
+    def stats(self):
+        """
+        @return: dict with size, idle, in_use, waiting, minsize, maxsize,
+                 utilization, checkouts, timeouts, discarded,
+                 wait_time and max_wait
+        """
+        with self._cond:
+            in_use = self.size - len(self.idle)
+            return {
+                    'size': self.size,
+                    'idle': len(self.idle),
+                    'in_use': in_use,
+                    'waiting': self.waiting,
+                    'minsize': self.minsize,
+                    'maxsize': self.maxsize,
+                    'utilization': float(in_use) / self.maxsize,
+                    'checkouts': self.checkouts,
+                    'timeouts': self.timeouts,
+                    'discarded': self.discarded,
+                    'wait_time': self.wait_time,
+                    'max_wait': self.max_wait,
+                    }
+
+
+def is_pool(conn):
+    return isinstance(conn, ConnectionPool)
+
+def checkout(conn):
+    """
+    @return: a connection checked out of conn if it is a pool,
+             or conn itself
+    """
+    if is_pool(conn):
+        return conn.getconn()
+    return conn
+
+def checkin(conn, real, error=False):
+    """
+    Returns real to conn if conn is a pool.
+    """
+    if is_pool(conn):
+        conn.putconn(real, error)
+
+@contextmanager
+def acquire(conn):
+    """
+    Uses a connection or a pool for the duration of a with block.
+    """
+    real = checkout(conn)
+    try:
+        yield real
+    except:
+        checkin(conn, real, error=True)
+        raise
+    checkin(conn, real)
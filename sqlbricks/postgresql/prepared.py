@@ -0,0 +1,222 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+
+Server-side prepared statements.
+
+PostgreSQL parses and plans every statement it receives. Statement
+shapes run over and over, such as primary key lookups and saves, can
+be prepared once per connection and then only executed:
+
+  conn = prepared.enable(psycopg2.connect(dsn), threshold=5)
+  pool = ConnectionPool(lambda: prepared.enable(psycopg2.connect(dsn)))
+
+Once a connection is enabled, each distinct SQL text run through
+L{execute} is counted, and on its threshold-th use it is PREPAREd
+and from then on run with EXECUTE. At most maxsize statements stay
+prepared on a connection; the least recently used one is DEALLOCATEd
+to make room for another.
+
+PREPARE runs under a savepoint (unless the connection is in
+autocommit mode), so a statement the server cannot prepare, e.g.
+because the type of a parameter cannot be inferred without its
+value, does not abort the transaction: it is run unprepared, and
+no attempt is made to prepare it again.
+
+Prepared statements belong to a server session, so they do not work
+behind a pooler multiplexing server sessions between transactions.
+'''
+
+import itertools
+import re
+import weakref
+
+from ..base.cache import LRUCache
+from ..base import events
+
+_registries = weakref.WeakKeyDictionary()
+
+_PLACEHOLDER = re.compile(r'%(?:\((\w+)\)s|%)')
+
+class _Statement(object): #IGNORE:R0903
+    """
+    The SQL text and parameters of an EXECUTE or PREPARE,
+    in the shape L{events.execute} expects.
+    """
+    __slots__ = ('sql', 'bound_parameters')
+
+    def __init__(self, sql, bound_parameters=None):
+        self.sql = sql
+        self.bound_parameters = bound_parameters
+
+    def __unicode__(self):
+        return self.sql
+
+
+class PreparedStatements(object):
+    """
+    The registry of statements prepared on one connection.
+
+    @param maxsize: the most statements kept prepared at once
+    @param threshold: the number of uses after which a statement
+                      is prepared
+    """
+    _names = itertools.count(1)
+
+    def __init__(self, maxsize=100, threshold=5):
+        if threshold < 1:
+            raise ValueError("threshold must be at least 1")
+        self.maxsize = maxsize
+        self.threshold = threshold
+        self.statements = LRUCache(maxsize)
+        self.usage = LRUCache(maxsize * 10)
+        self.unpreparable = LRUCache(maxsize * 10)
+        self.prepares = 0
+        self.failures = 0
+        self.executions = 0
+        self.deallocations = 0
+
+    @staticmethod
+    def convert(sql):
+        """
+        Turns a statement with named placeholders into one with
+        positional ones.
+
+        @return: (SQL text for PREPARE, list of parameter names
+                 in positional order)
+        """
+        order = []
+        positions = {}
+        def replace(match):
+            name = match.group(1)
+            if name is None:
+                return u'%'
+            if name not in positions:
+                order.append(name)
+                positions[name] = len(order)
+            return u'${0}'.format(positions[name])
+        return _PLACEHOLDER.sub(replace, sql), order
+
+    def prepare(self, cursor, sql, dao=None):
+        """
+        Prepares sql on the connection of cursor, deallocating
+        statements which no longer fit.
+
+        @return: (statement name, parameter names), or None if
+                 the server could not prepare sql
+        """
+        text, order = self.convert(sql)
+        name = u'sqlbricks_p{0}'.format(next(self._names))
+        guarded = not getattr(cursor.connection, 'autocommit', False)
+        if guarded:
+            events.execute(cursor, _Statement(
+                u'SAVEPOINT sqlbricks_prepare'), dao)
+        try:
+            events.execute(cursor, _Statement(
+                u'PREPARE {0} AS {1}'.format(name, text)), dao)
+        except Exception: #IGNORE:W0703
+            if not guarded:
+                raise
+            events.execute(cursor, _Statement(
+                u'ROLLBACK TO SAVEPOINT sqlbricks_prepare'), dao)
+            events.execute(cursor, _Statement(
+                u'RELEASE SAVEPOINT sqlbricks_prepare'), dao)
+            self.failures += 1
+            self.unpreparable.put(sql, True)
+            return None
+        if guarded:
+            events.execute(cursor, _Statement(
+                u'RELEASE SAVEPOINT sqlbricks_prepare'), dao)
+        self.prepares += 1
+        entry = (name, order)
+        for _, evicted in self.statements.put(sql, entry):
+            events.execute(cursor, _Statement(
+                u'DEALLOCATE {0}'.format(evicted[0])), dao)
+            self.deallocations += 1
+        return entry
+
+    def execute(self, cursor, statement, dao=None):
+        """
+        Runs a statement, preparing it if it has been used often
+        enough, and executing its prepared form if it is prepared.
+        """
+        sql = unicode(statement)
+        entry = self.statements.get(sql)
+        if entry is None:
+            if sql in self.unpreparable:
+                return events.execute(cursor, statement, dao)
+            count = (self.usage.get(sql) or 0) + 1
+            if count < self.threshold:
+                self.usage.put(sql, count)
+                return events.execute(cursor, statement, dao)
+            self.usage.pop(sql)
+            entry = self.prepare(cursor, sql, dao)
+            if entry is None:
+                return events.execute(cursor, statement, dao)
+        name, order = entry
+        self.executions += 1
+        if not order:
+            return events.execute(cursor, _Statement(
+                u'EXECUTE {0}'.format(name), {}), dao)
+        params = statement.bound_parameters
+        return events.execute(cursor, _Statement(
+            u'EXECUTE {0} ({1})'.format(name, u', '.join(
+                u'%({0})s'.format(x) for x in order)), params), dao)
+
+    def clear(self):
+        """
+        Forgets every prepared statement, e.g. after the server
+        session was reset with DISCARD ALL.
+        """
+        self.statements.clear()
+        self.usage.clear()
+        self.unpreparable.clear()
+
+    def stats(self):
+        """
+        @return: dict with prepared, prepares, failures, executions,
+                 deallocations, hits and misses
+        """
+        cache = self.statements.stats()
+        return {
+                'prepared': len(self.statements),
+                'prepares': self.prepares,
+                'failures': self.failures,
+                'executions': self.executions,
+                'deallocations': self.deallocations,
+                'hits': cache['hits'],
+                'misses': cache['misses'],
+                }
+
+
+def enable(conn, maxsize=100, threshold=5):
+    """
+    Turns prepared statements on for a DB-API connection.
+
+    @return: conn
+    """
+    _registries[conn] = PreparedStatements(maxsize, threshold)
+    return conn
+
+def disable(conn):
+    _registries.pop(conn, None)
+
+def registry(conn):
+    """
+    @return: the L{PreparedStatements} of a connection, or None
+    """
+    try:
+        return _registries.get(conn)
+    except TypeError:
+        return None
+
+def execute(cursor, statement, dao=None):
+    """
+    Runs a statement on a cursor, through the prepared statements
+    of the cursor's connection if they are enabled.
+    """
+    prepared = registry(getattr(cursor, 'connection', None))
+    if prepared is None:
+        return events.execute(cursor, statement, dao)
+    return prepared.execute(cursor, statement, dao)
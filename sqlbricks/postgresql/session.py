@@ -0,0 +1,161 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from collections import OrderedDict
+import itertools
+
+from ..base.cache import LRUCache
+
+class IdentityMap(object):
+    """
+    Keeps loaded DAO objects by (class, primary key), so that
+    repeated lookups of the same row return the same object
+    without a round trip. The map is bounded and evicts the least
+    recently used entries.
+    """
+
+    def __init__(self, maxsize=1000):
+        self.cache = LRUCache(maxsize)
+        self.invalidations = 0
+
+    @staticmethod
+    def key(cls, value):
+        return (cls, value)
+
+    def get(self, cls, value):
+        """
+        @return: the object of class cls with primary key value,
+                 or None if it is not in the map
+        """
+        return self.cache.get(self.key(cls, value))
+
+    def add(self, obj):
+        """
+        Puts an object into the map. Objects without
+        a primary key are ignored.
+        """
+        value = getattr(obj, obj.__primary__)
+        if value is not None:
+            self.cache.put(self.key(obj.__class__, value), obj)
+        return obj
+
+    def discard(self, obj):
+        """
+        Drops an object from the map, e.g. after it was written.
+        """
+        value = getattr(obj, obj.__primary__)
+        if value is not None and \
+                self.cache.pop(self.key(obj.__class__, value)) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.cache.clear()
+
+    def stats(self):
+        """
+        @return: dict with hits, misses, evictions, invalidations,
+                 size and maxsize
+        """
+        result = self.cache.stats()
+        result['invalidations'] = self.invalidations
+        return result
+
+    def __len__(self):
+        return len(self.cache)
+
+
+class Session(object):
+    """
+    Wraps a DB-API connection for a unit of work. A session can be
+    passed to DAO methods wherever a connection is expected; objects
+    loaded through it keep it as their connection.
+
+      session = Session(conn)
+      user = User.load_by_primary(session, 1)
+      user.owner  # served from the identity map if loaded before
+
+    Objects given to add() are written together by flush(), which
+    commit() calls first: new objects with multi-row INSERTs and
+    changed ones with UPDATE ... FROM (VALUES ...), grouped by class
+    and by the set of changed fields, instead of one round trip
+    per save().
+
+      session.add(*users)
+      for user in users:
+          user.score += 1
+      session.commit()
+
+    Changes are those recorded by field assignments; a list or dict
+    field changed in place must be flagged with mark_changed().
+    """
+
+    def __init__(self, connection, maxsize=1000, max_parameters=None):
+        self.connection = connection
+        self.identity_map = IdentityMap(maxsize)
+        self.max_parameters = max_parameters
+        self.tracked = OrderedDict()
+
+    def cursor(self, *args, **kwargs):
+        return self.connection.cursor(*args, **kwargs)
+
+    def add(self, *objects):
+        """
+        Tracks objects for flush(); they now use this session
+        as their connection.
+        """
+        for obj in objects:
+            obj.__connection__ = self
+            self.tracked[id(obj)] = obj
+
+    def expunge(self, obj):
+        """
+        Stops tracking an object.
+        """
+        self.tracked.pop(id(obj), None)
+
+    def flush(self):
+        """
+        Writes new and changed tracked objects.
+
+        @return: dict with the numbers of inserted and updated objects
+        """
+        inserts = OrderedDict()
+        updates = OrderedDict()
+        for obj in self.tracked.itervalues():
+            cls = obj.__class__
+            if getattr(obj, cls.__primary__) is None:
+                inserts.setdefault(cls, []).append(obj)
+            elif obj.__changed__:
+                updates.setdefault(cls, []).append(obj)
+        inserted = updated = 0
+        for cls, objects in inserts.iteritems():
+            cls.insert_many(self, objects, self.max_parameters,
+                            changed_only=True)
+            inserted += len(objects)
+        for cls, objects in updates.iteritems():
+            updated += cls.update_many(self, objects, self.max_parameters)
+        for objects in itertools.chain(inserts.itervalues(),
+                                       updates.itervalues()):
+            for obj in objects:
+                self.identity_map.add(obj)
+        return {'inserted': inserted, 'updated': updated}
+
+    def commit(self):
+        self.flush()
+        return self.connection.commit()
+
+    def rollback(self):
+        self.identity_map.clear()
+        self.tracked.clear()
+        return self.connection.rollback()
+
+    def close(self):
+        self.identity_map.clear()
+        self.tracked.clear()
+        return self.connection.close()
+
+    def stats(self):
+        return self.identity_map.stats()
@@ -6,7 +6,7 @@ Created on 16 Mar 2013
 
 from ..base.sql import BaseQuery, _BaseMixin, _WhereMixin, _HavingMixin, \
     _GroupMixin, _FieldListMixin, _FromMixin, _JoinMixin, _OrderMixin, \
-    _UsingMixin, _LimitMixin, _WithMixin
+    _UsingMixin, _LimitMixin, _WithMixin, _SeekMixin
 
 class _ReturningMixin(_BaseMixin):
     """
@@ -18,27 +18,27 @@ class _ReturningMixin(_BaseMixin):
         """
         Adds elements to the RETURNING clause.
         """
-        self.check_clause('returning', set())
+        self.check_clause('returning')
         for arg in args:
             self.clauses['returning'][unicode(arg)] = True
         for key, val in kwargs.iteritems():
             clause = u"{0} AS {1}".format(val, key)
-            self.clauses['returning'].add(clause)
+            self.clauses['returning'][clause] = True
     
     def format_returning(self): #IGNORE:C0111
         result = u''
         if self.clauses.get('returning'):
             result = u"RETURNING {0}".\
-                format(u', '.join(self.clauses.get('returning')))
+                format(u', '.join(self.clauses.get('returning').keys()))
         return result
 
 #IGNORE:R0903
 #IGNORE:R0904
 class Select(BaseQuery, _FieldListMixin, _FromMixin, _WhereMixin,
              _JoinMixin, _GroupMixin, _OrderMixin, _HavingMixin,  
-             _WithMixin, _LimitMixin):
+             _WithMixin, _LimitMixin, _SeekMixin):
     
-    def __unicode__(self):
+    def render(self):
         result = u'''
             {with_clause} SELECT
                 {field_list}
@@ -77,7 +77,7 @@ class Literal(object): #IGNORE:R0903
 
 class Update(_WithMixin, _WhereMixin, _FromMixin, _JoinMixin, #IGNORE:R0901
              _ReturningMixin, _BaseMixin, BaseQuery):
-    
+
     def __init__(self, table, alias=None, only=False):
         self.table = table
         self.alias = None
@@ -109,7 +109,7 @@ class Update(_WithMixin, _WhereMixin, _FromMixin, _JoinMixin, #IGNORE:R0901
             return u'ONLY'
         return u''
 
-    def __unicode__(self):
+    def render(self):
         result = u'''
             {with_clause} UPDATE {only} {table_name}
                 {set_clause}
@@ -131,11 +131,23 @@ class Update(_WithMixin, _WhereMixin, _FromMixin, _JoinMixin, #IGNORE:R0901
 
 
 class Insert(BaseQuery, _WithMixin, _ReturningMixin):
+    """
+    INSERT statement. Takes either a single row through add_values(),
+    many rows through add_rows() or a query through add_query().
+    """
+    #: PostgreSQL cannot bind more than 65535 parameters per statement
+    max_parameters = 65535
 
     def __init__(self, table):
         self.table = table
+        self.rows = []
         super(Insert, self).__init__()
 
+    def _derive(self):
+        result = super(Insert, self)._derive()
+        result.rows = list(self.rows)
+        return result
+
     def add_values(self, **kwargs):
         self.check_clause('values', {})
         for key, val in kwargs.iteritems():
@@ -148,7 +160,92 @@ class Insert(BaseQuery, _WithMixin, _ReturningMixin):
                 arg_v = u'%({0})s'.format(key)
             self.clauses['values'][arg_c] = arg_v
             
+    def add_rows(self, *rows):
+        """
+        Adds rows for a multi-row VALUES list. Every row is a dict
+        and all rows must have the same keys. Bound parameters are
+        namespaced by the row number: column_0, column_1 and so on.
+        """
+        self.check_clause('rows', [])
+        for row in rows:
+            if not self.clauses.get('columns'):
+                self.clauses['columns'] = tuple(sorted(row.keys()))
+            columns = self.clauses['columns']
+            if len(row) != len(columns) or \
+                    any(col not in row for col in columns):
+                raise ValueError("All rows must have the same columns")
+            index = len(self.rows)
+            buf = []
+            for col in columns:
+                val = row[col]
+                if isinstance(val, Literal):
+                    buf.append(unicode(val))
+                else:
+                    name = u'{0}_{1}'.format(col, index)
+                    self.bound_parameters[name] = val
+                    buf.append(u'%({0})s'.format(name))
+            self.clauses['rows'].append(tuple(buf))
+            self.rows.append(row)
+
+    @staticmethod
+    def row_parameters(row):
+        """
+        @return: the number of bound parameters a row takes
+        """
+        return sum(1 for val in row.itervalues()
+                   if not isinstance(val, Literal))
+
+    def parameters_per_row(self):
+        """
+        @return: the most bound parameters any row takes
+        """
+        return max([self.row_parameters(x) for x in self.rows] or [0])
+
+    def split(self, max_parameters=None):
+        """
+        Splits a multi-row INSERT into statements which do not
+        go over max_parameters bound parameters each.
+        
+        @return: list of Insert statements, in row order
+        """
+        if max_parameters is None:
+            max_parameters = self.max_parameters
+        shared = ()
+        if self.clauses.get('conflict'):
+            shared = self.clauses['conflict']['parameters']
+        max_parameters -= len(shared)
+        counts = [self.row_parameters(x) for x in self.rows]
+        if sum(counts) <= max_parameters:
+            return [self]
+        # rows mixing Literal and bound values take different numbers
+        # of parameters, so chunks are filled row by row
+        bounds = []
+        start = total = 0
+        for index, count in enumerate(counts):
+            if index > start and total + count > max_parameters:
+                bounds.append((start, index))
+                start, total = index, 0
+            total += count
+        bounds.append((start, len(counts)))
+        result = []
+        for start, end in bounds:
+            statement = Insert(self.table)
+            for clause in ('with', 'returning', 'conflict'):
+                if self.clauses.get(clause):
+                    statement.clauses[clause] = \
+                        self.clauses[clause].__class__(self.clauses[clause])
+            for name in shared:
+                statement.bound_parameters[name] = self.bound_parameters[name]
+            statement.add_rows(*self.rows[start:end])
+            result.append(statement)
+        return result
+
     def format_values(self):
+        if self.clauses.get('rows'):
+            return u'({0}) VALUES {1}'.format(
+                u', '.join(self.clauses['columns']),
+                u', '.join(u'({0})'.format(u', '.join(row))
+                           for row in self.clauses['rows']))
         if not self.clauses.get('values'):
             return u''
         buf1 = []
@@ -158,23 +255,89 @@ class Insert(BaseQuery, _WithMixin, _ReturningMixin):
             buf2.append(val)
         return u'({0}) VALUES ({1})'.format(u', '.join(buf1), u', '.join(buf2))
 
+    def add_on_conflict(self, *columns, **kwargs):
+        """
+        Adds an ON CONFLICT clause. Without update, conflicting rows
+        are skipped (DO NOTHING); DO UPDATE needs a conflict target.
+        
+        @param columns: the conflict target columns
+        @keyword constraint: the name of a constraint to use as the
+                             target instead of columns
+        @keyword update: a list of columns to set to their EXCLUDED
+                         values, or a dict of columns to values
+                         (bound as parameters unless Literal)
+        @keyword where: the condition of DO UPDATE
+        """
+        constraint = kwargs.pop('constraint', None)
+        update = kwargs.pop('update', None)
+        where = kwargs.pop('where', None)
+        if kwargs:
+            raise TypeError("Unexpected arguments: {0}".\
+                            format(u', '.join(sorted(kwargs))))
+        if update and not (columns or constraint):
+            raise ValueError("ON CONFLICT DO UPDATE needs "
+                             "a conflict target")
+        self.check_clause('conflict', None)
+        conflict = {'target': u'', 'action': u'DO NOTHING',
+                    'parameters': ()}
+        if constraint is not None:
+            conflict['target'] = u'ON CONSTRAINT {0}'.format(constraint)
+        elif columns:
+            conflict['target'] = u'({0})'.format(
+                u', '.join(unicode(x) for x in columns))
+        if update:
+            parameters = []
+            if isinstance(update, dict):
+                buf = []
+                for key, val in sorted(update.iteritems()):
+                    if isinstance(val, Literal):
+                        buf.append(u'{0} = {1}'.format(key, val))
+                    else:
+                        name = u'conflict_{0}'.format(key)
+                        self.bound_parameters[name] = val
+                        parameters.append(name)
+                        buf.append(u'{0} = %({1})s'.format(key, name))
+            else:
+                buf = [u'{0} = EXCLUDED.{0}'.format(x) for x in update]
+            action = u'DO UPDATE SET {0}'.format(u', '.join(buf))
+            if where is not None:
+                if hasattr(where, 'bind'):
+                    before = set(self.bound_parameters)
+                    where = where.bind(self.bound_parameters)
+                    parameters.extend(sorted(set(self.bound_parameters) -
+                                             before))
+                action = u'{0} WHERE {1}'.format(action, where)
+            conflict['action'] = action
+            conflict['parameters'] = tuple(parameters)
+        self.clauses['conflict'] = conflict
+
+    def format_conflict(self):
+        conflict = self.clauses.get('conflict')
+        if not conflict:
+            return u''
+        return u'ON CONFLICT {0} {1}'.format(conflict['target'],
+                                             conflict['action'])
+
     def add_query(self, query):
         self.check_clause('query', None)
         if not isinstance(query, (str, unicode, Select)):
             raise TypeError('INSERT query must be a SELECT')
         self.clauses['query'] = query
 
-    def __unicode__(self):
+    def render(self):
         result = u'''
             {with_clause} INSERT INTO {table_name}
                 {values_or_query}
+                {conflict}
                 {returning}
             '''.format(
                        with_clause = self.format_with(),
                        table_name = self.table,
                        values_or_query = self.format_values() \
-                            if self.clauses.get('values')\
+                            if self.clauses.get('values') \
+                                or self.clauses.get('rows') \
                             else unicode(self.clauses.get('query')),
+                       conflict = self.format_conflict(),
                        returning = self.format_returning()
                        ).strip()
         return result
@@ -198,7 +361,7 @@ class Delete(BaseQuery, _JoinMixin, _WithMixin, _UsingMixin, #IGNORE:R0901
             return u'ONLY'
         return u''
 
-    def __unicode__(self):
+    def render(self):
         result = u'''
             {with_clause} DELETE {only} {table_name}
                 {using_clause}
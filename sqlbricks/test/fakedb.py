@@ -0,0 +1,115 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+class FakeCursor(object):
+    """
+    A deterministic DB-API cursor which answers queries
+    from its connection's responder. Columns are names, or
+    (name, type_code) pairs.
+    """
+    arraysize = 1
+
+    def __init__(self, connection, name=None):
+        self.connection = connection
+        self.name = name
+        self.description = None
+        self.rowcount = -1
+        self.rows = []
+        self.closed = False
+
+    def execute(self, sql, params=None):
+        self.connection.executed.append((sql, params))
+        result = self.connection.respond(sql, params)
+        if result is None:
+            self.description = None
+            self.rows = []
+            self.rowcount = 0
+            return
+        columns, rows = result
+        self.description = []
+        for col in columns:
+            if not isinstance(col, tuple):
+                col = (col, None)
+            self.description.append(col + (None,) * (7 - len(col)))
+        self.rows = list(rows)
+        self.rowcount = len(self.rows)
+
+    def executemany(self, sql, seq_of_params):
+        for params in seq_of_params:
+            self.execute(sql, params)
+
+    def fetchone(self):
+        if not self.rows:
+            return None
+        return self.rows.pop(0)
+
+    def fetchmany(self, size=None):
+        if size is None:
+            size = self.arraysize
+        result, self.rows = self.rows[:size], self.rows[size:]
+        return result
+
+    def fetchall(self):
+        result, self.rows = self.rows, []
+        return result
+
+    def copy_expert(self, sql, source, size=8192):
+        self.connection.executed.append((sql, None))
+        data = []
+        while True:
+            buf = source.read(size)
+            if not buf:
+                break
+            data.append(buf)
+        self.connection.copied.append(''.join(data))
+
+    def close(self):
+        self.closed = True
+
+    def __iter__(self):
+        while self.rows:
+            yield self.rows.pop(0)
+
+
+class FakeConnection(object):
+    """
+    A DB-API connection stand-in. The responder is either a callable
+    taking (sql, params) and returning (columns, rows) or None, or a list
+    of such results which are handed out in order.
+    """
+    cursor_class = FakeCursor
+
+    def __init__(self, responder=None):
+        self.responder = responder
+        self.executed = []
+        self.copied = []
+        self.cursors = []
+        self.commits = 0
+        self.rollbacks = 0
+        self.closed = False
+
+    def respond(self, sql, params):
+        if self.responder is None:
+            return None
+        if callable(self.responder):
+            return self.responder(sql, params)
+        if not self.responder:
+            return None
+        return self.responder.pop(0)
+
+    def cursor(self, name=None):
+        cur = self.cursor_class(self, name)
+        self.cursors.append(cur)
+        return cur
+
+    def commit(self):
+        self.commits += 1
+
+    def rollback(self):
+        self.rollbacks += 1
+
+    def close(self):
+        self.closed = True
@@ -0,0 +1,119 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+
+from sqlbricks.postgresql import aio
+from sqlbricks.postgresql.session import Session
+from sqlbricks.test.fakedb import FakeConnection
+from sqlbricks.test.testdao_postgresql import User, Author, users_by_id
+
+class FakeAsyncCursor(object):
+    """
+    Wraps a fake cursor so that every call returns a future
+    which is only completed when the connection ticks.
+    """
+
+    def __init__(self, connection, cursor):
+        self.connection = connection
+        self.cursor = cursor
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def _later(self, method, *args):
+        future = aio.Future()
+        self.connection.pending.append((future, method, args))
+        return future
+
+    def execute(self, sql, params=None):
+        return self._later(self.cursor.execute, sql, params)
+
+    def fetchone(self):
+        return self._later(self.cursor.fetchone)
+
+    def fetchmany(self, size=None):
+        return self._later(self.cursor.fetchmany, size)
+
+    def fetchall(self):
+        return self._later(self.cursor.fetchall)
+
+
+class FakeAsyncConnection(object):
+
+    def __init__(self, responder=None):
+        self.sync = FakeConnection(responder)
+        self.pending = []
+
+    def cursor(self):
+        return FakeAsyncCursor(self, self.sync.cursor())
+
+    def run(self, future):
+        while self.pending:
+            waiting, method, args = self.pending.pop(0)
+            waiting.set_result(method(*args))
+        return future.result()
+
+
+class AsyncDAOTest(TestCase):
+
+    def test_coroutine_waits_for_driver(self):
+        conn = FakeAsyncConnection(users_by_id)
+        task = aio.load_by_primary(User, conn, 4)
+        self.assertFalse(task.done())
+        user = conn.run(task)
+        self.assertEqual((user.id, user.name), (4, u'user4'))
+
+    def test_collection(self):
+        rows = [(i, u'user%d' % i, i) for i in range(5)]
+        conn = FakeAsyncConnection([(('id', 'name', 'age'), rows)])
+        collection = aio.load_by(User, conn)
+        collection.itersize = 2
+        first = conn.run(collection.next())
+        rest = conn.run(collection.all())
+        self.assertEqual([first.id] + [x.id for x in rest], range(5))
+        self.assertRaises(TypeError, iter, collection)
+
+    def test_count(self):
+        conn = FakeAsyncConnection([(('count',), [(12,)])])
+        self.assertEqual(conn.run(aio.load_by(User, conn).count()), 12)
+
+    def test_save_and_identity_map(self):
+        conn = FakeAsyncConnection(users_by_id)
+        session = Session(conn)
+        user = conn.run(aio.load_by_primary(User, session, 2))
+        self.assertTrue(conn.run(aio.load_by_primary(User, session, 2))
+                        is user)
+        user.name = u'renamed'
+        user.__changed__.add('name')
+        conn.run(aio.save(user))
+        sql, params = conn.sync.executed[-1]
+        self.assertTrue(sql.startswith(u'UPDATE'))
+        self.assertEqual(params['__primary__'], 2)
+        self.assertEqual(session.stats()['invalidations'], 1)
+
+    def test_related(self):
+        conn = FakeAsyncConnection([
+            (('author_id', 'id', 'title'), [(1, 10, u'a'), (1, 11, u'b')]),
+        ])
+        author = Author(__conn__=conn, id=1, name=u'ann')
+        articles = conn.run(aio.related(author, 'articles'))
+        self.assertEqual([x.id for x in articles], [10, 11])
+        self.assertTrue(u'"articles"."author_id" = %(articles_id)s' in
+                        conn.sync.executed[0][0])
+
+    def test_errors_propagate(self):
+        @aio.coroutine
+        def failing(conn):
+            yield conn.cursor().execute('SELECT 1')
+            raise ValueError('boom')
+        conn = FakeAsyncConnection()
+        self.assertRaises(ValueError, conn.run, failing(conn))
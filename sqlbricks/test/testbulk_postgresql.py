@@ -0,0 +1,65 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+
+from sqlbricks.postgresql.bulk import CopyLoader, escape_text, escape_csv
+from sqlbricks.test.fakedb import FakeConnection
+from sqlbricks.test.testdao_postgresql import User
+
+class EscapeTest(TestCase):
+
+    def test_text(self):
+        self.assertEqual(escape_text(None), u'\\N')
+        self.assertEqual(escape_text(u'a\tb\nc\\d'), u'a\\tb\\nc\\\\d')
+        self.assertEqual(escape_text(True), u't')
+
+    def test_csv(self):
+        self.assertEqual(escape_csv(None), u'')
+        self.assertEqual(escape_csv(u''), u'""')
+        self.assertEqual(escape_csv(u'say "hi", bob'), u'"say ""hi"", bob"')
+        self.assertEqual(escape_csv(12), u'12')
+        self.assertEqual(escape_csv(u'\\.'), u'"\\."')
+        self.assertEqual(escape_csv(u'a\\.'), u'a\\.')
+
+
+class CopyLoaderTest(TestCase):
+
+    def test_streams_mixed_rows(self):
+        conn = FakeConnection()
+        rows = [User(name=u'ann', age=3), {'name': u'bob', 'age': None},
+                (None, u'caf\xe9')]
+        stats = CopyLoader(User, columns=('age', 'name')).load(conn, rows)
+        self.assertEqual(stats['rows'], 3)
+        self.assertEqual(conn.executed[0][0],
+                         u'COPY users (age, name) FROM STDIN')
+        self.assertEqual(conn.copied[0],
+                         '3\tann\n\\N\tbob\n\\N\tcaf\xc3\xa9\n')
+
+    def test_generator_is_read_lazily(self):
+        pulled = []
+        def rows():
+            for i in range(10000):
+                pulled.append(i)
+                yield {'name': u'x' * 100, 'age': i}
+        loader = CopyLoader(User, columns=('age', 'name'), format='csv')
+        stream_rows = rows()
+        conn = FakeConnection()
+        cur = conn.cursor()
+        reads = []
+        def copy_expert(sql, source, size=8192):
+            while True:
+                buf = source.read(size)
+                if not buf:
+                    break
+                reads.append(len(pulled))
+        cur.copy_expert = copy_expert
+        conn.cursor = lambda: cur
+        stats = User.copy_from(conn, stream_rows, columns=('age', 'name'),
+                               format='csv')
+        self.assertEqual(stats['rows'], 10000)
+        self.assertTrue(reads[0] < 100)
+        self.assertTrue(loader.statement().endswith(u'WITH (FORMAT csv)'))
@@ -0,0 +1,800 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from array import array
+from unittest import TestCase
+
+from sqlbricks.postgresql.dao import BaseDAO, Field, Relationship, \
+    Collection, Expression, prefetch, joined, only, defer
+from sqlbricks.postgresql.session import Session
+from sqlbricks.test.fakedb import FakeConnection
+
+class User(BaseDAO):
+    __table__ = 'users'
+    name = Field()
+    age = Field()
+
+
+class InsertManyTest(TestCase):
+
+    def test_returning_rows_are_mapped_in_order(self):
+        counter = [0]
+        def responder(sql, params):
+            rows = []
+            for i in range(len(params) // 2):
+                counter[0] += 1
+                rows.append((params['age_%d' % i], counter[0],
+                             params['name_%d' % i]))
+            return ('age', 'id', 'name'), rows
+        conn = FakeConnection(responder)
+        users = [User(name=u'user%d' % i, age=i) for i in range(5)]
+        User.insert_many(conn, users, max_parameters=4)
+        self.assertEqual(len(conn.executed), 3)
+        self.assertEqual([x.id for x in users], [1, 2, 3, 4, 5])
+        self.assertEqual([x.name for x in users],
+                         [u'user%d' % i for i in range(5)])
+        self.assertTrue(all(x.__connection__ is conn for x in users))
+
+
+def user_rows(count):
+    return ('id', 'name', 'age'), [(i, u'user%d' % i, i) for i in range(count)]
+
+
+class StreamingCollectionTest(TestCase):
+
+    def test_stream_uses_named_cursor(self):
+        conn = FakeConnection([user_rows(5)])
+        collection = User.load_by(conn).stream(itersize=2)
+        users = list(collection)
+        self.assertEqual([x.id for x in users], range(5))
+        cursor = conn.cursors[0]
+        self.assertTrue(cursor.name.startswith('sqlbricks_'))
+        self.assertEqual(cursor.itersize, 2)
+        self.assertTrue(cursor.closed)
+
+    def test_batches(self):
+        conn = FakeConnection([user_rows(5)])
+        batches = list(User.load_by(conn).stream().batches(2))
+        self.assertEqual([len(x) for x in batches], [2, 2, 1])
+        self.assertEqual(batches[2][0].name, u'user4')
+
+    def test_cannot_stream_started(self):
+        conn = FakeConnection([user_rows(1)])
+        collection = User.load_by(conn)
+        collection.start()
+        self.assertRaises(RuntimeError, collection.stream)
+
+
+class HydrationPlanTest(TestCase):
+
+    def test_plan_is_computed_once(self):
+        description, rows = user_rows(3)
+        description = [(x, None) for x in description]
+        users = User.from_rows(description, rows, None)
+        self.assertTrue(User.hydration_plan(description) is
+                        User.hydration_plan([(x[0],) for x in description]))
+        self.assertEqual([(x.id, x.name, x.age) for x in users], rows)
+        self.assertEqual(users[0].__changed__, set())
+
+    def test_mutable_defaults(self):
+        class Tagged(BaseDAO):
+            __table__ = 'tagged'
+            tags = []
+        first, second = Tagged.from_rows([('id',)], [(1,), (2,)], None)
+        first.tags.append(u'x')
+        self.assertEqual(second.tags, [])
+
+    def test_custom_init_is_respected(self):
+        class Custom(BaseDAO):
+            __table__ = 'custom'
+            def __init__(self, **kwargs):
+                super(Custom, self).__init__(**kwargs)
+                self.extra = True
+        obj = Custom.from_rows([('id',)], [(1,)], None)[0]
+        self.assertFalse(Custom.hydration_plan([('id',)]).direct)
+        self.assertTrue(obj.extra)
+        self.assertEqual(obj.id, 1)
+
+
+class CompactUser(BaseDAO):
+    __table__ = 'users'
+    __compact__ = True
+    name = Field()
+    age = Field(0)
+
+
+class CompactLayoutTest(TestCase):
+
+    def test_no_instance_dict(self):
+        user = CompactUser(name=u'ann')
+        self.assertFalse(hasattr(user, '__dict__'))
+        self.assertEqual((user.id, user.name, user.age), (None, u'ann', 0))
+        user.age = 3
+        self.assertEqual(CompactUser(name=u'bob').age, 0)
+        self.assertRaises(AttributeError, setattr, user, 'nonfield', 1)
+
+    def test_hydration(self):
+        description, rows = user_rows(3)
+        description = [(x,) for x in description]
+        users = CompactUser.from_rows(description, rows, 'conn')
+        self.assertEqual(CompactUser.hydration_plan(description).mode,
+                         'slots')
+        self.assertEqual([(x.id, x.name, x.age) for x in users], rows)
+        self.assertEqual(users[1].__connection__, 'conn')
+
+    def test_subclass(self):
+        class Admin(CompactUser):
+            __compact__ = True
+            level = Field()
+        admin = Admin(name=u'root', level=9)
+        self.assertFalse(hasattr(admin, '__dict__'))
+        self.assertEqual((admin.name, admin.level), (u'root', 9))
+        self.assertEqual(Admin.__slots__, ('_level_value',))
+
+
+class Post(BaseDAO):
+    __table__ = 'posts'
+    author_id = Field()
+    title = Field()
+    author = Relationship('User', 'author_id', 'id')
+
+
+def users_by_id(sql, params):
+    if sql.startswith('DELETE') or sql.startswith('UPDATE'):
+        return ('age', 'id', 'name'), [(1, params.get('__primary__'), u'x')]
+    return ('id', 'name', 'age'), [(params['id'], u'user%d' % params['id'], 1)]
+
+
+class IdentityMapTest(TestCase):
+
+    def test_repeated_lookup_is_a_hit(self):
+        conn = FakeConnection(users_by_id)
+        session = Session(conn)
+        first = User.load_by_primary(session, 7)
+        second = User.load_by_primary(session, 7)
+        self.assertTrue(first is second)
+        self.assertEqual(len(conn.executed), 1)
+        stats = session.stats()
+        self.assertEqual((stats['hits'], stats['misses'], stats['size']),
+                         (1, 1, 1))
+
+    def test_relationship_uses_map(self):
+        conn = FakeConnection(users_by_id)
+        session = Session(conn)
+        user = User.load_by_primary(session, 3)
+        post = Post(__conn__=session, author_id=3, title=u'hello')
+        self.assertTrue(post.author is user)
+        self.assertEqual(len(conn.executed), 1)
+
+    def test_lru_bound(self):
+        conn = FakeConnection(users_by_id)
+        session = Session(conn, maxsize=2)
+        for key in (1, 2, 3, 1):
+            User.load_by_primary(session, key)
+        self.assertEqual(len(conn.executed), 4)
+        self.assertEqual(session.stats()['evictions'], 2)
+
+    def test_errors_are_not_missing_rows(self):
+        class Broken(User):
+            def __init__(self, **kwargs):
+                raise ValueError("broken")
+        conn = FakeConnection(users_by_id)
+        self.assertRaises(ValueError, Broken.load_by_primary, conn, 1)
+        self.assertRaises(ValueError, Broken.load_by_primary,
+                          Session(conn), 1)
+
+    def test_writes_evict(self):
+        conn = FakeConnection(users_by_id)
+        session = Session(conn)
+        user = User.load_by_primary(session, 5)
+        user.delete()
+        self.assertEqual(session.stats()['invalidations'], 1)
+        self.assertFalse(User.load_by_primary(session, 5) is user)
+
+
+class Author(BaseDAO):
+    __table__ = 'authors'
+    name = Field()
+    articles = Relationship('Article', 'id', 'author_id', collection=True)
+    tags = Relationship('Tag', 'id', 'id', collection=True,
+                        via_table='author_tags', via_mine='author_id',
+                        via_theirs='tag_id')
+
+
+class Article(BaseDAO):
+    __table__ = 'articles'
+    __compact__ = True
+    author_id = Field()
+    title = Field()
+    author = Relationship('Author', 'author_id', 'id')
+
+
+class Tag(BaseDAO):
+    __table__ = 'tags'
+    label = Field()
+
+
+class Employee(BaseDAO):
+    __table__ = 'employees'
+    name = Field()
+    boss_id = Field()
+    boss = Relationship('Employee', 'boss_id', 'id')
+
+
+class EagerLoadingTest(TestCase):
+
+    def test_prefetch_collection(self):
+        conn = FakeConnection([
+            (('id', 'name'), [(1, u'ann'), (2, u'bob'), (3, u'cid')]),
+            (('author_id', 'id', 'title', '__key__'),
+             [(1, 10, u'a', 1), (1, 11, u'b', 1), (3, 12, u'c', 3)]),
+        ])
+        authors = list(Author.load_by(conn, prefetch('articles')))
+        self.assertEqual(len(conn.executed), 2)
+        sql, params = conn.executed[1]
+        self.assertTrue(u'"articles"."author_id" = ANY(%(articles_keys)s)'
+                        in sql)
+        self.assertEqual(params, {'articles_keys': [1, 2, 3]})
+        self.assertEqual([[x.id for x in author.articles]
+                          for author in authors], [[10, 11], [], [12]])
+        self.assertEqual(len(conn.executed), 2)
+
+    def test_joined_single_on_compact(self):
+        conn = FakeConnection([
+            (('author_id', 'id', 'title'), [(1, 10, u'a'), (2, 11, u'b'),
+                                            (1, 12, u'c')]),
+            (('id', 'name', '__key__'), [(1, u'ann', 1), (2, u'bob', 2)]),
+        ])
+        articles = list(Article.load_by(conn, joined('author'),
+                                        title=u'x'))
+        sql, params = conn.executed[1]
+        sql = u' '.join(sql.split())
+        self.assertTrue(u'"authors"."id" IN (SELECT "articles"."author_id"'
+                        in sql)
+        self.assertTrue(u'(title = %(title)s)' in sql)
+        self.assertFalse(u'JOIN' in sql)
+        self.assertEqual(params, {'title': u'x'})
+        self.assertEqual([x.author.name for x in articles],
+                         [u'ann', u'bob', u'ann'])
+        self.assertTrue(articles[0].author is articles[2].author)
+        self.assertEqual(len(conn.executed), 2)
+
+    def test_joined_query_is_scoped(self):
+        parents = Article.load_by(None, id=5).query
+        sql = u' '.join(unicode(Article.get_relationship('author').
+                                eager_query(parent_query=parents)).split())
+        where = sql[sql.index(u'WHERE'):]
+        self.assertTrue(where.startswith(u'WHERE ("authors"."id" IN '
+                                         u'(SELECT "articles"."author_id"'))
+        self.assertTrue(u'(id = %(id)s)' in where)
+        self.assertEqual(sql.count(u'FROM'), 2)
+        parents = Employee.load_by(None, name=u'x').query
+        sql = u' '.join(unicode(Employee.get_relationship('boss').
+                                eager_query(parent_query=parents)).split())
+        self.assertTrue(u'"employees"."id" IN (SELECT '
+                        u'"employees"."boss_id"' in sql)
+        self.assertFalse(u'JOIN' in sql)
+
+    def test_join_theirs(self):
+        query = Article.get_relationship('author').join_theirs(
+            Article.load_by(None).query)
+        self.assertTrue(u'FROM articles JOIN authors ON ("authors"."id" = '
+                        u'"articles"."author_id")' in
+                        u' '.join(unicode(query).split()))
+
+    def test_prefetch_via_table(self):
+        conn = FakeConnection([
+            (('id', 'name'), [(1, u'ann'), (2, u'bob')]),
+            (('id', 'label', '__key__'), [(5, u'x', 1), (6, u'y', 1),
+                                          (5, u'x', 2)]),
+        ])
+        authors = list(Author.load_by(conn, prefetch('tags')))
+        sql = conn.executed[1][0]
+        self.assertTrue(u'JOIN author_tags ON ("author_tags"."tag_id" = '
+                        u'"tags"."id")' in sql)
+        self.assertTrue(u'"author_tags"."author_id" = ANY(' in sql)
+        self.assertEqual([[x.label for x in author.tags]
+                          for author in authors], [[u'x', u'y'], [u'x']])
+
+
+class AggregatePushdownTest(TestCase):
+
+    def test_count(self):
+        conn = FakeConnection([(('count',), [(42,)])])
+        collection = User.load_by(conn, age=3)
+        self.assertEqual(len(collection), 42)
+        sql, params = conn.executed[0]
+        self.assertEqual(u' '.join(sql.split()),
+                         u'SELECT COUNT(*) FROM users WHERE (age = %(age)s)')
+        self.assertEqual(params, {'age': 3})
+
+    def test_count_with_limit_uses_subquery(self):
+        conn = FakeConnection([(('count',), [(5,)])])
+        collection = User.load_by(conn)
+        collection.query.add_limit(5)
+        self.assertEqual(collection.count(), 5)
+        self.assertTrue(u'AS "__counted__"' in conn.executed[0][0])
+
+    def test_len_of_started_collection(self):
+        conn = FakeConnection([user_rows(3)])
+        collection = iter(User.load_by(conn))
+        self.assertEqual(len(collection), 3)
+        self.assertEqual(len(conn.executed), 1)
+
+    def test_list_of_started_streaming_collection(self):
+        conn = FakeConnection([user_rows(3)])
+        collection = iter(User.load_by(conn).stream())
+        self.assertEqual([x.id for x in list(collection)], [0, 1, 2])
+        self.assertEqual(len(conn.executed), 1)
+        self.assertRaises(TypeError, len, iter(User.load_by(conn).stream()))
+
+    def test_exists(self):
+        conn = FakeConnection([(('exists',), [(True,)])])
+        self.assertTrue(User.load_by(conn, name=u'x').exists())
+        self.assertTrue(u'SELECT EXISTS(SELECT 1' in
+                        u' '.join(conn.executed[0][0].split()))
+
+    def test_aggregate(self):
+        conn = FakeConnection([(('max', 'sum'), [(9, 20)])])
+        result = User.load_by(conn).aggregate(sum=User.age, max=User.age)
+        self.assertEqual(result, {'sum': 20, 'max': 9})
+        self.assertTrue(u'MAX("users"."age") AS "max", SUM("users"."age") '
+                        u'AS "sum"' in conn.executed[0][0])
+
+
+class KeysetPaginationTest(TestCase):
+
+    def test_pages(self):
+        table = [(i, u'user%d' % i, i % 3) for i in range(7)]
+        def responder(sql, params):
+            rows = [x for x in table if 'seek_0' not in params
+                    or (x[2], x[0]) > (params['seek_0'], params['seek_1'])]
+            rows.sort(key=lambda x: (x[2], x[0]))
+            return ('id', 'name', 'age'), rows[:3]
+        conn = FakeConnection(responder)
+        collection = User.load_by(conn)
+        collection.query.add_order(User.age)
+        pages = list(collection.pages(3))
+        self.assertEqual([[x.id for x in page] for page in pages],
+                         [[0, 3, 6], [1, 4, 2], [5]])
+        sql = conn.executed[1][0]
+        self.assertTrue(u'("users"."age", "users"."id") > '
+                        u'(%(seek_0)s, %(seek_1)s)' in sql)
+        self.assertTrue(u'LIMIT 3' in sql and u'OFFSET' not in sql)
+
+    def test_persistent_query(self):
+        conn = FakeConnection(lambda sql, params: (('id', 'name', 'age'),
+                                                   [(1, u'a', 2)]))
+        query = User.load_by(None).query.persistent().add_order(User.age)
+        collection = Collection(query, conn, User)
+        objects, token = collection.page(1)
+        sql = u' '.join(conn.executed[0][0].split())
+        self.assertTrue(u'ORDER BY "users"."age" ASC, "users"."id" ASC '
+                        u'LIMIT 1' in sql)
+        collection.page(1, token)
+        self.assertTrue(u'(%(seek_0)s, %(seek_1)s)' in conn.executed[1][0])
+        self.assertEqual(objects[0].id, 1)
+        fields = query.clauses['fields']
+        collection.options(only('name'))
+        self.assertTrue(query.clauses['fields'] is fields)
+        self.assertEqual(collection.deferred, frozenset(['age']))
+
+    def test_joined_on_page_loads_the_page_only(self):
+        conn = FakeConnection([
+            (('author_id', 'id', 'title'), [(1, 10, u'a'), (2, 11, u'b')]),
+            (('id', 'name', '__key__'), [(1, u'ann', 1), (2, u'bob', 2)]),
+        ])
+        objects, _ = Article.load_by(conn, joined('author')).page(2)
+        sql, params = conn.executed[1]
+        self.assertTrue(u'= ANY(%(author_keys)s)' in sql)
+        self.assertEqual(params, {'author_keys': [1, 2]})
+        self.assertEqual([x.author.name for x in objects], [u'ann', u'bob'])
+
+
+class ExpressionTest(TestCase):
+
+    def test_values_are_bound(self):
+        texts = []
+        for name in (u'john', u'jane'):
+            collection = User.load_by(None, (User.name == name) &
+                                      (User.age >= 18))
+            texts.append(unicode(collection.query))
+            self.assertEqual(collection.query.bound_parameters,
+                             {u'expr_0': name, u'expr_1': 18})
+        self.assertEqual(texts[0], texts[1])
+        self.assertTrue(u'(("users"."name" = %(expr_0)s) AND '
+                        u'("users"."age" >= %(expr_1)s))' in texts[0])
+
+    def test_names_do_not_clash(self):
+        collection = User.load_by(None, User.age > 1, User.age < 9)
+        params = collection.query.bound_parameters
+        self.assertEqual(sorted(params.items()),
+                         [(u'expr_0', 1), (u'expr_1', 9)])
+
+    def test_unicode_inlines_literals(self):
+        expr = (User.name == u"o'neil") | (User.age == None)
+        self.assertEqual(unicode(expr),
+                         u'(("users"."name" = \'o\'\'neil\') OR '
+                         u'("users"."age" IS NULL))')
+        self.assertEqual(unicode(Expression.call('COALESCE', User.age, 0)),
+                         u'COALESCE("users"."age", \'0\')')
+
+    def test_deep_chain(self):
+        expr = User.age
+        for i in range(5000):
+            expr = expr + i
+        texts, values = expr.parts()
+        self.assertEqual(len(values), 5000)
+        self.assertEqual(len(texts), 5001)
+
+    def test_membership_strategies(self):
+        params = {}
+        expr = User.id.in_([3, 1, 3])
+        self.assertEqual((expr.strategy, expr.bind(params)),
+                         ('list', u'("users"."id" IN (%(expr_0)s, '
+                          u'%(expr_1)s))'))
+        self.assertEqual(params, {u'expr_0': 3, u'expr_1': 1})
+        params = {}
+        expr = User.id.not_in(range(100))
+        self.assertEqual((expr.strategy, expr.bind(params)),
+                         ('array', u'("users"."id" <> ALL(%(expr_0)s))'))
+        self.assertEqual(params, {u'expr_0': range(100)})
+        expr = User.id.in_(range(5000))
+        self.assertEqual(expr.strategy, 'join')
+        self.assertTrue(u'IN (SELECT unnest(%(expr_0)s::bigint[])))' in
+                        expr.bind({}))
+        self.assertEqual(unicode(User.id.in_([])), u'FALSE')
+        self.assertEqual(unicode(User.name.in_([u'a"b', None], 'array')),
+                         u'("users"."name" = ANY(\'{"a\\"b",NULL}\'))')
+        self.assertRaises(ValueError, User.id.in_, [1], 'temp')
+
+    def test_membership_values(self):
+        params = {}
+        User.id.in_([1, True, 1.0, 1]).bind(params)
+        self.assertEqual(sorted((type(x).__name__, x)
+                                for x in params.values()),
+                         [('bool', True), ('float', 1.0), ('int', 1)])
+        params = {}
+        expr = User.name.not_in([u'a', None])
+        self.assertEqual(expr.bind(params),
+                         u'("users"."name" NOT IN (%(expr_0)s))')
+        self.assertEqual(params, {u'expr_0': u'a'})
+        self.assertEqual(unicode(User.name.not_in([None])), u'TRUE')
+
+    def test_array_type(self):
+        array_type = Expression.array_type
+        self.assertEqual(array_type([1, 2L, None]), u'bigint')
+        self.assertEqual(array_type([True]), u'boolean')
+        self.assertEqual(array_type(['a', u'b']), u'text')
+        self.assertEqual(array_type([1, u'b']), None)
+        self.assertEqual(array_type([object()]), None)
+        expr = User.name.in_([u'n%d' % x for x in range(2000)], 'join')
+        self.assertTrue(u'unnest(%(expr_0)s::text[])' in expr.bind({}))
+        expr = User.name.in_([1, u'a'], 'join')
+        self.assertTrue(u'unnest(%(expr_0)s))' in expr.bind({}))
+
+
+class UnitOfWorkTest(TestCase):
+
+    @staticmethod
+    def responder(sql, params):
+        if sql.lstrip().startswith(u'INSERT'):
+            count = len(params) // 2
+            return ('age', 'id', 'name'), \
+                [(params['age_%d' % i], 100 + i, params['name_%d' % i])
+                 for i in range(count)]
+        if sql.lstrip().startswith(u'UPDATE'):
+            rows = []
+            i = 0
+            while 'id_%d' % i in params:
+                rows.append((params.get('age_%d' % i, 0), params['id_%d' % i],
+                             params.get('name_%d' % i, u'old')))
+                i += 1
+            return ('age', 'id', 'name'), list(reversed(rows))
+        return None
+
+    def test_flush_batches_writes(self):
+        conn = FakeConnection(self.responder)
+        session = Session(conn, max_parameters=6)
+        new = [User(name=u'new%d' % i, age=i) for i in range(3)]
+        old = [User(id=i, name=u'old', age=i) for i in range(1, 5)]
+        for obj in old[:3]:
+            obj.name = u'renamed%d' % obj.id
+            obj.__changed__.add('name')
+        old[3].__changed__.add('age')
+        session.add(*(new + old))
+        self.assertEqual(session.flush(), {'inserted': 3, 'updated': 4})
+        sqls = [x[0] for x in conn.executed]
+        self.assertEqual(len(sqls), 3)
+        self.assertEqual([x.id for x in new], [100, 101, 102])
+        self.assertTrue(u'SET name = "v"."name"' in sqls[1])
+        self.assertTrue(u'(NULL::"users")."id"' in sqls[1])
+        self.assertTrue(u'WHERE ("users"."id" = "v"."id")' in sqls[1])
+        self.assertEqual(conn.executed[1][1],
+                         {u'id_0': 1, u'name_0': u'renamed1',
+                          u'id_1': 2, u'name_1': u'renamed2',
+                          u'id_2': 3, u'name_2': u'renamed3'})
+        self.assertTrue(u'SET age = "v"."age"' in sqls[2])
+        self.assertEqual([x.name for x in old],
+                         [u'renamed1', u'renamed2', u'renamed3', u'old'])
+        self.assertTrue(all(not x.__changed__ for x in new + old))
+        self.assertTrue(session.identity_map.get(User, 100) is new[0])
+        self.assertEqual(session.flush(), {'inserted': 0, 'updated': 0})
+        self.assertEqual(len(conn.executed), 3)
+
+    def test_flush_sees_plain_assignments(self):
+        conn = FakeConnection(self.responder)
+        session = Session(conn)
+        users = User.from_rows([('id',), ('name',), ('age',)],
+                               [(1, u'old', 1), (2, u'old', 2)], session)
+        session.add(*users)
+        users[0].age += 1
+        users[1].age = 2
+        self.assertEqual(session.flush(), {'inserted': 0, 'updated': 1})
+        self.assertEqual(conn.executed[0][1], {u'id_0': 1, u'age_0': 2})
+
+    def test_commit_flushes(self):
+        conn = FakeConnection(self.responder)
+        session = Session(conn)
+        session.add(User(name=u'x', age=1))
+        session.commit()
+        self.assertEqual(len(conn.executed), 1)
+        self.assertEqual(conn.commits, 1)
+
+
+class Member(BaseDAO):
+    __table__ = 'members'
+    __unique__ = ('email',)
+    email = Field()
+    visits = Field()
+
+
+class UpsertTest(TestCase):
+
+    def test_upsert_many_by_unique_key(self):
+        def responder(sql, params):
+            rows = []
+            i = 0
+            while 'email_%d' % i in params:
+                rows.append((params['email_%d' % i], 10 + i,
+                             params['visits_%d' % i]))
+                i += 1
+            return ('email', 'id', 'visits'), list(reversed(rows))
+        conn = FakeConnection(responder)
+        members = [Member(email=u'a', visits=1), Member(email=u'b', visits=2),
+                   Member(email=u'a', visits=3)]
+        self.assertEqual(Member.upsert_many(conn, members), 2)
+        sql, params = conn.executed[0]
+        self.assertEqual(len(conn.executed), 1)
+        self.assertTrue(u'ON CONFLICT (email) DO UPDATE SET '
+                        u'visits = EXCLUDED.visits' in sql)
+        self.assertEqual(params, {'email_0': u'a', 'visits_0': 3,
+                                  'email_1': u'b', 'visits_1': 2})
+        self.assertEqual([(x.id, x.visits) for x in members],
+                         [(10, 3), (11, 2), (10, 3)])
+
+    def test_upsert_many_changed_key(self):
+        conn = FakeConnection([(('email', 'id', 'visits'),
+                                [(u'A ', 7, 1)])])
+        members = [Member(email=u'a', visits=1), Member(email=u'A', visits=2)]
+        self.assertRaises(ValueError, Member.upsert_many, conn, members)
+        self.assertEqual([x.id for x in members], [None, None])
+
+    def test_upsert_many_keeps_primary_key(self):
+        conn = FakeConnection([(('email', 'id', 'visits'), [(u'a', 5, 1)])])
+        member = Member(id=5, email=u'a', visits=1)
+        self.assertEqual(Member.upsert_many(conn, [member]), 1)
+        self.assertFalse(u'id = EXCLUDED.id' in conn.executed[0][0])
+
+    def test_upsert_needs_key(self):
+        self.assertRaises(ValueError, User.upsert_many, FakeConnection(),
+                          [User(name=u'x')])
+
+    def test_do_nothing(self):
+        conn = FakeConnection([(('email', 'id', 'visits'), [])])
+        member = Member(__conn__=conn, email=u'a', visits=1)
+        self.assertFalse(member.upsert(update=()))
+        self.assertTrue(u'ON CONFLICT (email) DO NOTHING'
+                        in conn.executed[0][0])
+
+
+class TemplateCollectionTest(TestCase):
+
+    def test_bound_template_in_collection(self):
+        template = User.load_by(None, name=None).query.freeze()
+        conn = FakeConnection(lambda sql, params: (('id', 'name', 'age'),
+                                                   [(1, params['name'], 3)]))
+        for name in (u'a', u'b'):
+            collection = Collection(template.bind(name=name), conn, User)
+            self.assertEqual([x.name for x in collection], [name])
+        self.assertEqual(conn.executed[0][0], conn.executed[1][0])
+
+    def test_counting_a_bound_template(self):
+        template = User.load_by(None, name=None).query.freeze()
+        conn = FakeConnection([(('count',), [(4,)]), (('exists',),
+                                                      [(True,)])])
+        collection = Collection(template.bind(name=u'a'), conn, User)
+        self.assertEqual(len(collection), 4)
+        self.assertTrue(collection.exists())
+        self.assertTrue(u'AS "__counted__"' in conn.executed[0][0])
+        self.assertEqual(conn.executed[1][1], {'name': u'a'})
+        self.assertRaises(TypeError, collection.options, prefetch('x'))
+        self.assertRaises(TypeError, collection.page, 10)
+        self.assertRaises(TypeError, collection.aggregate, max=User.age)
+
+
+class ColumnarExportTest(TestCase):
+
+    @staticmethod
+    def connection():
+        rows = [(i, u'user%d' % i, i * 2 if i != 3 else None)
+                for i in range(5)]
+        return FakeConnection(lambda sql, params:
+                              ((('id', 23), ('name', 25), ('age', 23)), rows))
+
+    def test_to_columns(self):
+        collection = User.load_by(self.connection())
+        collection.itersize = 2
+        columns = collection.to_columns(use_numpy=False)
+        self.assertEqual(columns.keys(), ['id', 'name', 'age'])
+        self.assertEqual(columns['id'], array('i', range(5)))
+        self.assertEqual(columns['name'], [u'user%d' % i for i in range(5)])
+        self.assertEqual(columns['age'], [0, 2, 4, None, 8])
+        self.assertFalse(collection.started)
+
+    def test_iter_columns(self):
+        batches = list(User.load_by(self.connection()).
+                       iter_columns(2, use_numpy=False))
+        self.assertEqual([len(x['id']) for x in batches], [2, 2, 1])
+        self.assertEqual(batches[1]['age'], [4, None])
+        self.assertEqual(batches[2]['age'], array('i', [8]))
+
+
+class Document(BaseDAO):
+    __table__ = 'documents'
+    title = Field()
+    body = Field()
+
+
+class CompactDocument(BaseDAO):
+    __table__ = 'documents'
+    __compact__ = True
+    title = Field()
+    body = Field()
+
+
+class ProjectionTest(TestCase):
+
+    @staticmethod
+    def responder(sql, params):
+        if u'ANY(%(keys)s)' in sql:
+            return ('id', 'body'), [(x, u'body%d' % x) for x in params['keys']]
+        if sql.lstrip().startswith(u'UPDATE'):
+            return ('id', 'title'), [(params['__primary__'], params['title'])]
+        return ('id', 'title'), [(i, u'title%d' % i) for i in range(3)]
+
+    def test_only_and_defer_narrow_fields(self):
+        for option in (only('title'), defer('body')):
+            collection = Document.load_by(None, option)
+            self.assertEqual(collection.query.clauses['fields'].keys(),
+                             [u'"documents"."id"', u'"documents"."title"'])
+            self.assertEqual(collection.deferred, frozenset(['body']))
+        self.assertRaises(ValueError, Document.load_by, None, only('nope'))
+
+    def test_deferred_loaded_per_batch(self):
+        for cls in (Document, CompactDocument):
+            conn = FakeConnection(self.responder)
+            documents = list(cls.load_by(conn, defer('body')))
+            self.assertEqual(documents[0].deferred_fields(),
+                             frozenset(['body']))
+            self.assertEqual(len(conn.executed), 1)
+            self.assertEqual([x.body for x in documents],
+                             [u'body0', u'body1', u'body2'])
+            self.assertEqual(len(conn.executed), 2)
+            self.assertEqual(conn.executed[1][1], {'keys': [0, 1, 2]})
+            self.assertEqual(documents[2].deferred_fields(), frozenset())
+
+    def test_save_leaves_deferred_alone(self):
+        conn = FakeConnection(self.responder)
+        document = Document.load_by(conn, only('title')).first()
+        document.title = u'new'
+        document.__changed__.add('title')
+        document.save()
+        sql, params = conn.executed[-1]
+        self.assertFalse(u'body' in sql)
+        self.assertEqual(sorted(params), ['__primary__', 'title'])
+        self.assertEqual(document.deferred_fields(), frozenset(['body']))
+
+    def test_loading_keeps_assignments(self):
+        def responder(sql, params):
+            if u'ANY(%(keys)s)' in sql:
+                return ('id', 'body', 'title'), [(0, u'db-body', u'db-title')]
+            return ('id',), [(0,)]
+        conn = FakeConnection(responder)
+        document = Document.load_by(conn, only('id')).first()
+        document.title = u'new'
+        self.assertEqual(document.body, u'db-body')
+        self.assertEqual(document.title, u'new')
+        self.assertEqual(document.__changed__, set(['title']))
+
+
+class ChangeTrackingTest(TestCase):
+
+    @staticmethod
+    def responder(sql, params):
+        names = sorted(x for x in params if x != '__primary__')
+        key = params.get('__primary__', 7)
+        return ['id'] + names, [[key] + [params[x] for x in names]]
+
+    @staticmethod
+    def loaded(cls, conn=None):
+        description, rows = user_rows(2)
+        return cls.from_rows([(x,) for x in description], rows, conn)[1]
+
+    def test_only_real_changes_count(self):
+        for cls in (User, CompactUser):
+            user = self.loaded(cls)
+            self.assertEqual(user.__changed__, set())
+            user.name = u'other'
+            user.age = 1
+            self.assertEqual(user.__changed__, set(['name']))
+            self.assertEqual(user.changes(), {'name': (u'user1', u'other')})
+            user.name = u'user1'
+            self.assertEqual(user.__changed__, set())
+            user.age = True
+            self.assertEqual(user.original('age'), 1)
+
+    def test_driver_types_compare_by_value(self):
+        user = User.from_rows([('id',), ('name',), ('age',)],
+                              [(1, 'caf\xc3\xa9', 5L)], None)[0]
+        user.name = u'caf\xe9'
+        user.age = 5
+        self.assertEqual(user.__changed__, set())
+        user.age = True
+        user.name = 'other'
+        self.assertEqual(user.__changed__, set(['name', 'age']))
+
+    def test_save_writes_changed_columns(self):
+        conn = FakeConnection(self.responder)
+        user = self.loaded(User, conn)
+        user.save()
+        self.assertEqual(conn.executed, [])
+        user.age = 5
+        user.id = 9
+        user.save()
+        sql, params = conn.executed[-1]
+        self.assertFalse(u'name =' in sql)
+        self.assertEqual(params, {'__primary__': 1, 'age': 5, 'id': 9})
+        self.assertEqual((user.__changed__, user.original('id')),
+                         (set(), 9))
+        user.save()
+        self.assertEqual(len(conn.executed), 1)
+
+    def test_insert_writes_assigned_fields(self):
+        conn = FakeConnection(self.responder)
+        user = User(__conn__=conn, name=u'ann')
+        user.save()
+        sql, params = conn.executed[-1]
+        self.assertTrue(sql.startswith(u'INSERT'))
+        self.assertEqual(params, {'name': u'ann'})
+        User(__conn__=conn).save()
+        self.assertTrue(u'(id) VALUES (DEFAULT)' in conn.executed[-1][0])
+        User(__conn__=conn, id=None, name=u'bob').save()
+        self.assertEqual(conn.executed[-1][1], {'name': u'bob'})
+
+    def test_snapshot_and_diff(self):
+        class Tagged(BaseDAO):
+            __table__ = 'tagged'
+            tags = Field()
+        obj = Tagged(id=1, tags=[u'a'])
+        snapshot = obj.snapshot()
+        obj.tags.append(u'b')
+        self.assertEqual(obj.__changed__, set())
+        self.assertEqual(obj.diff(snapshot),
+                         {'tags': ([u'a'], [u'a', u'b'])})
+        obj.mark_changed(*obj.diff(snapshot))
+        self.assertEqual(obj.__changed__, set(['tags']))
+        self.assertRaises(ValueError, obj.mark_changed, 'nope')
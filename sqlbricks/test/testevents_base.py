@@ -0,0 +1,68 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+
+from sqlbricks.base import events
+from sqlbricks.test.fakedb import FakeConnection
+from sqlbricks.test.testdao_postgresql import User, user_rows
+
+class EventsTest(TestCase):
+
+    def setUp(self):
+        self.seen = []
+        events.register(self.seen.append)
+
+    def tearDown(self):
+        events.unregister(self.seen.append)
+
+    def test_collection_events(self):
+        conn = FakeConnection([user_rows(3)])
+        list(User.load_by(conn, age=1).stream())
+        names = [x.name for x in self.seen]
+        self.assertEqual(names, ['render', 'before_execute', 'after_execute',
+                                 'rows_fetched', 'hydrate_start',
+                                 'hydrate_end'])
+        after = self.seen[2]
+        self.assertEqual((after.parameters, after.dao, after.rows),
+                         (1, User, 3))
+        self.assertTrue(after.duration >= 0)
+        self.assertEqual(self.seen[5].rows, 3)
+
+    def test_errors_are_reported(self):
+        class Failing(object):
+            def execute(self, sql, params):
+                raise ValueError(sql)
+        statement = User.load_by(None).query
+        self.assertRaises(ValueError, events.execute, Failing(), statement)
+        self.assertTrue(isinstance(self.seen[-1].error, ValueError))
+
+    def test_membership_event(self):
+        User.id.in_(range(50))
+        event = self.seen[-1]
+        self.assertEqual((event.name, event.rows, event.extra),
+                         ('membership', 50,
+                          {'strategy': 'array', 'negated': False}))
+
+
+class StatementCollectorTest(TestCase):
+
+    def test_fingerprint(self):
+        self.assertEqual(events.fingerprint(u"SELECT  a\n FROM t "
+                                            u"WHERE b = 'it''s' AND c = 12"),
+                         u"SELECT a FROM t WHERE b = ? AND c = ?")
+
+    def test_percentiles(self):
+        collector = events.StatementCollector()
+        for i in range(100):
+            collector(events.Event('after_execute', sql=u'SELECT %d' % i,
+                                   duration=float(i)))
+        collector(events.Event('before_execute', sql=u'SELECT 1'))
+        report = collector.report()
+        self.assertEqual(report.keys(), [u'SELECT ?'])
+        stats = report[u'SELECT ?']
+        self.assertEqual((stats['count'], stats['p50'], stats['p99'],
+                          stats['max']), (100, 50.0, 98.0, 99.0))
@@ -0,0 +1,104 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+
+from sqlbricks.postgresql import aio
+from sqlbricks.postgresql.dao import BaseDAO, Field
+from sqlbricks.postgresql.loader import BatchLoader
+from sqlbricks.postgresql.session import Session
+from sqlbricks.test.fakedb import FakeConnection
+
+class Account(BaseDAO):
+    __table__ = 'accounts'
+    name = Field()
+
+
+def accounts(sql, params):
+    return ('id', 'name'), [(x, u'account%d' % x) for x in params['keys']
+                            if x < 100]
+
+
+class BatchLoaderTest(TestCase):
+
+    def test_keys_are_coalesced(self):
+        conn = FakeConnection(accounts)
+        loader = BatchLoader(Account, conn)
+        futures = loader.load_many([3, 1, 3, 200])
+        self.assertEqual(conn.executed, [])
+        self.assertEqual(futures[0].result().name, u'account3')
+        sql, params = conn.executed[0]
+        self.assertTrue(u'"accounts"."id" = ANY(%(keys)s)' in sql)
+        self.assertEqual(params['keys'], [3, 1, 200])
+        self.assertTrue(futures[2].result() is futures[0].result())
+        self.assertEqual(futures[3].result(), None)
+        self.assertEqual(len(conn.executed), 1)
+        self.assertEqual(loader.stats(), {'requests': 4, 'batches': 1,
+                                          'queries': 1, 'keys': 3,
+                                          'pending': 0})
+
+    def test_chunks(self):
+        conn = FakeConnection(accounts)
+        loader = BatchLoader(Account, conn, chunk_size=2)
+        futures = loader.load_many(range(5))
+        self.assertEqual(loader.dispatch(), 5)
+        self.assertEqual([x[1]['keys'] for x in conn.executed],
+                         [[0, 1], [2, 3], [4]])
+        self.assertEqual([x.result().id for x in futures], range(5))
+
+    def test_identity_map(self):
+        session = Session(FakeConnection(accounts))
+        loader = BatchLoader(Account, session)
+        first = loader.load(1).result()
+        self.assertTrue(loader.load(1).result() is first)
+        self.assertEqual(len(session.connection.executed), 1)
+
+    def test_window(self):
+        conn = FakeConnection(accounts)
+        loader = BatchLoader(Account, conn, window=0.01)
+        futures = loader.load_many([1, 2])
+        self.assertEqual([x.result(timeout=5).id for x in futures], [1, 2])
+        self.assertEqual(len(conn.executed), 1)
+
+    def test_scheduled_with_other_futures(self):
+        calls = []
+        conn = FakeConnection(accounts)
+        loader = BatchLoader(Account, conn, schedule=calls.append,
+                             future=aio.Future)
+        futures = loader.load_many([1, 2])
+        self.assertEqual((len(calls), futures[0].done()), (1, False))
+        calls[0]()
+        self.assertEqual([x.result().id for x in futures], [1, 2])
+
+    def test_executor_and_delivery(self):
+        submitted = []
+        delivered = []
+        class Executor(object):
+            @staticmethod
+            def submit(func, *args):
+                submitted.append((func, args))
+        conn = FakeConnection(accounts)
+        loader = BatchLoader(Account, conn, schedule=lambda func: None,
+                             future=aio.Future, executor=Executor(),
+                             deliver=lambda *args: delivered.append(args))
+        futures = loader.load_many([1, 2])
+        self.assertEqual(loader.dispatch(), 2)
+        self.assertEqual(conn.executed, [])
+        func, args = submitted[0]
+        func(*args)
+        self.assertEqual((len(conn.executed), futures[0].done()),
+                         (1, False))
+        delivered[0][0](*delivered[0][1:])
+        self.assertEqual([x.result().id for x in futures], [1, 2])
+
+    def test_errors_reach_every_caller(self):
+        def failing(sql, params):
+            raise RuntimeError("down")
+        loader = BatchLoader(Account, FakeConnection(failing))
+        futures = loader.load_many([1, 2])
+        loader.dispatch()
+        for future in futures:
+            self.assertRaises(RuntimeError, future.result)
@@ -0,0 +1,126 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+import threading
+
+from sqlbricks.postgresql.dao import prefetch
+from sqlbricks.postgresql.pool import ConnectionPool, PoolTimeout
+from sqlbricks.test.fakedb import FakeConnection
+from sqlbricks.test.testdao_postgresql import User, Author, user_rows, \
+    users_by_id
+
+class ConnectionPoolTest(TestCase):
+
+    def test_min_size_and_reuse(self):
+        made = []
+        def factory():
+            made.append(FakeConnection())
+            return made[-1]
+        pool = ConnectionPool(factory, minsize=2, maxsize=3)
+        self.assertEqual(len(made), 2)
+        with pool.connection() as conn:
+            self.assertTrue(conn is made[0])
+            self.assertEqual(pool.stats()['in_use'], 1)
+        self.assertEqual(made[0].commits, 1)
+        stats = pool.stats()
+        self.assertEqual((stats['size'], stats['idle'], stats['checkouts']),
+                         (2, 2, 1))
+
+    def test_rollback_on_error(self):
+        conn = FakeConnection()
+        pool = ConnectionPool(lambda: conn, minsize=1, maxsize=1)
+        try:
+            with pool.connection():
+                raise KeyError('x')
+        except KeyError:
+            pass
+        self.assertEqual((conn.commits, conn.rollbacks), (0, 1))
+
+    def test_timeout(self):
+        pool = ConnectionPool(FakeConnection, minsize=0, maxsize=1,
+                              timeout=0.01)
+        held = pool.getconn()
+        self.assertRaises(PoolTimeout, pool.getconn)
+        self.assertEqual(pool.stats()['timeouts'], 1)
+        pool.putconn(held)
+        self.assertTrue(pool.getconn() is held)
+
+    def test_waiter_is_woken(self):
+        pool = ConnectionPool(FakeConnection, minsize=1, maxsize=1,
+                              timeout=5)
+        held = pool.getconn()
+        got = []
+        waiter = threading.Thread(target=lambda: got.append(pool.getconn()))
+        waiter.start()
+        pool.putconn(held)
+        waiter.join(5)
+        self.assertEqual(got, [held])
+
+    def test_health_check_replaces_closed(self):
+        pool = ConnectionPool(FakeConnection, minsize=1, maxsize=1)
+        broken = pool.getconn()
+        pool.putconn(broken)
+        broken.closed = True
+        fresh = pool.getconn()
+        self.assertFalse(fresh is broken)
+        self.assertEqual(pool.stats()['discarded'], 1)
+
+    def test_transaction_pins_connection(self):
+        pool = ConnectionPool(lambda: FakeConnection(users_by_id),
+                              minsize=0, maxsize=2)
+        with pool.transaction() as conn:
+            User.load_by_primary(pool, 1)
+            User.load_by_primary(pool, 2)
+            self.assertEqual(len(conn.executed), 2)
+            self.assertEqual(conn.commits, 0)
+        self.assertEqual(conn.commits, 1)
+        self.assertEqual(pool.stats()['size'], 1)
+
+
+class PooledDAOTest(TestCase):
+
+    def test_collection_returns_connection(self):
+        conn = FakeConnection([user_rows(3)])
+        pool = ConnectionPool(lambda: conn, minsize=1, maxsize=1)
+        users = list(User.load_by(pool))
+        self.assertEqual(len(users), 3)
+        self.assertTrue(users[0].__connection__ is pool)
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_leaving_early_returns_connection(self):
+        conn = FakeConnection(lambda sql, params: user_rows(3))
+        pool = ConnectionPool(lambda: conn, minsize=1, maxsize=1)
+        with User.load_by(pool) as users:
+            for _ in users:
+                break
+        self.assertEqual(pool.stats()['in_use'], 0)
+        for _ in User.load_by(pool).batches(1):
+            break
+        self.assertEqual(pool.stats()['in_use'], 0)
+        collection = iter(User.load_by(pool))
+        next(collection)
+        del collection
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_prefetch_reuses_connection(self):
+        conn = FakeConnection([
+            (('id', 'name'), [(1, u'ann')]),
+            (('author_id', 'id', 'title', '__key__'), [(1, 10, u'a', 1)]),
+        ])
+        pool = ConnectionPool(lambda: conn, minsize=1, maxsize=1,
+                              timeout=0.01)
+        authors = list(Author.load_by(pool, prefetch('articles')))
+        self.assertEqual([x.id for x in authors[0].articles], [10])
+        self.assertEqual(pool.stats()['in_use'], 0)
+
+    def test_save_checks_out(self):
+        conn = FakeConnection(users_by_id)
+        pool = ConnectionPool(lambda: conn, minsize=1, maxsize=1)
+        user = User.load_by_primary(pool, 4)
+        user.delete()
+        self.assertEqual(conn.commits, 2)
+        self.assertEqual(pool.stats()['in_use'], 0)
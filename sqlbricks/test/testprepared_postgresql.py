@@ -0,0 +1,88 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from unittest import TestCase
+
+from sqlbricks.postgresql import prepared
+from sqlbricks.postgresql.dao import BaseDAO, Field
+from sqlbricks.test.fakedb import FakeConnection
+
+class Account(BaseDAO):
+    __table__ = 'accounts'
+    name = Field()
+
+
+def accounts(sql, params):
+    if sql.startswith((u'PREPARE', u'DEALLOCATE', u'SAVEPOINT', u'RELEASE',
+                       u'ROLLBACK')):
+        return None
+    return ('id', 'name'), [(params['id'], u'account')]
+
+
+class PreparedStatementsTest(TestCase):
+
+    def test_convert(self):
+        text, order = prepared.PreparedStatements.convert(
+            u'SELECT a %% 2 FROM t WHERE a = %(a)s AND b = %(b)s '
+            u'OR b > %(a)s')
+        self.assertEqual(text, u'SELECT a % 2 FROM t WHERE a = $1 '
+                         u'AND b = $2 OR b > $1')
+        self.assertEqual(order, [u'a', u'b'])
+
+    def test_promoted_after_threshold(self):
+        conn = prepared.enable(FakeConnection(accounts), threshold=3)
+        for i in range(5):
+            self.assertEqual(Account.load_by_primary(conn, i).id, i)
+        sqls = [x[0] for x in conn.executed if u'SAVEPOINT' not in x[0]]
+        self.assertTrue(sqls[0].startswith(u'SELECT'))
+        self.assertTrue(sqls[1].startswith(u'SELECT'))
+        self.assertTrue(sqls[2].startswith(u'PREPARE sqlbricks_p'))
+        self.assertTrue(u'WHERE (id = $1)' in sqls[2])
+        name = sqls[2].split()[1]
+        self.assertEqual(sqls[3:], [u'EXECUTE {0} (%(id)s)'.format(name)] * 3)
+        self.assertEqual(conn.executed[-1][1], {'id': 4})
+        stats = prepared.registry(conn).stats()
+        self.assertEqual((stats['prepared'], stats['prepares'],
+                          stats['executions']), (1, 1, 3))
+
+    def test_eviction_deallocates(self):
+        conn = prepared.enable(FakeConnection(accounts), maxsize=1,
+                               threshold=1)
+        Account.load_by_primary(conn, 1)
+        Account.load_by(conn, name=u'x', id=2).first()
+        sqls = [x[0] for x in conn.executed if u'SAVEPOINT' not in x[0]]
+        first = sqls[0].split()[1]
+        self.assertEqual(sqls[3], u'DEALLOCATE {0}'.format(first))
+        self.assertEqual(prepared.registry(conn).stats()['deallocations'], 1)
+
+    def test_disabled_by_default(self):
+        conn = FakeConnection(accounts)
+        for i in range(10):
+            Account.load_by_primary(conn, i)
+        self.assertTrue(all(x[0].startswith(u'SELECT')
+                            for x in conn.executed))
+        self.assertTrue(prepared.registry(conn) is None)
+
+    def test_failed_prepare_runs_unprepared(self):
+        def refusing(sql, params):
+            if sql.startswith(u'PREPARE'):
+                raise ValueError("could not determine polymorphic type")
+            return accounts(sql, params)
+        conn = prepared.enable(FakeConnection(refusing), threshold=2)
+        for i in range(4):
+            self.assertEqual(Account.load_by_primary(conn, i).id, i)
+        sqls = [x[0].split()[0] for x in conn.executed]
+        self.assertEqual(sqls, [u'SELECT', u'SAVEPOINT', u'PREPARE',
+                                u'ROLLBACK', u'RELEASE', u'SELECT',
+                                u'SELECT', u'SELECT'])
+        stats = prepared.registry(conn).stats()
+        self.assertEqual((stats['prepares'], stats['failures']), (0, 1))
+
+    def test_autocommit_prepares_without_savepoint(self):
+        conn = prepared.enable(FakeConnection(accounts), threshold=1)
+        conn.autocommit = True
+        Account.load_by_primary(conn, 1)
+        self.assertTrue(conn.executed[0][0].startswith(u'PREPARE'))
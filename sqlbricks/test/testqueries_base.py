@@ -6,4 +6,147 @@ Created on 16 Mar 2013
 
 from unittest import TestCase
 
-        
\ No newline at end of file
+from sqlbricks.base.cache import LRUCache
+from sqlbricks.base.sql import BaseQuery, Template, _FieldListMixin, \
+    _WhereMixin
+from sqlbricks.test.fakedb import FakeConnection
+
+class _Query(BaseQuery, _FieldListMixin, _WhereMixin):
+    renders = 0
+
+    def render(self):
+        _Query.renders += 1
+        return u'SELECT {0} {1}'.format(self.format_fields(),
+                                        self.format_where()).strip()
+
+
+class LRUCacheTest(TestCase):
+
+    def test_eviction_order(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        evicted = cache.put('c', 3)
+        self.assertEqual(evicted, [('b', 2)])
+        self.assertFalse('b' in cache)
+        self.assertEqual(len(cache), 2)
+
+    def test_stats(self):
+        cache = LRUCache(maxsize=2)
+        cache.put('a', 1)
+        cache.get('a')
+        cache.get('z')
+        stats = cache.stats()
+        self.assertEqual(stats['hits'], 1)
+        self.assertEqual(stats['misses'], 1)
+        self.assertEqual(stats['size'], 1)
+
+
+class CompiledQueryTest(TestCase):
+
+    def setUp(self):
+        _Query.renders = 0
+
+    def test_compiled_text_is_kept(self):
+        query = _Query()
+        query.add_fields('a', 'b')
+        self.assertEqual(unicode(query), u'SELECT a, b')
+        unicode(query)
+        self.assertEqual(_Query.renders, 1)
+
+    def test_add_invalidates(self):
+        query = _Query()
+        query.add_fields('a')
+        unicode(query)
+        query.add_where('a = 1')
+        self.assertEqual(unicode(query), u'SELECT a WHERE (a = 1)')
+        self.assertEqual(_Query.renders, 2)
+
+
+class TemplateTest(TestCase):
+
+    def setUp(self):
+        query = _Query()
+        query.add_fields('a')
+        query.add_where('a = %(a)s', 'b = %(b)s')
+        query.bound_parameters['b'] = 2
+        self.template = query.freeze()
+
+    def test_frozen(self):
+        self.assertEqual(self.template.names, frozenset(['a', 'b']))
+        self.assertRaises(AttributeError, setattr, self.template, 'sql', u'')
+        self.assertRaises(KeyError, self.template.bind)
+        bound = self.template.bind(a=1)
+        self.assertEqual(unicode(bound), self.template.sql)
+        self.assertEqual(bound.bound_parameters, {'a': 1, 'b': 2})
+
+    def test_execute(self):
+        conn = FakeConnection()
+        self.template.execute(conn.cursor(), {'a': 1, 'b': 3})
+        self.assertEqual(conn.executed,
+                         [(u'SELECT a WHERE (a = %(a)s) AND (b = %(b)s)',
+                           {'a': 1, 'b': 3})])
+
+    def test_executemany_and_chunks(self):
+        conn = FakeConnection()
+        cur = conn.cursor()
+        self.template.executemany(cur, [{'a': 1}, {'a': 2}])
+        self.assertEqual(self.template.execute_chunks(
+            cur, ({'a': x} for x in range(5)), size=2), 5)
+        self.assertEqual([x[1]['a'] for x in conn.executed],
+                         [1, 2, 0, 1, 2, 3, 4])
+        self.assertTrue(all(x[1]['b'] == 2 for x in conn.executed))
+
+    def test_without_placeholders(self):
+        template = Template(u'SELECT 1')
+        self.assertEqual(template.bind().bound_parameters, {})
+
+    def test_parameters_are_copied(self):
+        self.template.defaults['b'] = 5
+        self.assertEqual(self.template.bind(a=1).bound_parameters['b'], 2)
+        params = {'a': 1, 'b': 3}
+        template = Template(u'SELECT %(a)s, %(b)s')
+        template.bind(params).bound_parameters['a'] = 9
+        self.assertEqual(params, {'a': 1, 'b': 3})
+
+
+class PersistentQueryTest(TestCase):
+
+    def setUp(self):
+        self.base = _Query().persistent().add_fields('a', 'b').\
+            add_where('active')
+
+    def test_add_returns_derived_query(self):
+        derived = self.base.add_where('a = %(a)s')
+        self.assertFalse(derived is self.base)
+        self.assertEqual(unicode(self.base), u'SELECT a, b WHERE (active)')
+        self.assertEqual(unicode(derived),
+                         u'SELECT a, b WHERE (active) AND (a = %(a)s)')
+
+    def test_unchanged_clauses_are_shared(self):
+        first = self.base.add_where('a = 1')
+        second = self.base.add_where('a = 2')
+        self.assertTrue(first.clauses['fields'] is self.base.clauses['fields'])
+        self.assertFalse(first.clauses['where'] is self.base.clauses['where'])
+        self.assertEqual(len(self.base.clauses['where']), 1)
+        self.assertEqual(unicode(second), u'SELECT a, b WHERE (active) '
+                         u'AND (a = 2)')
+
+    def test_fragments_are_reused(self):
+        unicode(self.base)
+        entry = self.base._fragments[('format_fields',)]
+        self.assertEqual(entry[1], u'a, b')
+        for value in range(3):
+            derived = self.base.add_where('a = {0}'.format(value))
+            unicode(derived)
+            self.assertTrue(derived._fragments is self.base._fragments)
+        self.assertTrue(self.base._fragments[('format_fields',)] is entry)
+
+    def test_mutable(self):
+        query = self.base.mutable()
+        self.assertTrue(query.__class__ is _Query)
+        self.assertFalse(query._persistent)
+        self.assertEqual(query.add_where('b'), None)
+        self.assertEqual(len(query.clauses['where']), 2)
+        self.assertEqual(len(self.base.clauses['where']), 1)
@@ -0,0 +1,165 @@
+'''
+Created on 18 Oct 2026
+
+@author: jafd
+'''
+
+from decimal import Decimal
+from unittest import TestCase
+from uuid import UUID
+
+from sqlbricks.postgresql.sql import Insert, Literal, Select
+
+class InsertTest(TestCase):
+
+    def test_multi_row(self):
+        statement = Insert('users')
+        statement.add_rows({'name': 'a', 'age': 1},
+                           {'name': 'b', 'age': Literal('DEFAULT')})
+        statement.add_returning('id')
+        self.assertEqual(u' '.join(unicode(statement).split()),
+                         u'INSERT INTO users (age, name) VALUES '
+                         u'(%(age_0)s, %(name_0)s), (DEFAULT, %(name_1)s) '
+                         u'RETURNING id')
+        self.assertEqual(statement.bound_parameters,
+                         {'age_0': 1, 'name_0': 'a', 'name_1': 'b'})
+
+    def test_adding_rows_renders_again(self):
+        statement = Insert('users')
+        statement.add_rows({'name': 'a'})
+        first = unicode(statement)
+        self.assertTrue(unicode(statement) is first)
+        statement.add_rows({'name': 'b'})
+        self.assertTrue(u'(%(name_0)s), (%(name_1)s)' in unicode(statement))
+
+    def test_rows_must_match(self):
+        statement = Insert('users')
+        self.assertRaises(ValueError, statement.add_rows,
+                          {'name': 'a'}, {'age': 1})
+
+    def test_split(self):
+        statement = Insert('users')
+        statement.add_rows(*[{'name': x, 'age': x} for x in range(5)])
+        statement.add_returning('id')
+        chunks = statement.split(max_parameters=4)
+        self.assertEqual([len(x.rows) for x in chunks], [2, 2, 1])
+        for chunk in chunks:
+            self.assertTrue(len(chunk.bound_parameters) <= 4)
+            self.assertTrue(u'RETURNING id' in unicode(chunk))
+        self.assertEqual(chunks[2].bound_parameters,
+                         {'name_0': 4, 'age_0': 4})
+        self.assertEqual(statement.split(), [statement])
+
+    def test_split_mixed_rows(self):
+        statement = Insert('users')
+        statement.add_rows({'name': 'a', 'age': Literal('DEFAULT')},
+                           *[{'name': x, 'age': x} for x in range(3)])
+        self.assertEqual(statement.parameters_per_row(), 2)
+        chunks = statement.split(max_parameters=3)
+        self.assertEqual([len(x.rows) for x in chunks], [2, 1, 1])
+        for chunk in chunks:
+            self.assertTrue(len(chunk.bound_parameters) <= 3)
+
+
+class SeekTest(TestCase):
+
+    def test_row_value_comparison(self):
+        statement = Select()
+        statement.add_fields('a', 'b')
+        statement.add_from('t')
+        statement.add_order('a', 'b')
+        statement.add_seek([1, 2])
+        self.assertTrue(u'WHERE ((a, b) > (%(seek_0)s, %(seek_1)s))' in
+                        unicode(statement))
+        self.assertEqual(statement.bound_parameters,
+                         {'seek_0': 1, 'seek_1': 2})
+        self.assertTrue(unicode(statement).endswith(u'ORDER BY a ASC, b ASC'))
+
+    def test_descending_and_mixed(self):
+        statement = Select()
+        statement.add_order(('a', 'DESC'), ('b', 'desc'))
+        statement.add_seek([1, 2])
+        self.assertTrue(u'((a, b) < (%(seek_0)s, %(seek_1)s))' in
+                        unicode(statement))
+        statement = Select()
+        statement.add_order(('a', 'DESC'), 'b')
+        statement.add_seek([1, 2])
+        self.assertTrue(u'((a < %(seek_0)s) OR (a = %(seek_0)s AND '
+                        u'b > %(seek_1)s))' in unicode(statement))
+
+    def test_token(self):
+        token = Select.seek_token([1, u'x'])
+        statement = Select()
+        statement.add_order('a', 'b')
+        statement.add_seek(token=token)
+        self.assertEqual(statement.bound_parameters,
+                         {'seek_0': 1, 'seek_1': u'x'})
+        self.assertRaises(ValueError, Select().add_seek, [1])
+
+    def test_token_types(self):
+        values = [Decimal('2.50'), UUID(int=7), {'__uuid__': 1}]
+        decoded = Select.decode_seek_token(Select.seek_token(values))
+        self.assertEqual(decoded, values)
+        self.assertEqual([x.__class__ for x in decoded],
+                         [Decimal, UUID, dict])
+        self.assertEqual(unicode(decoded[0]), u'2.50')
+        self.assertRaises(TypeError, Select.seek_token, [object()])
+
+
+class OnConflictTest(TestCase):
+
+    def test_do_nothing(self):
+        statement = Insert('users')
+        statement.add_values(name='a')
+        statement.add_on_conflict()
+        self.assertEqual(u' '.join(unicode(statement).split()),
+                         u'INSERT INTO users (name) VALUES (%(name)s) '
+                         u'ON CONFLICT DO NOTHING')
+
+    def test_do_update(self):
+        statement = Insert('users')
+        statement.add_rows({'email': 'a', 'age': 1}, {'email': 'b', 'age': 2})
+        statement.add_on_conflict('email', update=['age'],
+                                  where=u'users.age < EXCLUDED.age')
+        statement.add_returning('id')
+        self.assertEqual(u' '.join(unicode(statement).split()),
+                         u'INSERT INTO users (age, email) VALUES '
+                         u'(%(age_0)s, %(email_0)s), (%(age_1)s, %(email_1)s) '
+                         u'ON CONFLICT (email) DO UPDATE SET '
+                         u'age = EXCLUDED.age WHERE users.age < EXCLUDED.age '
+                         u'RETURNING id')
+
+    def test_constraint_and_values(self):
+        statement = Insert('users')
+        statement.add_values(email='a')
+        statement.add_on_conflict(constraint='users_email_key',
+                                  update={'hits': Literal('users.hits + 1'),
+                                          'seen': 'now'})
+        self.assertTrue(u'ON CONFLICT ON CONSTRAINT users_email_key '
+                        u'DO UPDATE SET hits = users.hits + 1, '
+                        u'seen = %(conflict_seen)s' in unicode(statement))
+        self.assertEqual(statement.bound_parameters['conflict_seen'], 'now')
+        self.assertRaises(ValueError, statement.add_on_conflict,
+                          update=['hits'])
+
+    def test_split_keeps_conflict(self):
+        statement = Insert('users')
+        statement.add_rows(*[{'email': x} for x in range(5)])
+        statement.add_on_conflict('email', update={'seen': 'now'})
+        chunks = statement.split(max_parameters=3)
+        self.assertEqual([len(x.rows) for x in chunks], [2, 2, 1])
+        for chunk in chunks:
+            self.assertTrue(u'ON CONFLICT (email)' in unicode(chunk))
+            self.assertEqual(chunk.bound_parameters['conflict_seen'], 'now')
+            self.assertTrue(len(chunk.bound_parameters) <= 3)
+
+
+class PersistentInsertTest(TestCase):
+
+    def test_rows_are_not_shared(self):
+        base = Insert('users').persistent().add_rows({'name': 'a'})
+        derived = base.add_rows({'name': 'b'})
+        self.assertEqual(len(base.rows), 1)
+        self.assertEqual(len(derived.rows), 2)
+        self.assertEqual(base.bound_parameters, {'name_0': 'a'})
+        self.assertTrue(u'(%(name_0)s), (%(name_1)s)' in unicode(derived))